@@ -0,0 +1,626 @@
+"""Prueba de carga offline del cog de música: sin YouTube ni Discord.
+
+Uso:
+    python bench/load_test.py [--guilds 10] [--duration 60] [--output resultados.json]
+
+Se sustituyen las piezas externas por dobles locales:
+- un YoutubeDL falso (vía el `factory` de YtdlPool) con latencia y tasa de fallos configurables;
+- un cliente de voz falso que consume los frames a tiempo real, como el reproductor de Pycord;
+- un archivo de audio generado con ffmpeg y servido por HTTP local en lugar de googlevideo.
+
+Cada servidor simulado hace /play (búsquedas y playlists), /skip y /seek contra `Musica`
+directamente. El resultado es un JSON con latencias de transición, CPU por stream, memoria
+por servidor y saturación del planificador de yt-dlp, pensado para comparar versiones.
+"""
+import argparse
+import asyncio
+import functools
+import http.server
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows no tiene getrusage: la CPU de ffmpeg (proceso hijo) no se puede medir desde aquí.
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+
+# ----------------------------
+# Extractor falso
+# ----------------------------
+class FakeYoutubeDL:
+    """Responde como yt-dlp tras una espera simulada; la configuración la fija el arnés."""
+
+    config = None
+    calls = {}
+    lock = threading.Lock()
+
+    def __init__(self, params):
+        self.params = params
+
+    @classmethod
+    def count(cls, kind):
+        with cls.lock:
+            cls.calls[kind] = cls.calls.get(kind, 0) + 1
+
+    def extract_info(self, query, download=False):
+        from yt_dlp.utils import DownloadError
+
+        config = self.config
+        rng = random.Random()
+        time.sleep(max(0.0, rng.gauss(config["latency"], config["jitter"])))
+
+        if self.params.get("extract_flat") or "list=" in query:
+            self.count("playlist")
+            playlist_id = query.rsplit("list=", 1)[-1]
+            return {
+                "title": f"Playlist {playlist_id}",
+                "entries": [
+                    {
+                        "url": f"https://www.youtube.com/watch?v={playlist_id[-5:]}{index:06d}",
+                        "title": f"Tema {index} de {playlist_id}",
+                        "duration": config["track_seconds"],
+                    }
+                    for index in range(config["playlist_size"])
+                ],
+            }
+
+        if query.startswith("ytsearch"):
+            self.count("search")
+            video_id = f"{abs(hash(query)) % 10**11:011d}"
+            return {
+                "entries": [
+                    {
+                        "webpage_url": f"https://www.youtube.com/watch?v={video_id}",
+                        "title": query.split(":", 1)[-1],
+                        "duration": config["track_seconds"],
+                    }
+                ]
+            }
+
+        self.count("stream")
+        roll = rng.random()
+        error = None
+        if roll < config["failure_rate"]:
+            self.count("failed_video")
+            error = f"ERROR: [youtube] {query}: Video unavailable"
+        elif roll < config["failure_rate"] + config["transient_failure_rate"]:
+            self.count("failed_transient")
+            error = f"ERROR: [youtube] {query}: HTTP Error 503: Service Unavailable"
+        if error:
+            # Como yt-dlp: con ignoreerrors el error solo se imprime y el resultado es None.
+            if self.params.get("ignoreerrors"):
+                return None
+            raise DownloadError(error)
+
+        video_id = query.rsplit("=", 1)[-1]
+        return {
+            "url": f"{config['audio_url']}?v={video_id}&expire={int(time.time()) + 6 * 3600}",
+            "acodec": "opus",
+            "ext": "webm",
+            "extractor": "fake",
+            "webpage_url": query,
+            "title": f"Vídeo {video_id}",
+            "duration": config["track_seconds"],
+        }
+
+
+# ----------------------------
+# Discord falso
+# ----------------------------
+class FakePlayer(threading.Thread):
+    """Lee la fuente a 50 frames/s como discord.player.AudioPlayer (con codificación Opus si aplica)."""
+
+    def __init__(self, source, after, encoder, counters):
+        super().__init__(daemon=True, name="fake-player")
+        self.source = source
+        self.after = after
+        self.encoder = encoder
+        self.counters = counters
+        self.stopped = threading.Event()
+        self.resumed = threading.Event()
+        self.resumed.set()
+
+    def run(self):
+        error = None
+        frames = 0
+        started = time.perf_counter()
+        try:
+            while not self.stopped.is_set():
+                if not self.resumed.is_set():
+                    self.resumed.wait()
+                    frames = 0
+                    started = time.perf_counter()
+                    continue
+                data = self.source.read()
+                if not data:
+                    break
+                if self.encoder is not None and not self.source.is_opus():
+                    self.encoder.encode(data, self.encoder.SAMPLES_PER_FRAME)
+                frames += 1
+                self.counters["frames"] += 1
+                delay = started + frames * 0.02 - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except Exception as e:
+            error = e
+        finally:
+            self.source.cleanup()
+        if self.after is not None:
+            self.after(error)
+
+    def stop(self):
+        self.stopped.set()
+        self.resumed.set()
+
+
+class FakeVoiceClient:
+    def __init__(self, guild, channel, encoder, counters):
+        self.guild = guild
+        self.channel = channel
+        self.encoder = encoder
+        self.counters = counters
+        self.source = None
+        self.player = None
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    def is_playing(self):
+        return self.player is not None and self.player.resumed.is_set()
+
+    def is_paused(self):
+        return self.player is not None and not self.player.resumed.is_set()
+
+    def play(self, source, after=None):
+        if self.player is not None:
+            raise RuntimeError("Already playing audio.")
+        self.source = source
+        player = FakePlayer(source, None, self.encoder, self.counters)
+
+        def done(error):
+            # Solo se libera el reproductor propio: tras /skip puede haber otro ya en marcha.
+            if self.player is player:
+                self.player = None
+            if after is not None:
+                after(error)
+
+        player.after = done
+        self.player = player
+        player.start()
+
+    def stop(self):
+        if self.player is not None:
+            self.player.stop()
+            self.player = None
+
+    def pause(self):
+        if self.player is not None:
+            self.player.resumed.clear()
+
+    def resume(self):
+        if self.player is not None:
+            self.player.resumed.set()
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, force=False):
+        self.stop()
+        self.connected = False
+        self.guild.voice_client = None
+
+
+class FakeObject:
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+class FakeChannel:
+    def __init__(self, channel_id, guild, encoder, counters):
+        self.id = channel_id
+        self.guild = guild
+        self.encoder = encoder
+        self.counters = counters
+
+    async def connect(self, timeout=60, reconnect=True):
+        self.guild.voice_client = FakeVoiceClient(self.guild, self, self.encoder, self.counters)
+        return self.guild.voice_client
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.voice_client = None
+
+
+class FakeBot:
+    def __init__(self, loop):
+        self.loop = loop
+        self.guilds = {}
+        self.cog = None
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(int(guild_id))
+
+    def get_channel(self, channel_id):
+        return None
+
+    def get_cog(self, name):
+        return self.cog
+
+    @property
+    def voice_clients(self):
+        return [guild.voice_client for guild in self.guilds.values() if guild.voice_client]
+
+
+class FakeFollowup:
+    async def send(self, content=None, ephemeral=False):
+        return None
+
+    async def edit_message(self, message_id=None, content=None):
+        return None
+
+
+class FakeContext:
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = FakeObject(id=guild.id * 10)
+        self.author = FakeObject(id=guild.id * 100, voice=FakeObject(channel=channel))
+        self.followup = FakeFollowup()
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    async def defer(self, ephemeral=False):
+        return None
+
+    async def respond(self, content=None, ephemeral=False):
+        return None
+
+
+# ----------------------------
+# Medidas
+# ----------------------------
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(pct):
+        return round(ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))], 4)
+
+    return {"n": len(ordered), "p50": pick(50), "p95": pick(95), "p99": pick(99), "max": round(ordered[-1], 4)}
+
+
+def rss_bytes():
+    """RSS del proceso; None si la plataforma no deja medirlo (Windows sin psutil)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    if resource is not None:
+        # Sin /proc (macOS): pico de RSS, menos preciso.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return None
+
+
+def children_cpu():
+    """CPU de los procesos hijos (ffmpeg) ya terminados; None sin getrusage (Windows)."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def phase_samples(phase_stats, kind, phase):
+    samples = []
+    for (span_kind, _, span_phase), window in phase_stats.windows.items():
+        if span_kind == kind and span_phase == phase:
+            samples.extend(window.samples)
+    return samples
+
+
+def generate_sample(path, seconds, executable):
+    subprocess.run(
+        [
+            executable, "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}:sample_rate=48000",
+            "-ac", "2", "-c:a", "libopus", "-b:a", "128k", path,
+        ],
+        check=True,
+    )
+
+
+def serve_directory(directory):
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-googlevideo").start()
+    return server
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ----------------------------
+# Simulación
+# ----------------------------
+ACTIONS = (("search", 0.35), ("playlist", 0.1), ("skip", 0.3), ("seek", 0.25))
+
+
+async def run_command(cog, command, ctx, *args):
+    await cog.cog_before_invoke(ctx)
+    await command.callback(cog, ctx, *args)
+
+
+async def guild_session(musica, cog, bot, guild_id, deadline, args, encoder, counters, command_times):
+    rng = random.Random(args.seed * 1000 + guild_id)
+    guild = bot.guilds[guild_id] = FakeGuild(guild_id)
+    channel = FakeChannel(guild_id * 7, guild, encoder, counters)
+    loop = asyncio.get_running_loop()
+
+    async def timed(name, command, *command_args):
+        started = loop.time()
+        try:
+            await run_command(cog, command, FakeContext(guild, channel), *command_args)
+        except Exception as e:
+            counters["command_errors"] += 1
+            logging.getLogger("bench").warning("Error en /%s (%s): %s", name, guild_id, e)
+        command_times.setdefault(name, []).append(loop.time() - started)
+
+    # Cada servidor arranca importando una playlist, como el uso típico del bot.
+    await timed("playlist", musica.play, f"https://www.youtube.com/playlist?list=PLbench{guild_id:05d}")
+
+    names = [name for name, _ in ACTIONS]
+    weights = [weight for _, weight in ACTIONS]
+    while loop.time() < deadline:
+        await asyncio.sleep(rng.uniform(args.min_gap, args.max_gap))
+        if loop.time() >= deadline:
+            break
+        action = rng.choices(names, weights)[0]
+        if action == "search":
+            await timed("search", musica.play, f"tema de prueba {rng.randrange(args.search_space)}")
+        elif action == "playlist":
+            await timed("playlist", musica.play, f"https://www.youtube.com/playlist?list=PLbench{rng.randrange(10**5):05d}")
+        elif action == "skip":
+            await timed("skip", musica.skip)
+        else:
+            await timed("seek", musica.seek, str(rng.randrange(max(1, args.track_seconds - 3))))
+
+    await timed("stop", musica.stop)
+
+
+async def sample_scheduler(cog, bot, stop, samples):
+    scheduler = cog.extraction_scheduler
+    while not stop.is_set():
+        samples.append(
+            (
+                scheduler.running / scheduler.workers,
+                scheduler.queue_depth(),
+                sum(1 for vc in bot.voice_clients if vc.is_playing()),
+            )
+        )
+        await asyncio.sleep(0.1)
+
+
+async def simulate(musica, args, audio_url):
+    FakeYoutubeDL.config = {
+        "latency": args.latency_ms / 1000,
+        "jitter": args.jitter_ms / 1000,
+        "failure_rate": args.failure_rate,
+        "transient_failure_rate": args.transient_failure_rate,
+        "track_seconds": args.track_seconds,
+        "playlist_size": args.playlist_size,
+        "audio_url": audio_url,
+    }
+    # El pool debe cambiarse antes de crear el cog: el planificador precalienta sus hilos con él.
+    musica.ytdl_pool = musica.YtdlPool(musica.YTDL_PROFILES, factory=FakeYoutubeDL)
+
+    encoder = None
+    if musica.PLAYBACK_MODE == "pcm":
+        try:
+            import discord
+
+            encoder = discord.opus.Encoder()
+        except Exception as e:
+            print(f"⚠️ libopus no disponible, la CPU no incluirá la codificación Opus: {e}", file=sys.stderr)
+
+    loop = asyncio.get_running_loop()
+    bot = FakeBot(loop)
+    cog = musica.Musica(bot)
+    bot.cog = cog
+    # Ventanas sin tope para que los percentiles cubran toda la prueba.
+    cog.phase_stats = musica.PhaseStats(window=1_000_000, slow_threshold=cog.phase_stats.slow_threshold)
+    await cog.on_ready()
+
+    counters = {"frames": 0, "command_errors": 0}
+    command_times = {}
+    scheduler_samples = []
+    stop_sampling = asyncio.Event()
+
+    rss_start = rss_bytes()
+    cpu_start = time.process_time()
+    children_start = children_cpu()
+    wall_start = time.perf_counter()
+    deadline = loop.time() + args.duration
+
+    sampler = loop.create_task(sample_scheduler(cog, bot, stop_sampling, scheduler_samples))
+    sessions = [
+        guild_session(musica.Musica, cog, bot, guild_id, deadline, args, encoder, counters, command_times)
+        for guild_id in range(1, args.guilds + 1)
+    ]
+    rss_peak = rss_start
+
+    async def track_rss():
+        nonlocal rss_peak
+        while rss_start is not None and not stop_sampling.is_set():
+            rss_peak = max(rss_peak, rss_bytes())
+            await asyncio.sleep(0.5)
+
+    rss_task = loop.create_task(track_rss())
+    await asyncio.gather(*sessions)
+    # Los reproductores terminan en sus hilos tras /stop; se les deja cerrar ffmpeg.
+    await asyncio.sleep(0.5)
+    stop_sampling.set()
+    await asyncio.gather(sampler, rss_task)
+
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    ffmpeg_cpu = children_cpu() - children_start if children_start is not None else None
+    # Sin la CPU de ffmpeg el total quedaría por debajo de la realidad: mejor no darlo.
+    total_cpu = cpu + ffmpeg_cpu if ffmpeg_cpu is not None else None
+    audio_seconds = counters["frames"] * 0.02
+    utilization = [sample[0] for sample in scheduler_samples]
+    depths = [sample[1] for sample in scheduler_samples]
+    streams = [sample[2] for sample in scheduler_samples]
+    avg_streams = sum(streams) / len(streams) if streams else 0.0
+    scheduler = cog.extraction_scheduler
+
+    results = {
+        "wall_seconds": round(wall, 2),
+        "audio_seconds": round(audio_seconds, 1),
+        "track_transition_seconds": {
+            "total": percentiles(phase_samples(cog.phase_stats, "transition", "total")),
+            "resolve": percentiles(phase_samples(cog.phase_stats, "transition", "resolve")),
+            "ffmpeg": percentiles(phase_samples(cog.phase_stats, "transition", "ffmpeg")),
+            "first_packet": percentiles(phase_samples(cog.phase_stats, "transition", "first_packet")),
+        },
+        "play_to_first_packet_seconds": percentiles(phase_samples(cog.phase_stats, "play", "total")),
+        "command_seconds": {name: percentiles(times) for name, times in sorted(command_times.items())},
+        "cpu": {
+            "python_seconds": round(cpu, 3),
+            "ffmpeg_seconds": round(ffmpeg_cpu, 3) if ffmpeg_cpu is not None else None,
+            "avg_concurrent_streams": round(avg_streams, 2),
+            "ms_per_audio_second": (
+                round(total_cpu * 1000 / audio_seconds, 3) if total_cpu is not None and audio_seconds else None
+            ),
+            "percent_core_per_stream": (
+                round(total_cpu / wall / avg_streams * 100, 2) if total_cpu is not None and avg_streams else None
+            ),
+        },
+        "memory": {
+            "rss_start_bytes": rss_start,
+            "rss_peak_bytes": rss_peak,
+            "per_guild_bytes": int((rss_peak - rss_start) / args.guilds) if rss_start is not None else None,
+        },
+        "executor": {
+            "workers": scheduler.workers,
+            "avg_utilization": round(sum(utilization) / len(utilization), 3) if utilization else None,
+            "saturated_fraction": round(sum(1 for u in utilization if u >= 1.0) / len(utilization), 3) if utilization else None,
+            "avg_queue_depth": round(sum(depths) / len(depths), 2) if depths else None,
+            "max_queue_depth": max(depths) if depths else None,
+            "wait_seconds": {
+                name: percentiles(list(scheduler.waits[priority])) for priority, name in musica.PRIORITY_NAMES.items()
+            },
+            "timeouts": scheduler.timeouts,
+        },
+        "extractor_calls": dict(sorted(FakeYoutubeDL.calls.items())),
+        "song_failures": dict(sorted(cog.song_failures.items())),
+        "audio_cache": cog.audio_cache.describe() if cog.audio_cache else None,
+        "command_errors": counters["command_errors"],
+        "slow_operations": cog.phase_stats.slow,
+        "event_loop": {
+            "lag_seconds": percentiles(list(cog.loop_lag.window.samples)),
+            "stalls": cog.loop_lag.stalls,
+        },
+    }
+    cog.cog_unload()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=10, help="Servidores simulados en paralelo.")
+    parser.add_argument("--duration", type=float, default=60, help="Segundos de simulación.")
+    parser.add_argument("--track-seconds", type=int, default=20, help="Duración del audio de prueba.")
+    parser.add_argument("--latency-ms", type=float, default=300, help="Latencia media del yt-dlp falso.")
+    parser.add_argument("--jitter-ms", type=float, default=100, help="Desviación de la latencia del yt-dlp falso.")
+    parser.add_argument("--failure-rate", type=float, default=0.02, help="Proporción de vídeos no disponibles.")
+    parser.add_argument("--transient-failure-rate", type=float, default=0.01, help="Proporción de errores transitorios.")
+    parser.add_argument("--playlist-size", type=int, default=25)
+    parser.add_argument("--search-space", type=int, default=200, help="Búsquedas distintas (repeticiones = aciertos de caché).")
+    parser.add_argument("--min-gap", type=float, default=2.0, help="Espera mínima entre comandos de un servidor.")
+    parser.add_argument("--max-gap", type=float, default=6.0, help="Espera máxima entre comandos de un servidor.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ffmpeg", default=os.getenv("FFMPEG_PATH") or shutil.which("ffmpeg"))
+    parser.add_argument("--output", help="Archivo JSON de salida (por defecto, stdout).")
+    parser.add_argument("--verbose", action="store_true", help="Muestra los logs del cog.")
+    args = parser.parse_args()
+
+    if not args.ffmpeg:
+        sys.exit("No se encontró ffmpeg (usa --ffmpeg o FFMPEG_PATH).")
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    tmpdir = tempfile.mkdtemp(prefix="bench-load-")
+    # El cog lee estas variables al importarse: nada de la prueba toca ./data ni otro ffmpeg.
+    os.environ["FFMPEG_PATH"] = args.ffmpeg
+    os.environ["MUSIC_DATA_DIR"] = os.path.join(tmpdir, "data")
+    os.environ.setdefault("MUSIC_METRICS_PORT", "0")
+
+    from cogs import musica  # noqa: E402
+
+    server = None
+    try:
+        generate_sample(os.path.join(tmpdir, "sample.webm"), args.track_seconds, args.ffmpeg)
+        server = serve_directory(tmpdir)
+        audio_url = f"http://127.0.0.1:{server.server_address[1]}/sample.webm"
+        results = asyncio.run(simulate(musica, args, audio_url))
+    finally:
+        if server:
+            server.shutdown()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "playback_mode": musica.PLAYBACK_MODE,
+            "timestamp": int(time.time()),
+        },
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "verbose")},
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Compara el coste de CPU por stream de los modos de reproducción de cogs/musica.py.
+
+Uso:
+    python bench/playback_cpu.py [--input audio.webm] [--seconds 60] [--volume 0.05]
+
+Sin --input se genera un WebM/Opus de prueba con ffmpeg. Cada modo lee todos los frames
+tan rápido como puede (igual que lo haría el reproductor de voz, pero sin esperar al
+tiempo real) y se reporta la CPU consumida por segundo de audio, separando el proceso
+ffmpeg (hijo) del trabajo en Python + codificación Opus del cliente.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows no tiene getrusage: la CPU de ffmpeg (proceso hijo) no se puede medir desde aquí.
+    resource = None
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import discord  # noqa: E402
+
+from cogs.musica import FFMPEG_EXECUTABLE, OPUS_BITRATE  # noqa: E402
+
+
+def generate_sample(path, seconds, executable):
+    subprocess.run(
+        [
+            executable, "-y", "-loglevel", "error",
+            "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}:sample_rate=48000",
+            "-ac", "2", "-c:a", "libopus", "-b:a", "128k", path,
+        ],
+        check=True,
+    )
+
+
+def children_cpu():
+    """CPU de los procesos hijos (ffmpeg) ya terminados; None sin getrusage (Windows)."""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def load_encoder():
+    try:
+        return discord.opus.Encoder()
+    except Exception as e:
+        print(f"⚠️ libopus no disponible, el modo pcm no incluirá la codificación: {e}", file=sys.stderr)
+        return None
+
+
+def run_mode(name, source, encoder=None):
+    python_start = time.process_time()
+    children_start = children_cpu()
+    wall_start = time.perf_counter()
+    frames = 0
+
+    try:
+        while True:
+            data = source.read()
+            if not data:
+                break
+            if encoder is not None:
+                encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+            frames += 1
+    finally:
+        source.cleanup()
+
+    audio_seconds = frames * 0.02
+    python_cpu = time.process_time() - python_start
+    ffmpeg_cpu = children_cpu() - children_start if children_start is not None else None
+    # Sin la CPU de ffmpeg el total quedaría por debajo de la realidad: mejor no darlo.
+    total_cpu = python_cpu + ffmpeg_cpu if ffmpeg_cpu is not None else None
+    return {
+        "mode": name,
+        "frames": frames,
+        "audio_seconds": round(audio_seconds, 2),
+        "wall_seconds": round(time.perf_counter() - wall_start, 3),
+        "python_cpu_seconds": round(python_cpu, 3),
+        "ffmpeg_cpu_seconds": round(ffmpeg_cpu, 3) if ffmpeg_cpu is not None else None,
+        "cpu_ms_per_audio_second": (
+            round(total_cpu * 1000 / audio_seconds, 3) if total_cpu is not None and frames else None
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", help="Archivo de audio local (ideal: WebM/Opus como el formato 251 de YouTube).")
+    parser.add_argument("--seconds", type=int, default=60, help="Duración del audio generado si no hay --input.")
+    parser.add_argument("--volume", type=float, default=0.05, help="Volumen para los modos que lo aplican.")
+    parser.add_argument("--ffmpeg", default=FFMPEG_EXECUTABLE or shutil.which("ffmpeg"))
+    args = parser.parse_args()
+
+    if not args.ffmpeg:
+        sys.exit("No se encontró ffmpeg (usa --ffmpeg o FFMPEG_PATH).")
+
+    tmpdir = None
+    path = args.input
+    if not path:
+        tmpdir = tempfile.mkdtemp(prefix="bench-playback-")
+        path = os.path.join(tmpdir, "sample.webm")
+        generate_sample(path, args.seconds, args.ffmpeg)
+
+    try:
+        results = [
+            run_mode(
+                "pcm",
+                discord.PCMVolumeTransformer(
+                    discord.FFmpegPCMAudio(path, executable=args.ffmpeg, options="-vn"), volume=args.volume
+                ),
+                encoder=load_encoder(),
+            ),
+            run_mode(
+                "opus-filter",
+                discord.FFmpegOpusAudio(
+                    path,
+                    bitrate=OPUS_BITRATE,
+                    executable=args.ffmpeg,
+                    options=f"-vn -af volume={args.volume:.4f}",
+                ),
+            ),
+            run_mode(
+                "opus-copy",
+                discord.FFmpegOpusAudio(path, codec="copy", executable=args.ffmpeg, options="-vn"),
+            ),
+        ]
+    finally:
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    print(json.dumps({"input": args.input or "generado", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Compara la memoria de la cola con canciones como dict frente al registro Song de cogs/musica.py.
+
+Uso:
+    python bench/song_memory.py [--tracks 100000] [--guilds 300] [--users 2000]
+
+Se construyen --tracks canciones repartidas entre --guilds canales y --users usuarios,
+con el mismo contenido en ambos formatos, y se mide con tracemalloc lo que ocupan.
+Las URLs y títulos se generan antes de medir, para contar solo el contenedor de cada canción.
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cogs.musica import SHARED_IDS, Song, shared_id  # noqa: E402
+
+
+def build_dict(webpage_url, titulo, duration, channel_id, requested_by):
+    # Formato anterior de Musica.build_song.
+    return {
+        "url": webpage_url,
+        "webpage_url": webpage_url,
+        "titulo": titulo or "Desconocido",
+        "duration": duration or 0,
+        "channel_id": channel_id,
+        "requested_by": requested_by,
+    }
+
+
+def build_record(webpage_url, titulo, duration, channel_id, requested_by):
+    return Song(
+        webpage_url=webpage_url,
+        titulo=titulo or "Desconocido",
+        duration=int(duration or 0),
+        channel_id=shared_id(channel_id),
+        requested_by=shared_id(requested_by),
+    )
+
+
+def measure(name, builder, rows):
+    SHARED_IDS.clear()
+    gc.collect()
+    tracemalloc.start()
+    # Los IDs llegan de Discord como objetos nuevos en cada petición.
+    songs = [builder(url, title, duration, int(str(channel)), int(str(user))) for url, title, duration, channel, user in rows]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del songs
+    return {
+        "layout": name,
+        "bytes": current,
+        "bytes_per_track": round(current / len(rows), 1),
+        "peak_bytes": peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tracks", type=int, default=100_000)
+    parser.add_argument("--guilds", type=int, default=300)
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    base_channel = 900_000_000_000_000_000
+    base_user = 100_000_000_000_000_000
+    rows = [
+        (
+            f"https://www.youtube.com/watch?v={i:011d}",
+            f"Canción de prueba número {i}",
+            180 + i % 240,
+            base_channel + i % args.guilds,
+            base_user + i % args.users,
+        )
+        for i in range(args.tracks)
+    ]
+
+    results = [measure("dict", build_dict, rows), measure("slots", build_record, rows)]
+    saved = results[0]["bytes"] - results[1]["bytes"]
+    print(json.dumps({
+        "tracks": args.tracks,
+        "results": results,
+        "saved_bytes": saved,
+        "saved_percent": round(saved * 100 / results[0]["bytes"], 1) if results[0]["bytes"] else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
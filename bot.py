@@ -1,6 +1,8 @@
 # JohnBotJovi.py
 import os
 import sys
+import json
+import hashlib
 import logging
 from dotenv import load_dotenv
 import discord
@@ -23,19 +25,128 @@ intents.message_content = True
 intents.members = True  # recuerda activar en el Developer Portal si es necesario
 
 # --- Inicializar bot (Pycord) ---
-bot = discord.Bot(intents=intents, debug_guilds=None)  # debug_guilds=None por defecto
+# auto_sync_commands=False: Pycord sincronizaría en cada on_connect; aquí se decide por huella.
+bot = discord.Bot(intents=intents, debug_guilds=None, auto_sync_commands=False)  # debug_guilds=None por defecto
+
+# --- Sincronización de slash commands ---
+DATA_DIR = os.path.abspath(
+    os.path.expanduser(os.getenv("MUSIC_DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+)
+COMMANDS_FINGERPRINT_PATH = os.path.join(DATA_DIR, "commands.sha256")
+
+
+def canonical_command(value):
+    # contexts/integration_types salen de sets de enums: su orden cambia entre procesos.
+    if isinstance(value, dict):
+        return {key: canonical_command(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [canonical_command(item) for item in value]
+        if all(isinstance(item, (int, str)) for item in items):
+            return sorted(items, key=str)
+        return items
+    return value
+
+
+def commands_fingerprint():
+    """Huella del árbol de comandos tal y como se envía a Discord (más el ID de la aplicación)."""
+    tree = sorted(
+        json.dumps(canonical_command([cmd.guild_ids, cmd.to_dict()]), sort_keys=True, default=str)
+        for cmd in bot.pending_application_commands
+    )
+    payload = json.dumps([bot.user.id if bot.user else None, tree])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def read_synced_fingerprint():
+    try:
+        with open(COMMANDS_FINGERPRINT_PATH, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def write_synced_fingerprint(fingerprint):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp_path = f"{COMMANDS_FINGERPRINT_PATH}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(fingerprint)
+    os.replace(tmp_path, COMMANDS_FINGERPRINT_PATH)
+
+
+async def sync_commands_if_changed(force=False):
+    """Sincroniza con Discord solo si los comandos cambiaron desde la última sincronización."""
+    fingerprint = commands_fingerprint()
+    if not force and fingerprint == read_synced_fingerprint():
+        log.info("Slash commands sin cambios (%s), se omite la sincronización.", fingerprint[:12])
+        return False
+
+    await bot.sync_commands(force=force)
+    try:
+        write_synced_fingerprint(fingerprint)
+    except OSError as e:
+        log.warning("No se pudo guardar la huella de comandos: %s", e)
+    log.info("Slash commands sincronizados correctamente (%s).", fingerprint[:12])
+    return True
 
 # --- Evento on_ready ---
 @bot.event
 async def on_ready():
     log.info(f"✅ Bot conectado como {bot.user} (ID: {bot.user.id})")
     try:
-        # Opcional: sincronizar globalmente (cuidado con errores si hay nombres duplicados)
-        await bot.sync_commands()
-        log.info("Slash commands sincronizados correctamente.")
+        # on_ready se repite tras cada reconexión al gateway: sin cambios no se llama a la API.
+        await sync_commands_if_changed()
     except Exception as e:
         log.exception("Error al sincronizar comandos: %s", e)
 
+# --- Sincronización forzada ---
+@bot.slash_command(name="synccommands", description="(OWNER) Fuerza la sincronización de slash commands con Discord.")
+@discord.default_permissions(administrator=True)
+async def force_sync_commands(ctx):
+    if not await bot.is_owner(ctx.author):
+        return await ctx.respond("🚫 Solo el dueño del bot puede sincronizar comandos.", ephemeral=True)
+
+    await ctx.defer(ephemeral=True)
+    try:
+        await sync_commands_if_changed(force=True)
+    except Exception as e:
+        log.exception("Error al forzar la sincronización de comandos: %s", e)
+        return await ctx.followup.send(f"⚠️ Error al sincronizar: {type(e).__name__}: {e}", ephemeral=True)
+    await ctx.followup.send("✅ Slash commands sincronizados.", ephemeral=True)
+
+# --- Recarga en caliente de cogs ---
+@bot.slash_command(name="reload", description="(OWNER) Recarga un módulo sin reiniciar el bot ni cortar la música.")
+@discord.default_permissions(administrator=True)
+@discord.option("modulo", str, description="Nombre del módulo en cogs/ (ej: musica).", default="musica")
+async def reload_cog(ctx, modulo: str = "musica"):
+    if not await bot.is_owner(ctx.author):
+        return await ctx.respond("🚫 Solo el dueño del bot puede recargar módulos.", ephemeral=True)
+
+    await ctx.defer(ephemeral=True)
+    module_name = f"cogs.{modulo}"
+    # Con hot_reload activo el cog entrega su estado (colas, cachés, pools) a la nueva instancia
+    # y las conexiones de voz siguen reproduciendo durante la recarga. El cog deja en hot_reload_result
+    # si pudo hacerlo así o tuvo que recargar en frío.
+    bot.hot_reload = True
+    bot.hot_reload_result = None
+    try:
+        bot.reload_extension(module_name)
+    except Exception as e:
+        log.exception("Error recargando %s: %s", module_name, e)
+        return await ctx.followup.send(f"⚠️ No se pudo recargar `{module_name}`: {type(e).__name__}: {e}", ephemeral=True)
+    finally:
+        bot.hot_reload = False
+
+    try:
+        # Si la recarga no cambió ningún comando no hace falta llamar a Discord.
+        await sync_commands_if_changed()
+    except Exception as e:
+        log.exception("Error al sincronizar comandos tras recargar %s: %s", module_name, e)
+    result = bot.hot_reload_result
+    bot.hot_reload_result = None
+    log.info("♻️ Módulo recargado: %s (%s)", module_name, result or "sin traspaso de estado")
+    detail = f" {result}" if result else ""
+    await ctx.followup.send(f"♻️ Módulo `{module_name}` recargado{detail}.", ephemeral=True)
+
 # --- Cargar cogs automáticamente ---
 cogs_dir = "./cogs"
 for filename in os.listdir(cogs_dir):
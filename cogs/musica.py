@@ -1,10 +1,25 @@
 import asyncio
+import bisect
+import dataclasses
+import functools
+import hashlib
+import inspect
+import json
 import logging
 import os
 import random
+import re
 import shutil
+import sqlite3
 import subprocess
+import sys
+import threading
+import time
+import traceback
 import urllib.parse
+from collections import Counter, OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
 
 import discord
 import spotipy
@@ -29,17 +44,32 @@ YTDL_OPTIONS = {
     "default_search": "ytsearch",
     "source_address": "0.0.0.0",
 }
-ytdl = yt_dlp.YoutubeDL(YTDL_OPTIONS)
 
+# "pcm": decodifica a PCM, escala volumen en Python y el cliente re-codifica a Opus (modo clásico).
+# "opus": ffmpeg entrega Opus directamente (sin transcodificar si la fuente ya es Opus y el volumen es 100%).
+PLAYBACK_MODE = (os.getenv("MUSIC_PLAYBACK_MODE") or "pcm").strip().lower()
+if PLAYBACK_MODE not in {"pcm", "opus"}:
+    log.warning(f"MUSIC_PLAYBACK_MODE desconocido: {PLAYBACK_MODE!r}. Usando 'pcm'.")
+    PLAYBACK_MODE = "pcm"
+
+STREAM_FORMAT = "bestaudio[acodec=opus]/bestaudio/best" if PLAYBACK_MODE == "opus" else YTDL_OPTIONS["format"]
+OPUS_BITRATE = 128
+
+# Perfiles de un solo vídeo: sin ignoreerrors, para que "Private video" y similares lleguen
+# como DownloadError a classify_extraction_error en vez de como un resultado vacío.
 YTDL_STREAM_PRIMARY_OPTIONS = {
     **YTDL_OPTIONS,
+    "format": STREAM_FORMAT,
     "noplaylist": True,
+    "ignoreerrors": False,
     "extractor_args": {"youtube": {"player_client": ["ios", "android", "web"]}},
 }
 
 YTDL_STREAM_FALLBACK_OPTIONS = {
     **YTDL_OPTIONS,
+    "format": STREAM_FORMAT,
     "noplaylist": True,
+    "ignoreerrors": False,
     "extractor_args": {"youtube": {"player_client": ["android", "web"]}},
 }
 
@@ -50,10 +80,59 @@ YTDL_PLAYLIST_FLAT_OPTIONS = {
     "skip_download": True,
 }
 
+# Clases de prioridad del planificador de extracciones (menor = más urgente).
+PRIORITY_PLAYBACK = 0  # la siguiente canción que un servidor necesita ya
+PRIORITY_SEEK = 1  # /seek y /replay
+PRIORITY_SEARCH = 2  # búsqueda interactiva de /play
+PRIORITY_PREFETCH = 3  # resolución anticipada de la cola
+PRIORITY_BULK = 4  # importación masiva de playlists
+PRIORITY_NAMES = {
+    PRIORITY_PLAYBACK: "playback",
+    PRIORITY_SEEK: "seek",
+    PRIORITY_SEARCH: "search",
+    PRIORITY_PREFETCH: "prefetch",
+    PRIORITY_BULK: "bulk",
+}
+
+# Fallos propios del vídeo (no del extractor): se recuerdan y no se reintentan.
+NEGATIVE_CACHE_REASONS = (
+    ("private", ("private video",)),
+    ("region", ("not available in your country", "blocked it in your country", "geo restrict")),
+    ("age", ("confirm your age", "age-restricted", "inappropriate for some users")),
+    ("members", ("members-only", "join this channel")),
+    ("copyright", ("copyright",)),
+    ("removed", ("video unavailable", "has been removed", "account associated with this video has been terminated")),
+)
+NEGATIVE_CACHE_TTL = 6 * 3600
+# YouTube respondió pero sin ningún stream reproducible: se recuerda menos tiempo por si es puntual.
+NO_STREAM_CACHE_TTL = 600
+NEGATIVE_REASON_LABELS = {
+    "private": "vídeo privado",
+    "region": "bloqueado en la región",
+    "age": "restringido por edad",
+    "members": "solo para miembros",
+    "copyright": "retirado por copyright",
+    "removed": "vídeo no disponible",
+    "no_stream": "sin stream reproducible",
+}
+
+STREAM_CACHE_SAFETY_MARGIN = 300
+STREAM_CACHE_DEFAULT_TTL = 1800
+STREAM_INFO_KEYS = ("url", "extractor", "title", "duration", "webpage_url", "acodec", "ext")
+
+YTDL_PROFILES = {
+    "default": YTDL_OPTIONS,
+    "stream_primary": YTDL_STREAM_PRIMARY_OPTIONS,
+    "stream_fallback": YTDL_STREAM_FALLBACK_OPTIONS,
+    "playlist_flat": YTDL_PLAYLIST_FLAT_OPTIONS,
+}
+
 FFMPEG_OPTIONS = {
     "before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -nostdin",
     "options": "-vn",
 }
+# Archivos de la caché de audio: las opciones -reconnect solo valen para HTTP.
+LOCAL_FFMPEG_BEFORE_OPTIONS = "-nostdin"
 
 def resolve_ffmpeg_executable():
     configured_path = os.getenv("FFMPEG_PATH")
@@ -75,10 +154,97 @@ def resolve_ffmpeg_executable():
 FFMPEG_EXECUTABLE = resolve_ffmpeg_executable()
 
 
+def resolve_data_dir():
+    configured_path = os.getenv("MUSIC_DATA_DIR")
+    if configured_path:
+        return os.path.abspath(os.path.expanduser(configured_path))
+    return os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "data"))
+
+
+def env_int(name, default):
+    raw = (os.getenv(name) or "").strip()
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError:
+        log.warning(f"Valor inválido para {name}: {raw!r}. Usando {default}.")
+        return default
+
+
+def env_flag(name, default=False):
+    raw = (os.getenv(name) or "").strip().lower()
+    if not raw:
+        return default
+    return raw in {"1", "true", "yes", "on", "si", "sí"}
+
+
+# IDs de canal/usuario compartidos entre canciones: cada int > 256 sería un objeto distinto.
+SHARED_IDS = {}
+SHARED_IDS_LIMIT = 50000
+
+
+def shared_id(value):
+    if value is None:
+        return None
+    if len(SHARED_IDS) >= SHARED_IDS_LIMIT:
+        SHARED_IDS.clear()
+    return SHARED_IDS.setdefault(value, value)
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Song:
+    """Canción en cola: registro inmutable y compacto (sin __dict__ por instancia)."""
+
+    webpage_url: str
+    titulo: str
+    duration: int
+    channel_id: int
+    requested_by: int = None
+
+    @property
+    def url(self):
+        return self.webpage_url
+
+    def replace(self, **changes):
+        return dataclasses.replace(self, **changes)
+
+    def to_record(self):
+        return [self.webpage_url, self.titulo, self.duration, self.channel_id, self.requested_by]
+
+    @classmethod
+    def from_record(cls, record):
+        webpage_url, titulo, duration, channel_id, requested_by = record
+        return cls(webpage_url, titulo, int(duration or 0), shared_id(channel_id), shared_id(requested_by))
+
+
 def create_youtube_search_query(artist, title):
     return f"{artist} - {title}"
 
 
+SPOTIFY_ENTITY_TYPES = ("track", "playlist", "album", "artist")
+
+
+def parse_spotify_url(value):
+    """Devuelve (tipo, id) de un enlace de Spotify, ignorando prefijos como /intl-es/."""
+    parsed = urllib.parse.urlparse(value)
+    path_segments = [p for p in parsed.path.split("/") if p and not p.startswith("intl-")]
+    entity_type = path_segments[0] if len(path_segments) >= 1 else None
+    entity_id = path_segments[1].split("?")[0] if len(path_segments) >= 2 else None
+    return entity_type, entity_id
+
+
+def spotify_track_item(track):
+    """Convierte un track de la API de Spotify en un elemento a resolver por /play."""
+    if not track or not track.get("name") or not track.get("artists"):
+        return None
+    return {
+        "query": create_youtube_search_query(track["artists"][0]["name"], track["name"]),
+        "spotify_id": track.get("id"),
+        "isrc": (track.get("external_ids") or {}).get("isrc"),
+    }
+
+
 def format_duration(seconds):
     if not seconds or seconds <= 0:
         return "?:??"
@@ -159,6 +325,14 @@ def make_extraction_query(raw_query):
     return raw_query
 
 
+def normalize_extraction_key(query):
+    """Clave canónica para deduplicar extracciones (espacios y mayúsculas plegados en búsquedas)."""
+    value = " ".join((query or "").split())
+    if is_likely_url(value):
+        return value
+    return value.casefold()
+
+
 def is_youtube_url(value):
     if not is_likely_url(value):
         return False
@@ -166,16 +340,1512 @@ def is_youtube_url(value):
     return any(h in host for h in ("youtube.com", "youtu.be", "music.youtube.com"))
 
 
-def extract_stream_info(url, primary, fallback):
+class YtdlPool:
+    """Instancias de YoutubeDL por hilo y por perfil de opciones.
+
+    Cada hilo del planificador construye (una sola vez) su propio juego de instancias,
+    así se reutilizan entre llamadas sin compartir nunca un objeto entre hilos a la vez.
+    """
+
+    def __init__(self, profiles, factory=yt_dlp.YoutubeDL):
+        self.profiles = profiles
+        self.factory = factory
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def get(self, profile):
+        instances = getattr(self.local, "instances", None)
+        if instances is None:
+            instances = self.local.instances = {}
+
+        instance = instances.get(profile)
+        if instance is None:
+            instance = instances[profile] = self.factory(self.profiles[profile])
+            with self.lock:
+                self.created += 1
+        return instance
+
+    def warm_up(self):
+        for profile in self.profiles:
+            self.get(profile)
+
+
+ytdl_pool = YtdlPool(YTDL_PROFILES)
+
+
+def extract_info(query):
+    return ytdl_pool.get("default").extract_info(query, download=False)
+
+
+STREAM_PROFILES = ("stream_primary", "stream_fallback")
+
+
+def extract_stream_info(url, profile, stats=None):
+    started = time.perf_counter()
     try:
-        return primary.extract_info(url, download=False)
-    except DownloadError as e1:
-        log.warning(f"Fallo extracción primaria para {url}: {e1}")
-        return fallback.extract_info(url, download=False)
+        info = ytdl_pool.get(profile).extract_info(url, download=False)
+    except Exception:
+        if stats is not None:
+            stats.record(False, time.perf_counter() - started)
+        raise
+    if stats is not None:
+        stats.record(bool(info and info.get("url")), time.perf_counter() - started)
+    return info
+
 
 def extract_playlist_flat_info(url):
-    flat_ytdl = yt_dlp.YoutubeDL(YTDL_PLAYLIST_FLAT_OPTIONS)
-    return flat_ytdl.extract_info(url, download=False)
+    return ytdl_pool.get("playlist_flat").extract_info(url, download=False)
+
+
+def extract_metadata_info(url):
+    # process=False: título y duración sin elegir formato ni preparar el stream.
+    return ytdl_pool.get("default").extract_info(url, download=False, process=False)
+
+
+def stream_url_ttl(stream_url, now=None):
+    """Segundos de vida útil de una URL de stream según su parámetro `expire=`."""
+    now = time.time() if now is None else now
+    parsed = urllib.parse.urlparse(stream_url or "")
+    expire = urllib.parse.parse_qs(parsed.query).get("expire")
+    if not expire:
+        # Algunas URLs de googlevideo llevan los parámetros en el path (/expire/<ts>/...).
+        segments = parsed.path.split("/")
+        if "expire" in segments:
+            idx = segments.index("expire")
+            expire = segments[idx + 1 : idx + 2]
+    if not expire:
+        return STREAM_CACHE_DEFAULT_TTL
+
+    try:
+        expires_at = int(expire[0])
+    except ValueError:
+        return STREAM_CACHE_DEFAULT_TTL
+    return expires_at - now - STREAM_CACHE_SAFETY_MARGIN
+
+
+def classify_extraction_error(error):
+    """Devuelve el motivo si el error es propio del vídeo (privado, borrado...), o None si es transitorio."""
+    if isinstance(error, NoStreamFound):
+        return "no_stream"
+    if not isinstance(error, DownloadError):
+        return None
+    message = str(error).lower()
+    for reason, needles in NEGATIVE_CACHE_REASONS:
+        if any(needle in message for needle in needles):
+            return reason
+    return None
+
+
+class NoStreamFound(ValueError):
+    """La extracción terminó sin error pero sin URL de stream (ningún perfil la encontró)."""
+
+
+class KnownBadVideo(Exception):
+    def __init__(self, webpage_url, reason):
+        super().__init__(f"{webpage_url}: {NEGATIVE_REASON_LABELS.get(reason, reason)}")
+        self.webpage_url = webpage_url
+        self.reason = reason
+
+
+class ExtractorUnavailable(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Extractor en pausa por fallos repetidos (reintento en {retry_after:.0f}s)")
+        self.retry_after = retry_after
+
+
+def compact_stream_info(info):
+    return {key: info.get(key) for key in STREAM_INFO_KEYS if info.get(key) is not None}
+
+
+class TTLCache:
+    """Caché LRU acotada con expiración individual por entrada."""
+
+    def __init__(self, max_entries, default_ttl):
+        self.max_entries = max(1, max_entries)
+        self.default_ttl = default_ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        item = self.entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        if ttl <= 0:
+            self.entries.pop(key, None)
+            return
+
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def peek(self, key):
+        """Como get(), pero sin tocar contadores ni el orden LRU."""
+        item = self.entries.get(key)
+        if item is None or item[0] <= time.monotonic():
+            return None
+        return item[1]
+
+    def pop(self, key):
+        item = self.entries.pop(key, None)
+        return item[1] if item else None
+
+    def clear(self):
+        self.entries.clear()
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def describe(self):
+        return (
+            f"{len(self.entries)}/{self.max_entries} entradas · "
+            f"{self.hit_ratio():.0%} aciertos ({self.hits}/{self.hits + self.misses}) · "
+            f"{self.evictions} desalojos"
+        )
+
+
+class SingleFlight:
+    """Comparte una sola ejecución entre llamadas concurrentes con la misma clave."""
+
+    def __init__(self):
+        self.inflight = {}
+        self.started = 0
+        self.joined = 0
+
+    def __len__(self):
+        return len(self.inflight)
+
+    async def run(self, key, factory):
+        task = self.inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.inflight[key] = task
+            self.started += 1
+            task.add_done_callback(lambda t, k=key: self.forget(k, t))
+        else:
+            self.joined += 1
+        # shield: si un llamador se cancela (timeout), los demás siguen esperando el mismo resultado.
+        return await asyncio.shield(task)
+
+    def forget(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            # Marca la excepción como consumida aunque ya no quede nadie esperando.
+            task.exception()
+
+    def describe(self):
+        return f"{len(self.inflight)} en curso · {self.started} ejecutadas · {self.joined} compartidas"
+
+
+class LatencyWindow:
+    """Ventana de las últimas muestras de latencia, con percentiles bajo demanda."""
+
+    def __init__(self, maxlen=256):
+        self.samples = deque(maxlen=maxlen)
+        self.count = 0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentile(self, pct):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def describe(self):
+        if not self.samples:
+            return "sin datos"
+        p50, p95, p99 = (self.percentile(p) for p in (50, 95, 99))
+        return f"p50 {p50:.2f}s · p95 {p95:.2f}s · p99 {p99:.2f}s (n={self.count})"
+
+
+class ProfileStats:
+    """Latencia y tasa de éxito recientes de un perfil de extracción (se alimenta desde los hilos)."""
+
+    def __init__(self, name, window=100):
+        self.name = name
+        self.latencies = LatencyWindow(window)
+        self.outcomes = deque(maxlen=window)
+        self.wins = 0
+
+    def record(self, ok, seconds):
+        self.outcomes.append(ok)
+        if ok:
+            self.latencies.add(seconds)
+
+    def success_rate(self):
+        if not self.outcomes:
+            return None
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def describe(self):
+        rate = self.success_rate()
+        rate_txt = "?" if rate is None else f"{rate:.0%}"
+        return f"{self.name}: éxito {rate_txt} · {self.latencies.describe()} · {self.wins} victorias"
+
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+LOOP_LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    """Histograma acumulado de cubetas fijas (semántica de Prometheus: nunca se reinicia)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+
+
+class LoopLagMonitor:
+    """Mide cuánto tarda el event loop en despertar una corrutina que duerme `interval` segundos.
+
+    Un hilo vigía comprueba el latido del loop; si se atrasa más de `threshold` captura la pila
+    del hilo del loop en ese momento, que es justo el código que lo está bloqueando.
+    """
+
+    def __init__(self, interval=0.5, threshold=0.25, log_interval=60.0, check_interval=0.05):
+        self.interval = interval
+        self.threshold = threshold
+        self.log_interval = log_interval
+        self.check_interval = check_interval
+        self.histogram = Histogram(LOOP_LAG_BUCKETS)
+        self.window = LatencyWindow(240)
+        self.last = 0.0
+        self.max = 0.0
+        self.heartbeat = time.monotonic()
+        self.loop_thread = None
+        self.watchdog = None
+        self.stop_event = threading.Event()
+        self.episode = None
+        self.incidents = deque(maxlen=10)
+        self.stalls = 0
+        self.suppressed = 0
+        self.last_log = 0.0
+
+    async def run(self):
+        self.loop_thread = threading.get_ident()
+        self.start_watchdog()
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - self.heartbeat - self.interval)
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.histogram.observe(lag)
+            self.window.add(lag)
+            episode = self.episode
+            if episode is not None:
+                # El bloqueo terminó: ahora se conoce su duración real.
+                episode["lag"] = lag
+                self.episode = None
+
+    def start_watchdog(self):
+        if self.watchdog is not None and self.watchdog.is_alive():
+            return
+        self.stop_event.clear()
+        self.watchdog = threading.Thread(target=self.watch, name="loop-watchdog", daemon=True)
+        self.watchdog.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def watch(self):
+        while not self.stop_event.wait(self.check_interval):
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if stalled < self.threshold or self.episode is not None or self.loop_thread is None:
+                continue
+            frame = sys._current_frames().get(self.loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)[-12:]
+            del frame
+            self.record_stall(stalled, stack)
+
+    def record_stall(self, stalled, stack):
+        episode = {
+            "at": time.time(),
+            "stalled": stalled,
+            "lag": None,
+            "where": f"{os.path.basename(stack[-1].filename)}:{stack[-1].lineno} {stack[-1].name}" if stack else "?",
+            "stack": "".join(traceback.format_list(stack)),
+        }
+        self.episode = episode
+        self.incidents.append(episode)
+        self.stalls += 1
+
+        now = time.monotonic()
+        if now - self.last_log < self.log_interval:
+            self.suppressed += 1
+            return
+        skipped = f" ({self.suppressed} bloqueos más sin registrar desde el último aviso)" if self.suppressed else ""
+        self.last_log = now
+        self.suppressed = 0
+        log.warning(
+            f"🧊 Event loop bloqueado {stalled * 1000:.0f}ms en {episode['where']}{skipped}. Pila:\n{episode['stack']}"
+        )
+
+    def describe(self):
+        return (
+            f"último {self.last * 1000:.1f}ms · máx {self.max * 1000:.0f}ms · {self.window.describe()} · "
+            f"{self.stalls} bloqueos > {self.threshold * 1000:.0f}ms"
+        )
+
+
+class MetricsWriter:
+    """Construye la exposición en texto de Prometheus."""
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lines = []
+
+    @staticmethod
+    def labels_text(labels):
+        if not labels:
+            return ""
+        escaped = []
+        for key, value in labels.items():
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def add(self, name, kind, help_text, samples):
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{self.labels_text(labels)} {float(value):g}")
+
+    def histogram(self, name, help_text, series):
+        name = self.prefix + name
+        self.lines.append(f"# HELP {name} {help_text}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in series:
+            for bound, count in histogram.cumulative():
+                self.lines.append(f"{name}_bucket{self.labels_text({**labels, 'le': f'{bound:g}'})} {count}")
+            self.lines.append(f"{name}_bucket{self.labels_text({**labels, 'le': '+Inf'})} {histogram.count}")
+            self.lines.append(f"{name}_sum{self.labels_text(labels)} {histogram.sum:g}")
+            self.lines.append(f"{name}_count{self.labels_text(labels)} {histogram.count}")
+
+    def text(self):
+        return "\n".join(self.lines) + "\n"
+
+
+class PhaseSpan:
+    """Tiempos por fase de una operación (/play o cambio de canción), medidos con marcas sucesivas."""
+
+    def __init__(self, kind, guild_id, source):
+        self.kind = kind
+        self.guild_id = str(guild_id)
+        self.source = source
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []
+        # True mientras se espera el primer paquete de audio (lo marca el hilo del reproductor).
+        self.pending = False
+        self.finished = False
+
+    def mark(self, phase, at=None):
+        now = time.perf_counter() if at is None else at
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def total(self):
+        return self.last - self.started
+
+    def breakdown(self):
+        return " · ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases)
+
+
+class PhaseStats:
+    """Percentiles por operación, tipo de origen y fase; avisa en el log de las operaciones lentas."""
+
+    def __init__(self, window=256, slow_threshold=8.0, min_samples=20):
+        self.window = window
+        self.slow_threshold = slow_threshold
+        self.min_samples = min_samples
+        # (operación, origen, fase) -> LatencyWindow; la fase "total" es la operación completa.
+        self.windows = {}
+        self.histograms = {}
+        self.recent = deque(maxlen=200)
+        self.slow = 0
+
+    def get_window(self, kind, source, phase):
+        key = (kind, source, phase)
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = LatencyWindow(self.window)
+        return window
+
+    def record(self, span):
+        if span.finished:
+            return
+        span.finished = True
+
+        outliers = []
+        for phase, seconds in span.phases + [("total", span.total())]:
+            window = self.get_window(span.kind, span.source, phase)
+            # Una fase es anómala si supera el p99 de su propio historial (y no es ruido de milisegundos).
+            if len(window) >= self.min_samples and seconds >= 0.5 and seconds > window.percentile(99):
+                outliers.append(phase)
+            window.add(seconds)
+            key = (span.kind, span.source, phase)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+        self.recent.append(span)
+
+        if span.total() >= self.slow_threshold or outliers:
+            self.slow += 1
+            detail = f" · sobre p99: {', '.join(outliers)}" if outliers else ""
+            log.warning(
+                f"🐢 {span.kind} lento en {span.guild_id} ({span.source}): "
+                f"{span.total():.2f}s = {span.breakdown()}{detail}"
+            )
+
+    def describe(self):
+        if not self.windows:
+            return "sin datos"
+        lines = []
+        for kind, source, phase in sorted(self.windows, key=lambda key: (key[0], key[1], key[2] != "total")):
+            lines.append(f"{kind}/{source} {phase}: {self.windows[(kind, source, phase)].describe()}")
+        lines.append(f"operaciones lentas registradas: {self.slow}")
+        return "\n".join(lines)
+
+    def describe_guild(self, guild_id, limit=5):
+        spans = [span for span in self.recent if span.guild_id == str(guild_id)][-limit:]
+        if not spans:
+            return "sin datos"
+        return "\n".join(
+            f"{span.kind}/{span.source} {span.total():.2f}s = {span.breakdown()}" for span in reversed(spans)
+        )
+
+
+class CircuitBreaker:
+    """Corta las extracciones tras fallos repetidos del extractor y sondea hasta que se recupera."""
+
+    CLOSED = "cerrado"
+    OPEN = "abierto"
+    HALF_OPEN = "semiabierto"
+
+    def __init__(self, threshold, window, cooldown):
+        self.threshold = max(1, threshold)
+        self.window = window
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = deque()
+        self.opened_at = 0.0
+        self.probe_started_at = None
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        now = time.monotonic()
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN and now - self.opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self.probe_started_at = None
+
+        if self.state == self.HALF_OPEN:
+            # Una sola sonda a la vez; si se pierde (cancelada), se permite otra tras el cooldown.
+            if self.probe_started_at is None or now - self.probe_started_at >= self.cooldown:
+                self.probe_started_at = now
+                return True
+
+        self.rejected += 1
+        return False
+
+    def retry_after(self):
+        if self.state == self.CLOSED:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            log.info("✅ Extractor recuperado, circuito cerrado.")
+        self.state = self.CLOSED
+        self.failures.clear()
+        self.probe_started_at = None
+
+    def record_failure(self):
+        now = time.monotonic()
+        if self.state == self.HALF_OPEN:
+            self.trip(now)
+            return
+
+        self.failures.append(now)
+        while self.failures and now - self.failures[0] > self.window:
+            self.failures.popleft()
+        if self.state == self.CLOSED and len(self.failures) >= self.threshold:
+            self.trip(now)
+
+    def trip(self, now):
+        self.state = self.OPEN
+        self.opened_at = now
+        self.probe_started_at = None
+        self.failures.clear()
+        self.times_opened += 1
+        log.warning(f"🚧 Circuito de extracción abierto durante {self.cooldown:.0f}s por fallos repetidos.")
+
+    def describe(self):
+        detail = f"{self.state}"
+        if self.state != self.CLOSED:
+            detail += f" (reintento en {self.retry_after():.0f}s)"
+        return (
+            f"{detail} · {len(self.failures)}/{self.threshold} fallos recientes · "
+            f"abierto {self.times_opened} veces · {self.rejected} rechazadas"
+        )
+
+
+class ExtractionQueueTimeout(asyncio.TimeoutError):
+    """El trabajo expiró antes de conseguir hilo: saturación local, no un fallo del extractor."""
+
+
+class ExtractionJob:
+    __slots__ = ("fut", "fn", "enqueued_at", "key", "guild_id", "priority")
+
+    def __init__(self, fut, fn, enqueued_at, key, guild_id, priority):
+        self.fut = fut
+        self.fn = fn
+        self.enqueued_at = enqueued_at
+        self.key = key
+        self.guild_id = guild_id
+        self.priority = priority
+
+
+class ExtractionScheduler:
+    """Pool de hilos dedicado a yt-dlp con prioridades y reparto por turnos entre servidores.
+
+    Los trabajos esperan en el event loop y solo pasan al pool cuando hay un hilo libre,
+    así una playlist enorme nunca llena la cola interna del executor por delante de la
+    canción que otro servidor necesita ya.
+    """
+
+    def __init__(self, workers, initializer=None):
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="ytdl", initializer=initializer
+        )
+        # prioridad -> {guild_id: deque[ExtractionJob]}; el orden del dict implementa el turno.
+        self.pending = {priority: OrderedDict() for priority in sorted(PRIORITY_NAMES)}
+        self.running = 0
+        self.submitted = {priority: 0 for priority in PRIORITY_NAMES}
+        self.timeouts = 0
+        self.waits = {priority: deque(maxlen=256) for priority in PRIORITY_NAMES}
+        self.wait_histograms = {priority: Histogram() for priority in PRIORITY_NAMES}
+        self.run_histograms = {priority: Histogram() for priority in PRIORITY_NAMES}
+
+    def queue_depth(self, priority=None):
+        priorities = self.pending if priority is None else [priority]
+        return sum(len(jobs) for p in priorities for jobs in self.pending[p].values())
+
+    async def run(self, fn, *, priority=PRIORITY_SEARCH, guild_id=None, timeout=None, key=None):
+        loop = asyncio.get_running_loop()
+        job = ExtractionJob(loop.create_future(), fn, loop.time(), key, guild_id, priority)
+        self.enqueue(job)
+        self.submitted[priority] += 1
+        self.dispatch(loop)
+        try:
+            # El timeout cuenta desde que se encola: la espera por un hilo también entra en el límite.
+            return await asyncio.wait_for(job.fut, timeout=timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if self.discard(job):
+                raise ExtractionQueueTimeout(f"Sin hilo libre de yt-dlp en {timeout}s") from None
+            raise
+
+    def discard(self, job):
+        jobs = self.pending[job.priority].get(job.guild_id)
+        if not jobs or job not in jobs:
+            return False
+        jobs.remove(job)
+        if not jobs:
+            del self.pending[job.priority][job.guild_id]
+        return True
+
+    def enqueue(self, job):
+        guilds = self.pending[job.priority]
+        if job.guild_id not in guilds:
+            guilds[job.guild_id] = deque()
+        guilds[job.guild_id].append(job)
+
+    def promote(self, key, priority):
+        """Sube de prioridad los trabajos pendientes con esa clave (p. ej. un prefetch que ahora se necesita ya).
+
+        Puede haber más de uno: la resolución con cobertura encola un trabajo por perfil con la misma clave.
+        """
+        moved = []
+        for current in range(priority + 1, max(PRIORITY_NAMES) + 1):
+            for guild_id, jobs in list(self.pending[current].items()):
+                matching = [job for job in jobs if job.key == key]
+                for job in matching:
+                    jobs.remove(job)
+                if not jobs:
+                    del self.pending[current][guild_id]
+                moved.extend(matching)
+        for job in moved:
+            job.priority = priority
+            self.enqueue(job)
+        return bool(moved)
+
+    def next_job(self):
+        for guilds in self.pending.values():
+            while guilds:
+                guild_id, jobs = next(iter(guilds.items()))
+                job = jobs.popleft()
+                if jobs:
+                    guilds.move_to_end(guild_id)
+                else:
+                    del guilds[guild_id]
+                if not job.fut.done():
+                    return job
+        return None
+
+    def dispatch(self, loop):
+        while self.running < self.workers:
+            job = self.next_job()
+            if job is None:
+                return
+            self.running += 1
+            started = loop.time()
+            self.waits[job.priority].append(started - job.enqueued_at)
+            self.wait_histograms[job.priority].observe(started - job.enqueued_at)
+            work = self.executor.submit(job.fn)
+            # El hilo solo se libera cuando yt-dlp termina de verdad, aunque el llamador haya expirado.
+            work.add_done_callback(
+                lambda _, lp=loop, p=job.priority, t=started: lp.call_soon_threadsafe(self.release, lp, p, t)
+            )
+            loop.create_task(self.deliver(job, asyncio.wrap_future(work, loop=loop)))
+
+    def release(self, loop, priority, started):
+        self.running -= 1
+        self.run_histograms[priority].observe(loop.time() - started)
+        self.dispatch(loop)
+
+    async def deliver(self, job, work):
+        # El timeout lo aplica run(); si ya expiró, el resultado del hilo simplemente se descarta.
+        try:
+            result = await work
+        except Exception as e:
+            if not job.fut.done():
+                job.fut.set_exception(e)
+        else:
+            if not job.fut.done():
+                job.fut.set_result(result)
+
+    def shutdown(self):
+        for guilds in self.pending.values():
+            for jobs in guilds.values():
+                for job in jobs:
+                    job.fut.cancel()
+            guilds.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def describe(self):
+        parts = []
+        for priority, name in PRIORITY_NAMES.items():
+            waits = self.waits[priority]
+            avg_wait = sum(waits) / len(waits) if waits else 0.0
+            max_wait = max(waits) if waits else 0.0
+            parts.append(
+                f"{name}: {self.queue_depth(priority)} en cola, espera media {avg_wait:.2f}s (máx {max_wait:.2f}s)"
+            )
+        header = f"{self.running}/{self.workers} hilos ocupados · {self.timeouts} timeouts"
+        return header + "\n  " + "\n  ".join(parts)
+
+
+class SongQueue:
+    """Cola de un servidor: cabeza O(1), duración total incremental y contador de versión.
+
+    `version` cambia con cada modificación, así el prefetch y el render de /queue saben
+    si tienen que recalcular algo.
+    """
+
+    def __init__(self, songs=()):
+        self.songs = deque()
+        self.total_duration = 0
+        self.version = 0
+        self.extend(songs)
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __iter__(self):
+        return iter(self.songs)
+
+    def __getitem__(self, index):
+        return self.songs[index]
+
+    def touch(self):
+        self.version += 1
+
+    def head(self, count):
+        return list(islice(self.songs, count))
+
+    def append(self, song):
+        self.songs.append(song)
+        self.total_duration += song.duration
+        self.touch()
+
+    def extend(self, songs):
+        songs = list(songs)
+        if not songs:
+            return
+        self.songs.extend(songs)
+        self.total_duration += sum(song.duration for song in songs)
+        self.touch()
+
+    def appendleft(self, song):
+        self.songs.appendleft(song)
+        self.total_duration += song.duration
+        self.touch()
+
+    def popleft(self):
+        song = self.songs.popleft()
+        self.total_duration -= song.duration
+        self.touch()
+        return song
+
+    def move(self, origin, destination):
+        song = self.songs[origin]
+        del self.songs[origin]
+        self.songs.insert(destination, song)
+        self.touch()
+        return song
+
+    def shuffle(self):
+        songs = list(self.songs)
+        random.shuffle(songs)
+        self.songs = deque(songs)
+        self.touch()
+
+    def replace_many(self, replacements):
+        """Sustituye en una sola pasada las canciones de {id(vieja): (vieja, nueva)}; devuelve cuántas cambió."""
+        replaced = 0
+        for index, queued in enumerate(self.songs):
+            pair = replacements.get(id(queued))
+            if pair and pair[0] is queued:
+                self.songs[index] = pair[1]
+                self.total_duration += pair[1].duration - queued.duration
+                replaced += 1
+        if replaced:
+            self.touch()
+        return replaced
+
+    def remove_ranges(self, ranges):
+        """Quita los intervalos [inicio, fin] (base 0, ordenados y sin solaparse) en una sola pasada."""
+        if not ranges:
+            return []
+        kept = deque()
+        removed = []
+        bounds = iter(ranges)
+        start, end = next(bounds)
+        for index, song in enumerate(self.songs):
+            while end is not None and index > end:
+                start, end = next(bounds, (None, None))
+            if end is not None and start <= index <= end:
+                removed.append(song)
+            else:
+                kept.append(song)
+        self.songs = kept
+        self.total_duration -= sum(song.duration for song in removed)
+        self.touch()
+        return removed
+
+    def clear(self):
+        self.songs.clear()
+        self.total_duration = 0
+        self.touch()
+
+
+class MusicDatabase:
+    """Conexión SQLite (WAL) compartida por los almacenes persistentes del cog.
+
+    Los métodos son síncronos y se serializan con un lock; el cog los llama desde un executor.
+    """
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).rowcount
+
+    def executescript(self, script):
+        with self.lock:
+            self.conn.executescript(script)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def run_batch(self, statements):
+        """Ejecuta [(sql, params), ...] en una sola transacción (un único commit en disco)."""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                for sql, params in statements:
+                    self.conn.execute(sql, params)
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class SpotifyMatchCache:
+    """Caché persistente track de Spotify (id o ISRC) -> vídeo de YouTube elegido."""
+
+    TOUCH_BATCH = 32
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, db, max_entries, max_age):
+        self.db = db
+        self.max_entries = max(1, max_entries)
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        # last_used de los aciertos se acumula en memoria y se escribe en lote, no un commit por acierto.
+        self.touched = {}
+        self.touched_since = time.monotonic()
+        # Estimación de filas: el recorte solo se ejecuta al pasar de max_entries, y deja un margen.
+        self.rows = None
+        db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS spotify_matches (
+                track_id TEXT PRIMARY KEY,
+                isrc TEXT,
+                webpage_url TEXT NOT NULL,
+                title TEXT,
+                duration INTEGER,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS spotify_matches_isrc ON spotify_matches (isrc);
+            CREATE INDEX IF NOT EXISTS spotify_matches_last_used ON spotify_matches (last_used);
+            """
+        )
+
+    def get(self, track_id, isrc=None):
+        rows = []
+        if track_id:
+            rows = self.db.query("SELECT * FROM spotify_matches WHERE track_id = ?", (track_id,))
+        if not rows and isrc:
+            rows = self.db.query(
+                "SELECT * FROM spotify_matches WHERE isrc = ? ORDER BY created_at DESC LIMIT 1", (isrc,)
+            )
+        if not rows:
+            self.misses += 1
+            return None
+
+        row = rows[0]
+        now = time.time()
+        if now - row["created_at"] > self.max_age:
+            # Entrada vieja: se vuelve a buscar en YouTube y put() la reemplaza.
+            self.stale += 1
+            return None
+
+        self.touched[row["track_id"]] = now
+        if len(self.touched) >= self.TOUCH_BATCH or time.monotonic() - self.touched_since >= self.TOUCH_INTERVAL:
+            self.flush_touched()
+        self.hits += 1
+        return dict(row)
+
+    def touched_statements(self):
+        statements = [
+            ("UPDATE spotify_matches SET last_used = ? WHERE track_id = ?", (used, track_id))
+            for track_id, used in self.touched.items()
+        ]
+        self.touched = {}
+        self.touched_since = time.monotonic()
+        return statements
+
+    def flush_touched(self):
+        """Escribe en una sola transacción los last_used pendientes."""
+        statements = self.touched_statements()
+        if statements:
+            self.db.run_batch(statements)
+
+    def put(self, track_id, isrc, webpage_url, title, duration):
+        key = track_id or (f"isrc:{isrc}" if isrc else None)
+        if not key:
+            return
+        now = time.time()
+        statements = self.touched_statements()
+        statements.append((
+            "INSERT OR REPLACE INTO spotify_matches "
+            "(track_id, isrc, webpage_url, title, duration, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, isrc, webpage_url, title, int(duration or 0), now, now),
+        ))
+        self.db.run_batch(statements)
+
+        if self.rows is None:
+            self.rows = self.count()
+        else:
+            self.rows += 1
+        if self.rows > self.max_entries:
+            # La estimación cuenta también los reemplazos; se confirma antes de recortar.
+            self.rows = self.count()
+        if self.rows > self.max_entries:
+            keep = self.max_entries - self.max_entries // 10
+            self.db.execute(
+                "DELETE FROM spotify_matches WHERE track_id IN ("
+                "SELECT track_id FROM spotify_matches ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (keep,),
+            )
+            self.rows = keep
+
+    def inspect(self, key):
+        return [
+            dict(row)
+            for row in self.db.query(
+                "SELECT * FROM spotify_matches WHERE track_id = ? OR isrc = ? LIMIT 5", (key, key)
+            )
+        ]
+
+    def purge(self, key=None):
+        self.rows = None
+        if key:
+            return self.db.execute("DELETE FROM spotify_matches WHERE track_id = ? OR isrc = ?", (key, key))
+        return self.db.execute("DELETE FROM spotify_matches")
+
+    def count(self):
+        return self.db.query("SELECT COUNT(*) AS n FROM spotify_matches")[0]["n"]
+
+    def describe(self):
+        total = self.hits + self.misses + self.stale
+        ratio = self.hits / total if total else 0.0
+        return (
+            f"{self.count()}/{self.max_entries} entradas · {ratio:.0%} aciertos "
+            f"({self.hits} aciertos, {self.misses} fallos, {self.stale} caducadas)"
+        )
+
+
+class SearchCache:
+    """Caché de búsquedas de texto libre -> vídeo elegido (TTL + LRU), con persistencia opcional."""
+
+    def __init__(self, max_entries, ttl, db=None):
+        self.memory = TTLCache(max_entries, ttl)
+        self.ttl = ttl
+        self.db = db
+        self.loaded = False
+        # Estimación de filas en disco: el recorte solo se ejecuta al pasar del límite.
+        self.rows = None
+        if db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS search_cache (
+                    query TEXT PRIMARY KEY,
+                    webpage_url TEXT NOT NULL,
+                    title TEXT,
+                    duration INTEGER,
+                    expires_at REAL NOT NULL
+                );
+                """
+            )
+
+    def load(self):
+        """Lee las entradas vigentes de disco (en un executor); restore() las vuelca a memoria."""
+        if not self.db:
+            return []
+        now = time.time()
+        self.db.execute("DELETE FROM search_cache WHERE expires_at <= ?", (now,))
+        self.rows = self.db.query("SELECT COUNT(*) AS n FROM search_cache")[0]["n"]
+        rows = self.db.query(
+            "SELECT * FROM search_cache ORDER BY expires_at DESC LIMIT ?", (self.memory.max_entries,)
+        )
+        return [dict(row) for row in rows]
+
+    def restore(self, rows):
+        """Añade las entradas leídas por load() sin pisar ni desalojar las búsquedas hechas mientras tanto."""
+        self.loaded = True
+        entries = self.memory.entries
+        now = time.time()
+        restored = 0
+        for row in rows:
+            if len(entries) >= self.memory.max_entries:
+                break
+            if row["query"] in entries or row["expires_at"] <= now:
+                continue
+            value = {"webpage_url": row["webpage_url"], "title": row["title"], "duration": row["duration"]}
+            # Se insertan por el extremo antiguo del LRU, de la más reciente a la más vieja.
+            entries[row["query"]] = (time.monotonic() + row["expires_at"] - now, value)
+            entries.move_to_end(row["query"], last=False)
+            restored += 1
+        return restored
+
+    def get(self, key):
+        return self.memory.get(key)
+
+    def put(self, key, value):
+        self.memory.set(key, value)
+
+    def persist(self, key, value):
+        if not self.db:
+            return
+        self.db.execute(
+            "INSERT OR REPLACE INTO search_cache (query, webpage_url, title, duration, expires_at) VALUES (?, ?, ?, ?, ?)",
+            (key, value["webpage_url"], value.get("title"), int(value.get("duration") or 0), time.time() + self.ttl),
+        )
+        if self.rows is None:
+            self.rows = self.db.query("SELECT COUNT(*) AS n FROM search_cache")[0]["n"]
+        else:
+            self.rows += 1
+        if self.rows > self.memory.max_entries:
+            # La estimación cuenta también los reemplazos; se confirma antes de recortar.
+            self.rows = self.db.query("SELECT COUNT(*) AS n FROM search_cache")[0]["n"]
+        if self.rows > self.memory.max_entries:
+            keep = self.memory.max_entries - self.memory.max_entries // 10
+            self.db.execute(
+                "DELETE FROM search_cache WHERE query IN ("
+                "SELECT query FROM search_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (keep,),
+            )
+            self.rows = keep
+
+    def describe(self):
+        persisted = "persistente" if self.db else "solo memoria"
+        return f"{self.memory.describe()} · {persisted}"
+
+
+class QueueStateStore:
+    """Estado persistente por servidor: cola y canción actual."""
+
+    def __init__(self, db):
+        self.db = db
+        self.writes = 0
+        self.flushes = 0
+        db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS guild_state (
+                guild_id TEXT PRIMARY KEY,
+                current TEXT,
+                queue TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            """
+        )
+
+    def load(self, guild_id):
+        rows = self.db.query("SELECT current, queue FROM guild_state WHERE guild_id = ?", (guild_id,))
+        if not rows:
+            return None
+        current = json.loads(rows[0]["current"]) if rows[0]["current"] else None
+        return {
+            "current": Song.from_record(current) if current else None,
+            "queue": [Song.from_record(record) for record in json.loads(rows[0]["queue"])],
+        }
+
+    def save_many(self, states):
+        """Guarda [(guild_id, current, canciones), ...]; un servidor sin cola ni canción se borra."""
+        now = time.time()
+        statements = []
+        for guild_id, current, songs in states:
+            if current is None and not songs:
+                statements.append(("DELETE FROM guild_state WHERE guild_id = ?", (guild_id,)))
+                continue
+            statements.append((
+                "INSERT OR REPLACE INTO guild_state (guild_id, current, queue, updated_at) VALUES (?, ?, ?, ?)",
+                (
+                    guild_id,
+                    json.dumps(current.to_record(), ensure_ascii=False) if current else None,
+                    json.dumps([song.to_record() for song in songs], ensure_ascii=False),
+                    now,
+                ),
+            ))
+        if statements:
+            self.db.run_batch(statements)
+            self.writes += len(statements)
+            self.flushes += 1
+
+    def count(self):
+        return self.db.query("SELECT COUNT(*) AS n FROM guild_state")[0]["n"]
+
+    def describe(self):
+        return f"{self.count()} servidores guardados · {self.writes} escrituras en {self.flushes} lotes"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class GuildSettings:
+    """Ajustes de reproducción de un servidor."""
+
+    volume: float
+    max_queue: int
+    max_request: int
+    idle_timeout: int
+
+    def replace(self, **changes):
+        return dataclasses.replace(self, **changes)
+
+
+class GuildSettingsStore:
+    """Ajustes por servidor cacheados en memoria y guardados en SQLite (si hay base de datos).
+
+    Los servidores sin fila usan `defaults`; cada fila se lee una sola vez, en el primer comando.
+    """
+
+    def __init__(self, defaults, db=None):
+        self.defaults = defaults
+        self.db = db
+        self.cache = {}
+        self.loaded = set()
+        if db:
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS guild_settings (
+                    guild_id TEXT PRIMARY KEY,
+                    volume REAL NOT NULL,
+                    max_queue INTEGER NOT NULL,
+                    max_request INTEGER NOT NULL,
+                    idle_timeout INTEGER NOT NULL,
+                    updated_at REAL NOT NULL
+                );
+                """
+            )
+
+    def get(self, guild_id):
+        return self.cache.get(str(guild_id), self.defaults)
+
+    def update(self, guild_id, **changes):
+        settings = self.get(guild_id).replace(**changes)
+        self.cache[str(guild_id)] = settings
+        return settings
+
+    def load(self, guild_id):
+        rows = self.db.query(
+            "SELECT volume, max_queue, max_request, idle_timeout FROM guild_settings WHERE guild_id = ?", (guild_id,)
+        )
+        if not rows:
+            return None
+        return GuildSettings(rows[0]["volume"], rows[0]["max_queue"], rows[0]["max_request"], rows[0]["idle_timeout"])
+
+    def save(self, guild_id, settings):
+        self.db.execute(
+            "INSERT OR REPLACE INTO guild_settings "
+            "(guild_id, volume, max_queue, max_request, idle_timeout, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (guild_id, settings.volume, settings.max_queue, settings.max_request, settings.idle_timeout, time.time()),
+        )
+
+    def describe(self):
+        persisted = "persistentes" if self.db else "solo memoria"
+        return f"{len(self.cache)} servidores personalizados · {persisted}"
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class CachedAudio:
+    """Pista guardada en la caché de audio local."""
+
+    filename: str
+    size: int
+    checksum: str
+    duration: int
+
+
+# Nombres que genera la caché de audio: sha1 de la URL + .opus (terminada) o .part (en curso).
+AUDIO_CACHE_FILE_RE = re.compile(r"[0-9a-f]{40}\.(?:opus|part)")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AudioCache:
+    """Caché en disco (Ogg/Opus) de las canciones que más se repiten.
+
+    Las reproducciones se cuentan en SQLite y, al llegar a `min_plays`, la pista se descarga en
+    segundo plano. El índice vive en memoria en orden LRU y se desaloja hasta caber en `max_bytes`.
+    Los métodos que tocan disco o base de datos son síncronos: el cog los llama desde un executor.
+    """
+
+    UNCACHE_SQL = (
+        "UPDATE audio_tracks SET filename = NULL, size = NULL, checksum = NULL, cached_at = NULL WHERE webpage_url = ?"
+    )
+
+    def __init__(self, db, directory, max_bytes, min_plays, max_duration, max_tracked=20000):
+        self.db = db
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = max(1, min_plays)
+        self.max_duration = max_duration
+        self.max_tracked = max_tracked
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        # Entradas descartadas desde el event loop; su archivo y su fila se limpian en la próxima escritura.
+        self.discarded = deque()
+        self.plays_recorded = 0
+        self.hits = 0
+        self.misses = 0
+        self.downloads = Counter()
+        self.evictions = 0
+        self.corrupt = 0
+        os.makedirs(directory, exist_ok=True)
+        db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS audio_tracks (
+                webpage_url TEXT PRIMARY KEY,
+                plays INTEGER NOT NULL,
+                last_played REAL NOT NULL,
+                filename TEXT,
+                size INTEGER,
+                checksum TEXT,
+                duration INTEGER,
+                cached_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS audio_tracks_last_played ON audio_tracks (last_played);
+            """
+        )
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def part_path(self, webpage_url):
+        return self.path(hashlib.sha1(webpage_url.encode()).hexdigest() + ".part")
+
+    def load(self):
+        """Reconstruye el índice comprobando que cada archivo existe y conserva su tamaño."""
+        rows = self.db.query(
+            "SELECT webpage_url, filename, size, checksum, duration FROM audio_tracks "
+            "WHERE filename IS NOT NULL ORDER BY last_played"
+        )
+        lost = []
+        with self.lock:
+            for row in rows:
+                try:
+                    intact = os.path.getsize(self.path(row["filename"])) == row["size"]
+                except OSError:
+                    intact = False
+                if not intact:
+                    lost.append(row["webpage_url"])
+                    continue
+                self.entries[row["webpage_url"]] = CachedAudio(
+                    row["filename"], row["size"], row["checksum"], row["duration"]
+                )
+                self.total_bytes += row["size"]
+
+        if lost:
+            self.corrupt += len(lost)
+            self.db.run_batch([(self.UNCACHE_SQL, (url,)) for url in lost])
+        # Descargas a medias y archivos que ya no figuran en la base de datos. Solo se tocan nombres
+        # creados por la caché: la carpeta puede ser compartida (p. ej. la de la base SQLite).
+        known = {entry.filename for entry in self.entries.values()}
+        for name in os.listdir(self.directory):
+            if name not in known and AUDIO_CACHE_FILE_RE.fullmatch(name):
+                self.remove_file(name)
+        self.evict()
+        return len(self.entries)
+
+    def remove_file(self, filename):
+        try:
+            os.remove(self.path(filename))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning(f"No se pudo borrar {filename} de la caché de audio: {e}")
+
+    def contains(self, webpage_url):
+        return webpage_url in self.entries
+
+    def lookup(self, webpage_url):
+        """Ruta local de la pista si está en caché y el archivo sigue íntegro; si no, None."""
+        with self.lock:
+            entry = self.entries.get(webpage_url)
+            if entry is None:
+                self.misses += 1
+                return None
+            path = self.path(entry.filename)
+            try:
+                intact = os.path.getsize(path) == entry.size
+            except OSError:
+                intact = False
+            if not intact:
+                # Archivo borrado o truncado fuera del bot: se olvida y se vuelve al stream.
+                self.corrupt += 1
+                self.misses += 1
+                self.drop(webpage_url)
+                return None
+            self.entries.move_to_end(webpage_url)
+            self.hits += 1
+            return path
+
+    def drop(self, webpage_url):
+        # Llamar con self.lock tomado.
+        entry = self.entries.pop(webpage_url, None)
+        if entry:
+            self.total_bytes -= entry.size
+            self.discarded.append((webpage_url, entry.filename))
+
+    def flush_discarded(self):
+        statements = []
+        while self.discarded:
+            webpage_url, filename = self.discarded.popleft()
+            self.remove_file(filename)
+            statements.append((self.UNCACHE_SQL, (webpage_url,)))
+        if statements:
+            self.db.run_batch(statements)
+
+    def record_play(self, webpage_url):
+        """Suma una reproducción y devuelve el total de la pista."""
+        self.flush_discarded()
+        rows = self.db.query(
+            "INSERT INTO audio_tracks (webpage_url, plays, last_played) VALUES (?, 1, ?) "
+            "ON CONFLICT (webpage_url) DO UPDATE SET plays = plays + 1, last_played = excluded.last_played "
+            "RETURNING plays",
+            (webpage_url, time.time()),
+        )
+        self.plays_recorded += 1
+        if self.plays_recorded % 500 == 0:
+            # El recuento de pistas sin archivo no crece sin límite: se olvidan las menos recientes.
+            self.db.execute(
+                "DELETE FROM audio_tracks WHERE webpage_url IN ("
+                "SELECT webpage_url FROM audio_tracks WHERE filename IS NULL "
+                "ORDER BY last_played DESC LIMIT -1 OFFSET ?)",
+                (self.max_tracked,),
+            )
+        return rows[0]["plays"] if rows else 1
+
+    def wants(self, webpage_url, plays, duration):
+        # Sin duración conocida puede ser un directo: no se descarga.
+        return (
+            plays >= self.min_plays
+            and 0 < (duration or 0) <= self.max_duration
+            and webpage_url not in self.entries
+        )
+
+    def store(self, webpage_url, part_path, duration):
+        """Mueve una descarga terminada a la caché y desaloja lo necesario. Devuelve la entrada o None."""
+        size = os.path.getsize(part_path)
+        if not size or size > self.max_bytes:
+            os.remove(part_path)
+            return None
+        checksum = file_sha256(part_path)
+        filename = os.path.basename(part_path)[: -len(".part")] + ".opus"
+        os.replace(part_path, self.path(filename))
+        entry = CachedAudio(filename, size, checksum, int(duration or 0))
+
+        self.db.execute(
+            "UPDATE audio_tracks SET filename = ?, size = ?, checksum = ?, duration = ?, cached_at = ? "
+            "WHERE webpage_url = ?",
+            (filename, size, checksum, entry.duration, time.time(), webpage_url),
+        )
+        with self.lock:
+            # El nombre sale de la URL: una entrada previa apunta al mismo archivo, ya reemplazado.
+            previous = self.entries.pop(webpage_url, None)
+            if previous:
+                self.total_bytes -= previous.size
+            self.entries[webpage_url] = entry
+            self.total_bytes += size
+        self.evict()
+        return entry
+
+    def evict(self):
+        """Desaloja las pistas menos recientes hasta caber en el presupuesto de disco."""
+        with self.lock:
+            while self.total_bytes > self.max_bytes and self.entries:
+                webpage_url = next(iter(self.entries))
+                self.drop(webpage_url)
+                self.evictions += 1
+        self.flush_discarded()
+
+    def verify(self):
+        """Recalcula el checksum de cada archivo. Devuelve (comprobadas, dañadas)."""
+        with self.lock:
+            snapshot = list(self.entries.items())
+        broken = []
+        for webpage_url, entry in snapshot:
+            try:
+                intact = file_sha256(self.path(entry.filename)) == entry.checksum
+            except OSError:
+                intact = False
+            if not intact:
+                broken.append(webpage_url)
+
+        with self.lock:
+            for webpage_url in broken:
+                self.drop(webpage_url)
+        self.corrupt += len(broken)
+        self.flush_discarded()
+        return len(snapshot), len(broken)
+
+    def purge(self):
+        with self.lock:
+            removed = len(self.entries)
+            for webpage_url in list(self.entries):
+                self.drop(webpage_url)
+        self.flush_discarded()
+        return removed
+
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def describe(self):
+        mb = 1024 * 1024
+        return (
+            f"{len(self.entries)} pistas · {self.total_bytes / mb:.0f}/{self.max_bytes / mb:.0f} MB · "
+            f"{self.hit_ratio():.0%} aciertos ({self.hits}/{self.hits + self.misses}) · "
+            f"descargas {self.downloads['ok']} ok, {self.downloads['error']} fallidas · "
+            f"{self.evictions} desalojos · {self.corrupt} dañadas"
+        )
 
 
 def is_youtube_playlist_url(value):
@@ -190,22 +1860,175 @@ def is_youtube_playlist_url(value):
     return "/playlist" in parsed.path
 
 class Musica(commands.Cog):
+    # Estado que pasa intacto a la nueva instancia en una recarga en caliente (/reload).
+    HANDOFF_ATTRS = (
+        "queues",
+        "current_song",
+        "guild_settings",
+        "disconnect_timer",
+        "guild_locks",
+        "prefetch_tasks",
+        "prefetch_versions",
+        "warm_sources",
+        "queue_render_cache",
+        "import_tasks",
+        "stream_cache",
+        "failed_streams",
+        "extractor_breaker",
+        "breaker_retry",
+        "profile_stats",
+        "phase_stats",
+        "song_failures",
+        "loop_lag",
+        "loop_lag_task",
+        "metrics_server",
+        "extractions",
+        "extraction_scheduler",
+        "db",
+        "spotify_matches",
+        "search_cache",
+        "state_store",
+        "state_restored",
+        "state_saved",
+        "restored_queues",
+        "audio_cache",
+        "audio_downloads",
+        "audio_download_slots",
+        "spotify_client",
+    )
+
     def __init__(self, bot):
         self.bot = bot
+        # En /reload la instancia anterior deja su estado en bot.musica_handoff. Solo se adopta si el código
+        # que lo maneja no cambió; si cambió, se cierra todo lo anterior y se arranca de cero.
+        handoff = getattr(bot, "musica_handoff", None) if getattr(bot, "hot_reload", False) else None
+        hot = bool(handoff) and HANDOFF_FINGERPRINT is not None and handoff.get("fingerprint") == HANDOFF_FINGERPRINT
+        if hot:
+            # Mismas clases que el módulo anterior: isinstance y except siguen valiendo para el trabajo en curso.
+            globals().update(handoff["classes"])
+        elif handoff:
+            self.release_handoff(handoff)
+            bot.musica_handoff = None
+            bot.hot_reload_result = (
+                "en frío: cambió el código del estado compartido, así que se detuvo la música "
+                "y las colas quedaron guardadas para /resume"
+            )
+
         self.queues = {}
         self.current_song = {}
-        self.default_volume = 0.05
         self.disconnect_timer = {}
         self.guild_locks = {}
+        # Valores de fábrica; cada servidor puede cambiarlos con /volume y /musicconfig.
+        self.default_volume = 0.05
         self.max_queue_size = 300
+        self.max_request_size = 150
+        self.idle_timeout = 300
+
+        # Prefetch: resolución anticipada de las próximas canciones de cada cola.
+        self.prefetch_depth = max(0, env_int("MUSIC_PREFETCH_DEPTH", 2))
+        self.prefetch_warm_ffmpeg = env_flag("MUSIC_PREFETCH_WARM_FFMPEG", False)
+        self.prefetch_max_age = 1800
+        self.prefetch_tasks = {}
+        self.prefetch_versions = {}
+        self.warm_sources = {}
+        self.queue_render_cache = {}
+
+        # Importaciones de playlists en segundo plano (cancelables con /stop y /clear).
+        self.import_tasks = {}
+        self.import_concurrency = max(1, env_int("MUSIC_IMPORT_CONCURRENCY", 3))
+        self.import_progress_interval = 3.0
+
+        # Caché compartida entre servidores: webpage_url -> info de stream resuelta.
+        self.stream_cache = TTLCache(env_int("MUSIC_STREAM_CACHE_SIZE", 512), STREAM_CACHE_DEFAULT_TTL)
+        # URLs que fallaron por motivos del propio vídeo (privado, región, borrado...).
+        self.failed_streams = TTLCache(env_int("MUSIC_NEGATIVE_CACHE_SIZE", 2048), NEGATIVE_CACHE_TTL)
+        self.extractor_breaker = CircuitBreaker(
+            threshold=env_int("MUSIC_BREAKER_THRESHOLD", 5),
+            window=60,
+            cooldown=env_int("MUSIC_BREAKER_COOLDOWN", 60),
+        )
+        self.breaker_retry = {}
+        # Resolución con cobertura: si el perfil preferido tarda más que su p90, se lanza el otro en paralelo.
+        self.hedged_resolve = env_flag("MUSIC_HEDGED_RESOLVE", True)
+        self.profile_stats = {profile: ProfileStats(profile) for profile in STREAM_PROFILES}
+        # Tiempos por fase de /play y de los cambios de canción (consultables con /musicdiag).
+        self.phase_stats = PhaseStats(slow_threshold=env_int("MUSIC_SLOW_SPAN_SECONDS", 8))
+        # Canciones que no se pudieron reproducir, por motivo.
+        self.song_failures = Counter()
+        # Extracciones en curso compartidas por clave normalizada (búsqueda, playlist flat y stream).
+        self.extractions = SingleFlight()
+        self.extraction_scheduler = None
+
+        self.db = None
+        self.spotify_matches = None
+        self.state_store = None
+        self.guild_settings = None
+
+        # Métricas: lag del event loop y endpoint HTTP opcional en formato Prometheus.
+        self.loop_lag = LoopLagMonitor(threshold=env_int("MUSIC_LOOP_LAG_THRESHOLD_MS", 250) / 1000)
+        self.loop_lag_task = None
+        self.metrics_server = None
+        self.metrics_host = os.getenv("MUSIC_METRICS_HOST") or "127.0.0.1"
+        self.metrics_port = env_int("MUSIC_METRICS_PORT", 0)
+        self.ffmpeg_version_text = None
+
+        # Cola y canción actual persistentes: se restauran por servidor en su primer comando
+        # y los cambios se escriben agrupados cada pocos segundos.
+        self.state_flush_interval = max(1, env_int("MUSIC_STATE_FLUSH_SECONDS", 2))
+        self.state_restored = set()
+        self.state_saved = {}
+        # Cola guardada que aún no se ha recuperado: solo /resume la devuelve a la cola real.
+        self.restored_queues = {}
+        self.state_flush_task = None
+        self.search_cache = None
+
+        # Caché de audio en disco para las canciones que más se repiten (0 MB = desactivada).
+        self.audio_cache = None
+        self.audio_downloads = {}
+        self.audio_download_slots = asyncio.Semaphore(1)
+        self.audio_download_timeout = 600
+        self.spotify_client = None
+
+        if hot:
+            # No se consume el traspaso: si la carga falla, el módulo anterior vuelve a tomarlo.
+            self.adopt_handoff(handoff)
+            bot.hot_reload_result = "en caliente: colas, cachés y música en curso se conservan"
+        else:
+            self.open_resources()
+
+    def open_resources(self):
+        """Hilos de yt-dlp, base de datos, cachés persistentes y cliente de Spotify; una recarga en caliente los hereda."""
+        self.extraction_scheduler = ExtractionScheduler(
+            env_int("MUSIC_EXTRACT_WORKERS", 4), initializer=ytdl_pool.warm_up
+        )
+
+        try:
+            self.db = MusicDatabase(os.path.join(resolve_data_dir(), "musica.sqlite3"))
+            self.spotify_matches = SpotifyMatchCache(
+                self.db,
+                env_int("MUSIC_SPOTIFY_CACHE_SIZE", 20000),
+                env_int("MUSIC_SPOTIFY_CACHE_MAX_AGE_DAYS", 30) * 86400,
+            )
+            self.state_store = QueueStateStore(self.db)
+        except Exception as e:
+            log.error(f"⚠️ No se pudo abrir la base de datos de música, sin persistencia: {e}")
+
+        self.guild_settings = GuildSettingsStore(
+            GuildSettings(self.default_volume, self.max_queue_size, self.max_request_size, self.idle_timeout),
+            db=self.db,
+        )
+
+        search_db = self.db if env_flag("MUSIC_SEARCH_CACHE_PERSIST", False) else None
+        self.search_cache = SearchCache(
+            env_int("MUSIC_SEARCH_CACHE_SIZE", 1000),
+            env_int("MUSIC_SEARCH_CACHE_TTL_HOURS", 24) * 3600,
+            db=search_db,
+        )
 
-        self.ytdl_stream_primary = yt_dlp.YoutubeDL(YTDL_STREAM_PRIMARY_OPTIONS)
-        self.ytdl_stream_fallback = yt_dlp.YoutubeDL(YTDL_STREAM_FALLBACK_OPTIONS)
+        self.open_audio_cache()
 
         spotify_client_id = os.getenv("SPOTIFY_CLIENT_ID")
         spotify_client_secret = os.getenv("SPOTIFY_CLIENT_SECRET")
-        self.spotify_client = None
-
         if spotify_client_id and spotify_client_secret:
             try:
                 spotify_auth_manager = SpotifyClientCredentials(
@@ -220,13 +2043,268 @@ class Musica(commands.Cog):
         else:
             log.warning("🚫 Credenciales de Spotify no encontradas. Spotify deshabilitado.")
 
+    def adopt_handoff(self, handoff):
+        """Toma el estado de la instancia anterior (misma huella de código, así que trae todos los atributos)."""
+        global ytdl_pool
+        for name in self.HANDOFF_ATTRS:
+            setattr(self, name, handoff[name])
+
+        # Las instancias de yt-dlp solo se reutilizan si las opciones no cambiaron con la recarga.
+        if handoff["ytdl_pool"].profiles == YTDL_PROFILES:
+            ytdl_pool = handoff["ytdl_pool"]
+        if self.audio_cache is None:
+            self.open_audio_cache()
+        if self.state_restored:
+            self.ensure_state_flush()
+        log.info(f"♻️ Cog de música recargado: {len(self.queues)} colas y {len(self.current_song)} canciones en curso.")
+
+    def release_handoff(self, handoff):
+        """Recarga en frío: guarda las colas que dejó la instancia anterior, cierra sus recursos y corta la voz.
+
+        Solo usa atributos y métodos por nombre, así vale para instancias de clases de otra versión.
+        """
+        # Un traspaso de una versión anterior puede no traer los atributos nuevos.
+        self.restored_queues = {}
+        for name in self.HANDOFF_ATTRS:
+            if name in handoff:
+                setattr(self, name, handoff[name])
+        self.state_flush_task = None
+        # Fuerza a escribir todos los servidores restaurados, aunque no hayan cambiado.
+        self.state_saved = {}
+        try:
+            self.release_resources()
+        except Exception as e:
+            log.error(f"⚠️ Error cerrando la instancia anterior del cog de música: {e}")
+        # Sin cola ni canción, los callbacks del código anterior no arrancan nada más al cortar la voz.
+        for queue in self.queues.values():
+            queue.clear()
+        self.current_song.clear()
+        for vc in list(getattr(self.bot, "voice_clients", [])):
+            self.bot.loop.create_task(vc.disconnect(force=True))
+        log.info("♻️ Recarga en frío del cog de música: estado anterior guardado y liberado.")
+
+    def cog_unload(self):
+        if getattr(self.bot, "hot_reload", False):
+            # Recarga en caliente: nada se cancela ni se cierra, la nueva instancia lo recoge todo.
+            if self.state_flush_task:
+                self.state_flush_task.cancel()
+            handoff = {name: getattr(self, name) for name in self.HANDOFF_ATTRS}
+            handoff["ytdl_pool"] = ytdl_pool
+            handoff["fingerprint"] = HANDOFF_FINGERPRINT
+            handoff["classes"] = {name: globals()[name] for name in HANDOFF_CLASSES}
+            self.bot.musica_handoff = handoff
+            return
+
+        self.bot.musica_handoff = None
+        self.release_resources()
+
+    def release_resources(self):
+        if self.loop_lag_task:
+            self.loop_lag_task.cancel()
+        self.loop_lag.stop()
+        if self.metrics_server:
+            self.metrics_server.close()
+        for server_id in list(self.import_tasks):
+            self.cancel_imports(server_id)
+        for server_id in list(self.breaker_retry):
+            self.cancel_breaker_retry(server_id)
+        for server_id in set(self.prefetch_tasks) | set(self.warm_sources):
+            self.clear_prefetch(server_id)
+        for task in list(self.audio_downloads.values()):
+            task.cancel()
+        self.extraction_scheduler.shutdown()
+        if self.state_flush_task:
+            self.state_flush_task.cancel()
+        if self.state_store:
+            try:
+                self.state_store.save_many(self.collect_state_changes())
+            except Exception as e:
+                log.error(f"⚠️ No se pudo guardar el estado de las colas al descargar el cog: {e}")
+        if self.spotify_matches:
+            try:
+                self.spotify_matches.flush_touched()
+            except Exception as e:
+                log.error(f"⚠️ No se pudo guardar el uso de la caché de Spotify: {e}")
+        if self.db:
+            self.db.close()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # on_ready se repite tras reconectar: solo se arranca lo que no esté ya en marcha.
+        if self.loop_lag_task is None or self.loop_lag_task.done():
+            self.loop_lag_task = self.bot.loop.create_task(self.loop_lag.run())
+        if self.metrics_port and self.metrics_server is None:
+            try:
+                self.metrics_server = await asyncio.start_server(
+                    self.handle_metrics_request, self.metrics_host, self.metrics_port
+                )
+                log.info(f"📈 Métricas disponibles en http://{self.metrics_host}:{self.metrics_port}/metrics")
+            except OSError as e:
+                log.error(f"⚠️ No se pudo abrir el puerto de métricas {self.metrics_port}: {e}")
+        if self.search_cache.db and not self.search_cache.loaded:
+            # Se lee en un executor para no bloquear el event loop al arrancar.
+            self.search_cache.loaded = True
+            try:
+                loaded = self.search_cache.restore(await self.db_call(self.search_cache.load))
+                if loaded:
+                    log.info(f"🔎 Caché de búsquedas restaurada: {loaded} entradas.")
+            except Exception as e:
+                log.error(f"⚠️ No se pudo restaurar la caché de búsquedas: {e}")
+
+    async def handle_metrics_request(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # Se descartan las cabeceras: basta con la línea de petición.
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+
+            parts = request_line.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) >= 2 else ""
+            if len(parts) >= 2 and parts[0] == "GET" and path in ("/metrics", "/"):
+                # Tras una recarga en caliente el servidor sigue abierto pero responde el cog nuevo.
+                cog = self.bot.get_cog(self.qualified_name) or self
+                status, content_type, body = "200 OK", "text/plain; version=0.0.4; charset=utf-8", cog.metrics_text()
+            else:
+                status, content_type, body = "404 Not Found", "text/plain; charset=utf-8", "not found\n"
+
+            payload = body.encode("utf-8")
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("latin-1") + payload
+            )
+            await asyncio.wait_for(writer.drain(), timeout=5)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        except Exception as e:
+            log.warning(f"Error sirviendo métricas: {e}")
+        finally:
+            writer.close()
+
+    def metrics_text(self):
+        """Métricas del cog en formato Prometheus. Solo lee contadores en memoria (nada de E/S)."""
+        m = MetricsWriter("johnbot_music_")
+        voice_clients = list(self.bot.voice_clients)
+        active = [vc for vc in voice_clients if vc.is_playing() or vc.is_paused()]
+        m.add("voice_clients", "gauge", "Conexiones de voz abiertas.", [(None, len(voice_clients))])
+        m.add("voice_clients_playing", "gauge", "Conexiones de voz reproduciendo o en pausa.", [(None, len(active))])
+        m.add(
+            "queued_tracks", "gauge", "Canciones en cola en todos los servidores.",
+            [(None, sum(len(queue) for queue in self.queues.values()))],
+        )
+        m.add(
+            "ffmpeg_processes", "gauge", "Procesos ffmpeg vivos (reproducción y fuentes precalentadas).",
+            [(None, len(active) + len(self.warm_sources))],
+        )
+
+        scheduler = self.extraction_scheduler
+        m.add("extraction_workers", "gauge", "Hilos del planificador de yt-dlp.", [(None, scheduler.workers)])
+        m.add("extraction_workers_busy", "gauge", "Hilos de yt-dlp ocupados.", [(None, scheduler.running)])
+        m.add(
+            "extraction_queue_depth", "gauge", "Extracciones esperando hilo, por prioridad.",
+            [({"priority": name}, scheduler.queue_depth(priority)) for priority, name in PRIORITY_NAMES.items()],
+        )
+        m.add(
+            "extractions_submitted_total", "counter", "Extracciones encoladas, por prioridad.",
+            [({"priority": name}, scheduler.submitted[priority]) for priority, name in PRIORITY_NAMES.items()],
+        )
+        m.add("extraction_timeouts_total", "counter", "Extracciones que superaron su timeout.", [(None, scheduler.timeouts)])
+        m.histogram(
+            "extraction_wait_seconds", "Espera en cola hasta obtener un hilo de yt-dlp.",
+            [({"priority": name}, scheduler.wait_histograms[priority]) for priority, name in PRIORITY_NAMES.items()],
+        )
+        m.histogram(
+            "extraction_duration_seconds", "Duración de las extracciones de yt-dlp en su hilo.",
+            [({"priority": name}, scheduler.run_histograms[priority]) for priority, name in PRIORITY_NAMES.items()],
+        )
+        m.add(
+            "stream_profile_success_ratio", "gauge", "Tasa de éxito reciente de cada perfil de stream.",
+            [
+                ({"profile": name}, stats.success_rate())
+                for name, stats in self.profile_stats.items()
+                if stats.success_rate() is not None
+            ],
+        )
+        m.add(
+            "extractor_breaker_open", "gauge", "1 si el circuito del extractor no está cerrado.",
+            [(None, int(self.extractor_breaker.state != CircuitBreaker.CLOSED))],
+        )
+
+        caches = {
+            "stream": (self.stream_cache.hits, self.stream_cache.misses, len(self.stream_cache)),
+            "failed_streams": (self.failed_streams.hits, self.failed_streams.misses, len(self.failed_streams)),
+            "search": (self.search_cache.memory.hits, self.search_cache.memory.misses, len(self.search_cache.memory)),
+        }
+        if self.spotify_matches:
+            matches = self.spotify_matches
+            caches["spotify"] = (matches.hits, matches.misses + matches.stale, None)
+        if self.audio_cache:
+            caches["audio"] = (self.audio_cache.hits, self.audio_cache.misses, len(self.audio_cache.entries))
+        m.add("cache_hits_total", "counter", "Aciertos de caché.", [({"cache": k}, v[0]) for k, v in caches.items()])
+        m.add("cache_misses_total", "counter", "Fallos de caché.", [({"cache": k}, v[1]) for k, v in caches.items()])
+        m.add(
+            "cache_hit_ratio", "gauge", "Proporción de aciertos de caché desde el arranque.",
+            [({"cache": k}, v[0] / (v[0] + v[1])) for k, v in caches.items() if v[0] + v[1]],
+        )
+        m.add(
+            "cache_entries", "gauge", "Entradas en memoria de cada caché.",
+            [({"cache": k}, v[2]) for k, v in caches.items() if v[2] is not None],
+        )
+
+        if self.audio_cache:
+            audio = self.audio_cache
+            m.add("audio_cache_bytes", "gauge", "Bytes ocupados por la caché de audio.", [(None, audio.total_bytes)])
+            m.add("audio_cache_max_bytes", "gauge", "Presupuesto de disco de la caché de audio.", [(None, audio.max_bytes)])
+            m.add(
+                "audio_cache_downloads_total", "counter", "Descargas a la caché de audio, por resultado.",
+                [({"result": result}, count) for result, count in sorted(audio.downloads.items())],
+            )
+            m.add(
+                "audio_cache_downloads_active", "gauge", "Descargas a la caché de audio pendientes.",
+                [(None, len(self.audio_downloads))],
+            )
+            m.add(
+                "audio_cache_evictions_total", "counter", "Pistas desalojadas por el presupuesto de disco.",
+                [(None, audio.evictions)],
+            )
+            m.add(
+                "audio_cache_corrupt_total", "counter", "Archivos de la caché descartados por no ser íntegros.",
+                [(None, audio.corrupt)],
+            )
+
+        m.add(
+            "song_failures_total", "counter", "Canciones que no se pudieron reproducir, por motivo.",
+            [({"reason": reason}, count) for reason, count in sorted(self.song_failures.items())],
+        )
+        m.histogram(
+            "phase_duration_seconds", "Duración de cada fase de /play y de los cambios de canción.",
+            [
+                ({"operation": kind, "source": source, "phase": phase}, histogram)
+                for (kind, source, phase), histogram in self.phase_stats.histograms.items()
+            ],
+        )
+        m.add("slow_operations_total", "counter", "Operaciones registradas como lentas.", [(None, self.phase_stats.slow)])
+        m.histogram("event_loop_lag_seconds", "Retraso del event loop al despertar.", [({}, self.loop_lag.histogram)])
+        m.add("event_loop_lag_max_seconds", "gauge", "Mayor retraso del event loop observado.", [(None, self.loop_lag.max)])
+        m.add(
+            "event_loop_stalls_total", "counter", "Bloqueos del event loop por encima del umbral del vigía.",
+            [(None, self.loop_lag.stalls)],
+        )
+        return m.text()
+
+    async def cog_before_invoke(self, ctx):
+        if ctx.guild:
+            await self.load_guild_settings(ctx.guild.id)
+            await self.restore_guild_state(ctx.guild.id)
+
     # ----------------------------
     # Helpers de diseño/mantenimiento
     # ----------------------------
     def get_queue(self, server_id):
         server_id = str(server_id)
         if server_id not in self.queues:
-            self.queues[server_id] = []
+            self.queues[server_id] = SongQueue()
         return self.queues[server_id]
 
     def get_lock(self, server_id):
@@ -236,51 +2314,458 @@ class Musica(commands.Cog):
         return self.guild_locks[server_id]
 
     def song_label(self, song):
-        return f"{song['titulo']} [{format_duration(song.get('duration'))}]"
+        return f"{song.titulo} [{format_duration(song.duration)}]"
+
+    def build_song(self, *, webpage_url, titulo, channel_id, duration, requested_by=None):
+        return Song(
+            webpage_url=webpage_url,
+            titulo=titulo or "Desconocido",
+            duration=int(duration or 0),
+            channel_id=shared_id(channel_id),
+            requested_by=shared_id(requested_by),
+        )
+
+    def create_audio_source(self, server_id, url_stream, before_options=None, codec=None):
+        before_options = before_options or FFMPEG_OPTIONS["before_options"]
+        volume = self.guild_settings.get(server_id).volume
+
+        if PLAYBACK_MODE == "opus":
+            if codec == "opus" and abs(volume - 1.0) < 1e-6:
+                # Passthrough: ni decodificación, ni escalado, ni re-codificación.
+                return discord.FFmpegOpusAudio(
+                    url_stream,
+                    codec="copy",
+                    executable=FFMPEG_EXECUTABLE,
+                    before_options=before_options,
+                    options=FFMPEG_OPTIONS["options"],
+                )
+            # El volumen va en el filtro de ffmpeg, que entrega Opus ya codificado.
+            return discord.FFmpegOpusAudio(
+                url_stream,
+                bitrate=OPUS_BITRATE,
+                executable=FFMPEG_EXECUTABLE,
+                before_options=before_options,
+                options=f"{FFMPEG_OPTIONS['options']} -af volume={volume:.4f}",
+            )
+
+        source = discord.FFmpegPCMAudio(
+            url_stream,
+            executable=FFMPEG_EXECUTABLE,
+            before_options=before_options,
+            options=FFMPEG_OPTIONS["options"],
+        )
+        return discord.PCMVolumeTransformer(source, volume=volume)
+
+    async def safe_send(self, channel_id, content):
+        try:
+            channel = self.bot.get_channel(channel_id)
+            if channel:
+                await channel.send(content)
+        except Exception as e:
+            log.warning(f"No se pudo enviar mensaje al canal {channel_id}: {e}")
+
+    def check_breaker(self):
+        if not self.extractor_breaker.allow():
+            raise ExtractorUnavailable(self.extractor_breaker.retry_after())
+
+    def record_extraction_result(self, error=None):
+        if isinstance(error, ExtractionQueueTimeout):
+            # Nunca llegó a yt-dlp: no dice nada de la salud del extractor.
+            return
+        if error is None or classify_extraction_error(error):
+            # Un vídeo privado/borrado significa que YouTube respondió: el extractor funciona.
+            self.extractor_breaker.record_success()
+        else:
+            self.extractor_breaker.record_failure()
+
+    async def run_extraction(self, key, fn, *, priority, guild_id, timeout):
+        if key in self.extractions.inflight:
+            self.extraction_scheduler.promote(key, priority)
+        return await self.extractions.run(key, lambda: self.run_guarded_extraction(key, fn, priority, guild_id, timeout))
+
+    async def run_guarded_extraction(self, key, fn, priority, guild_id, timeout):
+        self.check_breaker()
+        try:
+            result = await self.extraction_scheduler.run(
+                fn, priority=priority, guild_id=guild_id, timeout=timeout, key=key
+            )
+        except Exception as e:
+            self.record_extraction_result(e)
+            raise
+        self.record_extraction_result()
+        return result
+
+    async def extract_info_async(self, query, timeout=25, priority=PRIORITY_SEARCH, guild_id=None):
+        return await self.run_extraction(
+            ("info", normalize_extraction_key(query)),
+            lambda q=query: extract_info(q),
+            priority=priority,
+            guild_id=guild_id,
+            timeout=timeout,
+        )
+
+    async def extract_playlist_flat_async(self, query, timeout=35, priority=PRIORITY_BULK, guild_id=None):
+        return await self.run_extraction(
+            ("flat", normalize_extraction_key(query)),
+            lambda q=query: extract_playlist_flat_info(q),
+            priority=priority,
+            guild_id=guild_id,
+            timeout=timeout,
+        )
+
+    async def extract_metadata_async(self, url, timeout=25, priority=PRIORITY_BULK, guild_id=None):
+        return await self.run_extraction(
+            ("meta", normalize_extraction_key(url)),
+            lambda u=url: extract_metadata_info(u),
+            priority=priority,
+            guild_id=guild_id,
+            timeout=timeout,
+        )
+
+    async def resolve_stream_with_retry(self, source_query, retries=2, priority=PRIORITY_PLAYBACK, guild_id=None):
+        cached = self.stream_cache.get(source_query)
+        if cached:
+            return cached
+
+        failure = self.failed_streams.get(source_query)
+        if failure:
+            raise KnownBadVideo(source_query, failure["reason"])
+
+        key = ("stream", normalize_extraction_key(source_query))
+        if key in self.extractions.inflight:
+            self.extraction_scheduler.promote(key, priority)
+        return await self.extractions.run(
+            key,
+            lambda: self.resolve_stream_uncached(source_query, retries, key, priority, guild_id),
+        )
+
+    async def resolve_stream_uncached(self, source_query, retries, key, priority, guild_id):
+        last_error = None
+        for attempt in range(1, retries + 1):
+            self.check_breaker()
+            try:
+                info = await self.extract_stream_profiles(source_query, key, priority, guild_id)
+                self.record_extraction_result()
+                if info and info.get("url"):
+                    info = compact_stream_info(info)
+                    self.stream_cache.set(source_query, info, ttl=stream_url_ttl(info["url"]))
+                    return info
+                last_error = NoStreamFound("Stream sin URL")
+            except Exception as e:
+                self.record_extraction_result(e)
+                reason = classify_extraction_error(e)
+                if reason:
+                    self.failed_streams.set(
+                        source_query,
+                        {"reason": reason, "message": str(e)[:200]},
+                        ttl=NO_STREAM_CACHE_TTL if reason == "no_stream" else None,
+                    )
+                    raise KnownBadVideo(source_query, reason) from e
+                last_error = e
+
+            if attempt < retries:
+                # Backoff exponencial con jitter para no sincronizar reintentos entre servidores.
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1) + random.uniform(0, 0.25))
+        raise last_error or ValueError("No se pudo resolver stream")
+
+    def stream_profile_order(self):
+        """Perfil preferido primero: mejor tasa de éxito y, si empatan, menor latencia mediana."""
+        def score(profile):
+            stats = self.profile_stats[profile]
+            rate = stats.success_rate()
+            if rate is None or len(stats.outcomes) < 20:
+                return (0, 0.0, STREAM_PROFILES.index(profile))
+            p50 = stats.latencies.percentile(50) or 0.0
+            return (-round(rate * 20), p50, STREAM_PROFILES.index(profile))
+
+        return sorted(STREAM_PROFILES, key=score)
+
+    def hedge_delay(self, profile):
+        latencies = self.profile_stats[profile].latencies
+        if len(latencies) < 10:
+            return 3.0
+        return min(8.0, max(1.0, latencies.percentile(90)))
+
+    def run_stream_profile(self, source_query, profile, key, priority, guild_id):
+        stats = self.profile_stats[profile]
+        return self.bot.loop.create_task(
+            self.extraction_scheduler.run(
+                lambda q=source_query: extract_stream_info(q, profile, stats),
+                priority=priority,
+                guild_id=guild_id,
+                timeout=25,
+                key=key,
+            )
+        )
+
+    async def extract_stream_profiles(self, source_query, key, priority, guild_id):
+        preferred, backup = self.stream_profile_order()
+        first = self.run_stream_profile(source_query, preferred, key, priority, guild_id)
+        pending = {first: preferred}
+
+        if self.hedged_resolve:
+            done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(preferred))
+        else:
+            done, _ = await asyncio.wait({first})
+
+        first_error = None
+        if done:
+            if first.cancelled():
+                # shutdown() canceló el trabajo: el cog se está descargando.
+                raise RuntimeError("Planificador de yt-dlp detenido")
+            first_error = first.exception()
+            if classify_extraction_error(first_error):
+                # Privado, borrado, bloqueado...: el otro perfil devolvería el mismo error.
+                raise first_error
+        first_failed = bool(done) and (first_error is not None or not (first.result() or {}).get("url"))
+        if not done or first_failed:
+            if first_failed:
+                detail = first_error or "sin URL de stream"
+                log.warning(f"Fallo extracción con {preferred} para {source_query}: {detail}")
+            pending[self.run_stream_profile(source_query, backup, key, priority, guild_id)] = backup
+
+        last_error = None
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    profile = pending.pop(task)
+                    if task.cancelled():
+                        last_error = last_error or RuntimeError("Planificador de yt-dlp detenido")
+                        continue
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        continue
+                    info = task.result()
+                    if info and info.get("url"):
+                        self.profile_stats[profile].wins += 1
+                        return info
+        finally:
+            # El perdedor se cancela si aún espera turno; si ya corre en un hilo, su resultado se descarta.
+            for task in pending:
+                task.cancel()
+        # Un error real explica más que un resultado vacío; sin errores, el vídeo no tiene stream.
+        raise last_error or NoStreamFound(f"Stream sin URL para {source_query}")
+
+    # ----------------------------
+    # Prefetch de las próximas canciones
+    # ----------------------------
+    def refresh_prefetch(self, server_id):
+        """Sincroniza el prefetch con la cabeza actual de la cola."""
+        server_id = str(server_id)
+        queue = self.get_queue(server_id)
+        if self.prefetch_versions.get(server_id) == queue.version:
+            return
+        self.prefetch_versions[server_id] = queue.version
+
+        wanted = []
+        for song in queue.head(self.prefetch_depth):
+            source_query = song.webpage_url
+            if self.audio_cache and self.audio_cache.contains(source_query):
+                # Se reproducirá desde disco: no hace falta resolverla.
+                continue
+            if source_query and source_query not in wanted:
+                wanted.append(source_query)
+
+        tasks = self.prefetch_tasks.setdefault(server_id, {})
+        for source_query in list(tasks):
+            if source_query not in wanted:
+                tasks.pop(source_query).cancel()
+
+        warm = self.warm_sources.get(server_id)
+        if warm and (not wanted or warm[0] != wanted[0]):
+            self.discard_warm_source(server_id)
+
+        for source_query in wanted:
+            if source_query not in tasks:
+                tasks[source_query] = self.bot.loop.create_task(self.prefetch_stream(server_id, source_query))
+
+    def clear_prefetch(self, server_id):
+        server_id = str(server_id)
+        self.prefetch_versions.pop(server_id, None)
+        for task in self.prefetch_tasks.pop(server_id, {}).values():
+            task.cancel()
+        self.discard_warm_source(server_id)
+
+    def discard_warm_source(self, server_id):
+        warm = self.warm_sources.pop(str(server_id), None)
+        if warm:
+            try:
+                warm[1].cleanup()
+            except Exception as e:
+                log.warning(f"No se pudo liberar fuente precalentada: {e}")
+
+    async def prefetch_stream(self, server_id, source_query):
+        try:
+            info = await self.resolve_stream_with_retry(
+                source_query, retries=2, priority=PRIORITY_PREFETCH, guild_id=server_id
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.info(f"Prefetch falló para {source_query}: {e}")
+            return None
+
+        resolved_at = self.bot.loop.time()
+        if self.prefetch_warm_ffmpeg:
+            self.warm_up_source(server_id, source_query, info)
+        return info, resolved_at
+
+    def warm_up_source(self, server_id, source_query, info):
+        queue = self.queues.get(server_id)
+        if not queue or queue[0].webpage_url != source_query:
+            return
+        if server_id in self.warm_sources:
+            return
+
+        guild = self.bot.get_guild(int(server_id))
+        vc = guild.voice_client if guild else None
+        if vc is None or not (vc.is_playing() or vc.is_paused()):
+            return
+
+        try:
+            self.warm_sources[server_id] = (
+                source_query,
+                self.create_audio_source(server_id, info["url"], codec=info.get("acodec")),
+            )
+            log.info(f"🔥 Fuente precalentada para {source_query}")
+        except Exception as e:
+            log.warning(f"No se pudo precalentar ffmpeg para {source_query}: {e}")
+
+    async def take_prefetched(self, server_id, source_query):
+        """Devuelve (info, fuente_precalentada) si el prefetch ya resolvió esa URL."""
+        task = self.prefetch_tasks.get(server_id, {}).pop(source_query, None)
+        if task is not None and not task.done():
+            # El prefetch sigue encolado como PRIORITY_PREFETCH: ahora es la canción que suena ya.
+            self.extraction_scheduler.promote(("stream", normalize_extraction_key(source_query)), PRIORITY_PLAYBACK)
+        warm_source = None
+        warm = self.warm_sources.get(server_id)
+        if warm and warm[0] == source_query:
+            warm_source = self.warm_sources.pop(server_id)[1]
+
+        result = None
+        if task is not None:
+            try:
+                result = await task
+            except asyncio.CancelledError:
+                result = None
 
-    def build_song(self, *, webpage_url, titulo, channel_id, duration, requested_by=None):
-        return {
-            "url": webpage_url,
-            "webpage_url": webpage_url,
-            "titulo": titulo or "Desconocido",
-            "duration": duration or 0,
-            "channel_id": channel_id,
-            "requested_by": requested_by,
-        }
+        if result is None or self.bot.loop.time() - result[1] > self.prefetch_max_age:
+            if warm_source is not None:
+                warm_source.cleanup()
+            return None, None
+        return result[0], warm_source
 
-    async def safe_send(self, channel_id, content):
+    # ----------------------------
+    # Caché de audio en disco
+    # ----------------------------
+    def open_audio_cache(self):
+        max_mb = env_int("MUSIC_AUDIO_CACHE_MB", 0)
+        if max_mb <= 0:
+            return
+        if not self.db:
+            log.warning("🚫 La caché de audio necesita la base de datos de música: desactivada.")
+            return
         try:
-            channel = self.bot.get_channel(channel_id)
-            if channel:
-                await channel.send(content)
+            cache = AudioCache(
+                self.db,
+                os.path.abspath(os.path.expanduser(
+                    os.getenv("MUSIC_AUDIO_CACHE_DIR") or os.path.join(resolve_data_dir(), "audio")
+                )),
+                max_mb * 1024 * 1024,
+                env_int("MUSIC_AUDIO_CACHE_MIN_PLAYS", 3),
+                env_int("MUSIC_AUDIO_CACHE_MAX_MINUTES", 15) * 60,
+            )
+            loaded = cache.load()
         except Exception as e:
-            log.warning(f"No se pudo enviar mensaje al canal {channel_id}: {e}")
-
-    async def extract_info_async(self, query, timeout=25):
-        fut = self.bot.loop.run_in_executor(None, lambda q=query: ytdl.extract_info(q, download=False))
-        return await asyncio.wait_for(fut, timeout=timeout)
+            log.error(f"⚠️ No se pudo abrir la caché de audio: {e}")
+            return
+        self.audio_cache = cache
+        log.info(f"💽 Caché de audio: {loaded} pistas en disco ({cache.describe()}).")
 
-    async def extract_playlist_flat_async(self, query, timeout=35):
-        fut = self.bot.loop.run_in_executor(None, lambda q=query: extract_playlist_flat_info(q))
-        return await asyncio.wait_for(fut, timeout=timeout)
+    def local_audio_path(self, source_query):
+        return self.audio_cache.lookup(source_query) if self.audio_cache else None
 
-    async def resolve_stream_with_retry(self, source_query, retries=2):
-        last_error = None
-        for attempt in range(1, retries + 1):
-            try:
-                fut = self.bot.loop.run_in_executor(
-                    None,
-                    lambda q=source_query: extract_stream_info(q, self.ytdl_stream_primary, self.ytdl_stream_fallback),
-                )
-                info = await asyncio.wait_for(fut, timeout=25)
-                if info and info.get("url"):
-                    return info
-                last_error = ValueError("Stream sin URL")
-            except Exception as e:
-                last_error = e
-                if attempt < retries:
-                    await asyncio.sleep(0.6)
-        raise last_error or ValueError("No se pudo resolver stream")
+    async def count_track_play(self, song):
+        """Suma la reproducción y encarga la descarga si la pista ya es habitual."""
+        webpage_url = song.webpage_url
+        try:
+            plays = await self.db_call(self.audio_cache.record_play, webpage_url)
+        except Exception as e:
+            log.warning(f"No se pudo contar la reproducción de {webpage_url}: {e}")
+            return
+        if webpage_url in self.audio_downloads or not self.audio_cache.wants(webpage_url, plays, song.duration):
+            return
+        self.audio_downloads[webpage_url] = self.bot.loop.create_task(self.download_audio(song))
+
+    async def download_audio(self, song):
+        cache = self.audio_cache
+        webpage_url = song.webpage_url
+        part_path = cache.part_path(webpage_url)
+        try:
+            # Una descarga a la vez y con la prioridad más baja: nunca compite con lo que suena.
+            async with self.audio_download_slots:
+                info = await self.resolve_stream_with_retry(webpage_url, retries=1, priority=PRIORITY_BULK)
+                seconds = await self.run_audio_download(info, part_path)
+                # Integridad: una descarga cortada por la red también termina con código 0.
+                if song.duration and seconds < song.duration - 2:
+                    raise ValueError(f"descarga incompleta ({seconds:.0f}s de {song.duration}s)")
+                entry = await self.db_call(cache.store, webpage_url, part_path, song.duration)
+            if entry is None:
+                cache.downloads["skipped"] += 1
+                return
+            cache.downloads["ok"] += 1
+            log.info(f"💽 Guardada en caché: {self.song_label(song)} ({entry.size / 1024 / 1024:.1f} MB)")
+        except asyncio.CancelledError:
+            self.remove_partial_download(part_path)
+            raise
+        except Exception as e:
+            cache.downloads["error"] += 1
+            log.warning(f"No se pudo guardar en caché {self.song_label(song)}: {e}")
+            self.remove_partial_download(part_path)
+        finally:
+            self.audio_downloads.pop(webpage_url, None)
+
+    async def run_audio_download(self, info, part_path):
+        """Copia el stream a Ogg/Opus (sin recodificar si ya es Opus). Devuelve los segundos escritos."""
+        if info.get("acodec") == "opus":
+            codec = ["-c:a", "copy"]
+        else:
+            codec = ["-c:a", "libopus", "-b:a", f"{OPUS_BITRATE}k"]
+        proc = await asyncio.create_subprocess_exec(
+            FFMPEG_EXECUTABLE,
+            *FFMPEG_OPTIONS["before_options"].split(),
+            "-y", "-loglevel", "error", "-stats",
+            "-i", info["url"],
+            "-vn", "-map_metadata", "-1", *codec,
+            "-f", "ogg", part_path,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        try:
+            _, stderr = await asyncio.wait_for(proc.communicate(), timeout=self.audio_download_timeout)
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await proc.wait()
+
+        output = stderr.decode(errors="replace")
+        if proc.returncode != 0:
+            raise RuntimeError(f"ffmpeg terminó con código {proc.returncode}: {output.strip()[-200:]}")
+        # -stats informa del progreso como "time=HH:MM:SS.cc"; el último valor es lo escrito.
+        progress = re.findall(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)", output)
+        if not progress:
+            return 0.0
+        hours, minutes, seconds = progress[-1]
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    def remove_partial_download(self, part_path):
+        try:
+            os.remove(part_path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning(f"No se pudo borrar la descarga parcial {part_path}: {e}")
 
     # ----------------------------
     # Auto-desconexión
@@ -299,14 +2784,17 @@ class Musica(commands.Cog):
 
     async def run_disconnect_timer(self, server_id, channel_id):
         try:
-            await asyncio.sleep(300)
+            idle_timeout = self.guild_settings.get(server_id).idle_timeout
+            await asyncio.sleep(idle_timeout)
             guild = self.bot.get_guild(int(server_id))
             if guild and guild.voice_client:
                 vc = guild.voice_client
                 if not vc.is_playing() and not vc.is_paused():
                     await vc.disconnect()
                     self.cancel_disconnect_timer(server_id)
-                    await self.safe_send(channel_id, "😴 Desconectado automáticamente por inactividad (5 minutos).")
+                    await self.safe_send(
+                        channel_id, f"😴 Desconectado automáticamente por inactividad ({idle_timeout // 60} minutos)."
+                    )
         except asyncio.CancelledError:
             pass
         except Exception as e:
@@ -315,26 +2803,43 @@ class Musica(commands.Cog):
     # ----------------------------
     # Cola y reproducción
     # ----------------------------
-    def parse_removal_indices(self, cola_length, input_str):
-        indices_to_remove = set()
+    def parse_removal_ranges(self, cola_length, input_str):
+        """Convierte '3', '2-5' o '1,4' en intervalos [inicio, fin] base 0, recortados a la cola y fusionados.
+
+        Los rangos nunca se expanden: el coste depende de cuántas partes se escriban, no de los números.
+        """
+        intervals = []
         for part in input_str.split(","):
             part = part.strip()
             if not part:
                 continue
-            if "-" in part:
-                try:
+            try:
+                if "-" in part:
                     start, end = map(int, part.split("-"))
-                    for i in range(start, end + 1):
-                        indices_to_remove.add(i)
-                except ValueError:
-                    continue
+                else:
+                    start = end = int(part)
+            except ValueError:
+                continue
+
+            start, end = max(start, 1), min(end, cola_length)
+            if start <= end:
+                intervals.append((start - 1, end - 1))
+
+        merged = []
+        for start, end in sorted(intervals):
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
             else:
-                try:
-                    indices_to_remove.add(int(part))
-                except ValueError:
-                    continue
+                merged.append([start, end])
+        return merged
 
-        return sorted([i - 1 for i in indices_to_remove if 1 <= i <= cola_length], reverse=True)
+    def after_playback(self, server_id):
+        def next_song(error):
+            # Tras una recarga en caliente la canción siguiente la pide la instancia nueva del cog.
+            cog = self.bot.get_cog(self.qualified_name) or self
+            self.bot.loop.create_task(cog.on_song_end(server_id, error))
+
+        return next_song
 
     async def on_song_end(self, server_id, error):
         if error:
@@ -342,7 +2847,30 @@ class Musica(commands.Cog):
             log.warning(f"Finalizó canción con detalle: {error}")
         await self.play_next(server_id)
 
-    async def play_next(self, server_id):
+    def watch_first_packet(self, source, span):
+        """Cierra el span cuando el hilo del reproductor lee el primer paquete de audio de la fuente."""
+        loop = self.bot.loop
+        read = source.read
+
+        def first_read():
+            data = read()
+            at = time.perf_counter()
+            source.read = read
+            loop.call_soon_threadsafe(self.finish_first_packet, span, at)
+            return data
+
+        span.pending = True
+        source.read = first_read
+
+    def finish_first_packet(self, span, at):
+        span.mark("first_packet", at=at)
+        self.phase_stats.record(span)
+
+    async def play_next(self, server_id, span=None):
+        """Saca la siguiente canción de la cola y la reproduce.
+
+        `span` permite que /play siga midiendo sus fases hasta el primer paquete de audio.
+        """
         server_id = str(server_id)
         lock = self.get_lock(server_id)
 
@@ -352,53 +2880,620 @@ class Musica(commands.Cog):
                 return
 
             vc = guild.voice_client
+            queue = self.get_queue(server_id)
             if vc is None:
-                self.queues.get(server_id, []).clear()
+                queue.clear()
+                self.clear_prefetch(server_id)
                 return
 
             if vc.is_playing() or vc.is_paused():
                 return
 
-            if not self.queues.get(server_id):
+            if not queue:
                 self.current_song.pop(server_id, None)
+                self.clear_prefetch(server_id)
                 if vc.channel:
                     self.bot.loop.create_task(self.start_disconnect_timer(server_id, vc.channel.id))
                 return
 
             self.cancel_disconnect_timer(server_id)
 
-            next_item = self.queues[server_id].pop(0)
+            next_item = queue.popleft()
             self.current_song[server_id] = next_item
+            if span is None:
+                span = PhaseSpan("transition", server_id, "direct")
 
             try:
-                source_query = next_item.get("webpage_url") or next_item.get("url")
+                source_query = next_item.webpage_url
                 if not source_query:
                     raise ValueError("Canción sin URL de origen.")
 
-                fresh_info = await self.resolve_stream_with_retry(source_query, retries=2)
+                local_path = self.local_audio_path(source_query)
+                prefetched = False
+                if local_path:
+                    # Pista en la caché de audio: ni yt-dlp ni red, suena aunque YouTube no responda.
+                    fresh_info, source = {"url": local_path, "acodec": "opus", "extractor": "caché local"}, None
+                else:
+                    fresh_info, source = await self.take_prefetched(server_id, source_query)
+                    prefetched = fresh_info is not None
+                if fresh_info is None:
+                    fresh_info = await self.resolve_stream_with_retry(
+                        source_query, retries=2, priority=PRIORITY_PLAYBACK, guild_id=server_id
+                    )
                 url_stream = fresh_info.get("url")
                 if not url_stream:
                     raise ValueError("No se obtuvo URL de stream reproducible.")
+                if span.kind == "transition" and (prefetched or local_path):
+                    span.source = "disk" if local_path else "prefetch"
+                span.mark("resolve")
+
+                if source is None:
+                    source = self.create_audio_source(
+                        server_id,
+                        url_stream,
+                        before_options=LOCAL_FFMPEG_BEFORE_OPTIONS if local_path else None,
+                        codec=fresh_info.get("acodec"),
+                    )
+                span.mark("ffmpeg")
 
-                source = discord.FFmpegPCMAudio(url_stream, executable=FFMPEG_EXECUTABLE, **FFMPEG_OPTIONS)
-                source = discord.PCMVolumeTransformer(source, volume=self.default_volume)
-
-                log.info("🎵 Stream listo: %s | extractor=%s", self.song_label(next_item), fresh_info.get("extractor"))
-
-                def next_song(error):
-                    self.bot.loop.create_task(self.on_song_end(server_id, error))
+                log.info(
+                    "🎵 Stream listo: %s | extractor=%s | prefetch=%s",
+                    self.song_label(next_item),
+                    fresh_info.get("extractor"),
+                    prefetched,
+                )
 
-                vc.play(source, after=next_song)
-                await self.safe_send(next_item["channel_id"], f"▶️ Reproduciendo: **{self.song_label(next_item)}**")
+                self.watch_first_packet(source, span)
+                vc.play(source, after=self.after_playback(server_id))
+                self.refresh_prefetch(server_id)
+                if self.audio_cache:
+                    self.bot.loop.create_task(self.count_track_play(next_item))
+                await self.safe_send(next_item.channel_id, f"▶️ Reproduciendo: **{self.song_label(next_item)}**")
+
+            except ExtractorUnavailable as e:
+                # No se descarta la canción: vuelve a la cabeza y se reintenta cuando el circuito sondee.
+                self.song_failures["extractor_unavailable"] += 1
+                queue.appendleft(next_item)
+                self.current_song.pop(server_id, None)
+                self.schedule_breaker_retry(server_id, next_item.channel_id, e.retry_after)
+
+            except KnownBadVideo as e:
+                self.song_failures[e.reason] += 1
+                log.warning(f"Canción omitida {self.song_label(next_item)}: {e}")
+                await self.safe_send(
+                    next_item.channel_id,
+                    f"⚠️ No se pudo reproducir: **{self.song_label(next_item)}** "
+                    f"({NEGATIVE_REASON_LABELS.get(e.reason, e.reason)})",
+                )
+                self.bot.loop.create_task(self.play_next(server_id))
 
             except Exception as e:
+                self.song_failures["error"] += 1
                 log.error(f"Error preparando canción {self.song_label(next_item)}: {e}", exc_info=True)
-                await self.safe_send(next_item["channel_id"], f"⚠️ No se pudo reproducir: **{self.song_label(next_item)}**")
+                await self.safe_send(next_item.channel_id, f"⚠️ No se pudo reproducir: **{self.song_label(next_item)}**")
                 self.bot.loop.create_task(self.play_next(server_id))
 
+    def schedule_breaker_retry(self, server_id, channel_id, retry_after):
+        if server_id in self.breaker_retry:
+            return
+
+        async def retry():
+            try:
+                await asyncio.sleep(retry_after + random.uniform(0.5, 2.0))
+            finally:
+                self.breaker_retry.pop(server_id, None)
+            await self.play_next(server_id)
+
+        self.breaker_retry[server_id] = self.bot.loop.create_task(retry())
+        self.bot.loop.create_task(
+            self.safe_send(
+                channel_id,
+                f"⏳ YouTube no está respondiendo. Reintento automático en ~{max(1, int(retry_after))}s.",
+            )
+        )
+
+    def cancel_breaker_retry(self, server_id):
+        task = self.breaker_retry.pop(str(server_id), None)
+        if task:
+            task.cancel()
+
+    # ----------------------------
+    # Spotify (fuera del event loop)
+    # ----------------------------
+    async def spotify_call(self, fn, *args, **kwargs):
+        fut = self.bot.loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+        return await asyncio.wait_for(fut, timeout=20)
+
+    async def spotify_collect_pages(self, fetch_page, first_page, limit, page_size):
+        """Junta los items de todas las páginas (hasta `limit`), pidiendo el resto en paralelo."""
+        items = list((first_page or {}).get("items") or [])
+        total = min((first_page or {}).get("total") or len(items), limit)
+        offsets = range(len(items), total, page_size)
+        pages = await asyncio.gather(*(self.spotify_call(fetch_page, limit=page_size, offset=offset) for offset in offsets))
+        for page in pages:
+            items.extend((page or {}).get("items") or [])
+        return items[:limit]
+
+    async def resolve_spotify_link(self, entity_type, entity_id, limit):
+        """Devuelve (título, tracks a resolver) de un enlace track/playlist/album/artist."""
+        client = self.spotify_client
+
+        if entity_type == "track":
+            track = await self.spotify_call(client.track, entity_id)
+            item = spotify_track_item(track)
+            # Un track sin nombre o sin artistas (local, retirado...) no se puede buscar en YouTube.
+            return f"Canción Spotify: {(track or {}).get('name') or 'sin título'}", [item] if item else []
+
+        if entity_type == "playlist":
+            metadata, first_page = await asyncio.gather(
+                self.spotify_call(client.playlist, entity_id, fields="name"),
+                self.spotify_call(client.playlist_items, entity_id, limit=100, offset=0, additional_types=("track",)),
+            )
+            items = await self.spotify_collect_pages(
+                functools.partial(client.playlist_items, entity_id, additional_types=("track",)),
+                first_page,
+                limit,
+                page_size=100,
+            )
+            tracks = [item.get("track") for item in items if item]
+            title = metadata.get("name", "Playlist Spotify")
+        elif entity_type == "album":
+            album = await self.spotify_call(client.album, entity_id)
+            tracks = await self.spotify_collect_pages(
+                functools.partial(client.album_tracks, entity_id),
+                album.get("tracks"),
+                limit,
+                page_size=50,
+            )
+            title = album.get("name", "Álbum Spotify")
+        elif entity_type == "artist":
+            artist, top_tracks = await asyncio.gather(
+                self.spotify_call(client.artist, entity_id),
+                self.spotify_call(client.artist_top_tracks, entity_id),
+            )
+            tracks = top_tracks.get("tracks", [])
+            title = f"Top de {artist.get('name', 'artista')}"
+        else:
+            raise ValueError(f"Tipo de enlace Spotify no soportado: {entity_type}")
+
+        items = [item for item in map(spotify_track_item, tracks) if item]
+        return title, items[:limit]
+
+    # ----------------------------
+    # Resolución e importación de /play
+    # ----------------------------
+    def songs_from_entries(self, entries, *, channel_id, requested_by, limit):
+        songs = []
+        for entry in entries:
+            if len(songs) >= limit:
+                break
+            url_to_fetch = "desconocida"
+            try:
+                url_to_fetch = normalize_entry_url(entry)
+                if not url_to_fetch or not is_youtube_url(url_to_fetch):
+                    continue
+                if self.failed_streams.peek(url_to_fetch):
+                    log.info(f"Se omitió {url_to_fetch}: falló recientemente.")
+                    continue
+                songs.append(
+                    self.build_song(
+                        webpage_url=url_to_fetch,
+                        titulo=entry.get("title", "Desconocido"),
+                        duration=entry.get("duration") or 0,
+                        channel_id=channel_id,
+                        requested_by=requested_by,
+                    )
+                )
+            except Exception as song_e:
+                log.warning(f"⚠️ Se saltó una canción ({url_to_fetch}). Error: {song_e}")
+        return songs
+
+    async def db_call(self, fn, *args):
+        return await self.bot.loop.run_in_executor(None, functools.partial(fn, *args))
+
+    def db_call_background(self, fn, *args):
+        async def run():
+            try:
+                await self.db_call(fn, *args)
+            except Exception as e:
+                log.warning(f"Error escribiendo en la base de datos de música: {e}")
+
+        return self.bot.loop.create_task(run())
+
+    async def restore_guild_state(self, server_id):
+        """Recupera la cola guardada del servidor la primera vez que se usa tras arrancar."""
+        server_id = str(server_id)
+        if not self.state_store or server_id in self.state_restored:
+            return
+        self.state_restored.add(server_id)
+        self.ensure_state_flush()
+
+        try:
+            state = await self.db_call(self.state_store.load, server_id)
+        except Exception as e:
+            log.error(f"⚠️ No se pudo restaurar la cola de {server_id}: {e}")
+            # Sin saber qué hay guardado, mejor no sobrescribirlo.
+            self.state_restored.discard(server_id)
+            return
+
+        queue = self.get_queue(server_id)
+        if queue or self.current_song.get(server_id):
+            # Alguien usó la cola mientras se leía: gana lo que hay en memoria.
+            return
+        if state:
+            # La canción que sonaba al caer el bot encabeza la cola guardada; queda pendiente hasta /resume.
+            songs = ([state["current"]] if state["current"] else []) + state["queue"]
+            if songs:
+                self.restored_queues[server_id] = songs[: self.guild_settings.get(server_id).max_queue]
+                log.info(f"💾 Cola guardada para {server_id}: {len(songs)} canciones pendientes de /resume.")
+        self.state_saved[server_id] = (queue, queue.version, None)
+
+    async def load_guild_settings(self, server_id):
+        server_id = str(server_id)
+        store = self.guild_settings
+        if not store.db or server_id in store.loaded:
+            return
+        store.loaded.add(server_id)
+        try:
+            settings = await self.db_call(store.load, server_id)
+        except Exception as e:
+            log.error(f"⚠️ No se pudieron leer los ajustes de {server_id}: {e}")
+            return
+        if settings and server_id not in store.cache:
+            store.cache[server_id] = settings
+
+    def save_guild_settings(self, server_id, settings):
+        if self.guild_settings.db:
+            self.db_call_background(self.guild_settings.save, str(server_id), settings)
+
+    def restored_queue_hint(self, server_id):
+        restored = self.restored_queues.get(str(server_id))
+        if not restored:
+            return ""
+        return f"\n💾 Hay una cola guardada de {len(restored)} canciones: usa /resume para recuperarla o /clear para descartarla."
+
+    def ensure_state_flush(self):
+        if self.state_flush_task is None or self.state_flush_task.done():
+            self.state_flush_task = self.bot.loop.create_task(self.run_state_flush())
+
+    def collect_state_changes(self):
+        """Devuelve el estado de los servidores cuya cola o canción actual cambió desde la última escritura."""
+        changes = []
+        for server_id in self.state_restored:
+            queue = self.queues.get(server_id)
+            current = self.current_song.get(server_id)
+            saved = self.state_saved.get(server_id)
+            if saved and saved[0] is queue and saved[1] == (queue.version if queue else None) and saved[2] is current:
+                continue
+            self.state_saved[server_id] = (queue, queue.version if queue else None, current)
+            # La cola guardada sin recuperar se conserva detrás de la actual hasta que se use /resume o /clear.
+            pending = self.restored_queues.get(server_id, [])
+            changes.append((server_id, current, (list(queue) if queue else []) + pending))
+        return changes
+
+    async def run_state_flush(self):
+        while True:
+            await asyncio.sleep(self.state_flush_interval)
+            changes = self.collect_state_changes()
+            if not changes:
+                continue
+            try:
+                await self.db_call(self.state_store.save_many, changes)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"Error guardando el estado de las colas: {e}")
+                # Se reintentan en la próxima vuelta.
+                for server_id, _, _ in changes:
+                    self.state_saved.pop(server_id, None)
+
+    async def resolve_play_item(self, item, *, channel_id, requested_by, server_id, priority, limit):
+        """Resuelve un elemento de /play: texto/URL o un track de Spotify (con caché persistente)."""
+        if not isinstance(item, dict):
+            return await self.resolve_play_query(
+                item,
+                channel_id=channel_id,
+                requested_by=requested_by,
+                server_id=server_id,
+                priority=priority,
+                limit=limit,
+            )
+
+        if self.spotify_matches and (item.get("spotify_id") or item.get("isrc")):
+            try:
+                match = await self.db_call(self.spotify_matches.get, item.get("spotify_id"), item.get("isrc"))
+            except Exception as e:
+                log.warning(f"Error leyendo caché Spotify: {e}")
+                match = None
+            if match:
+                song = self.build_song(
+                    webpage_url=match["webpage_url"],
+                    titulo=match["title"],
+                    duration=match["duration"],
+                    channel_id=channel_id,
+                    requested_by=requested_by,
+                )
+                return [song], None
+
+        songs, title = await self.resolve_play_query(
+            item["query"],
+            channel_id=channel_id,
+            requested_by=requested_by,
+            server_id=server_id,
+            priority=priority,
+            limit=limit,
+        )
+        if songs and self.spotify_matches and (item.get("spotify_id") or item.get("isrc")):
+            try:
+                await self.db_call(
+                    self.spotify_matches.put,
+                    item.get("spotify_id"),
+                    item.get("isrc"),
+                    songs[0].webpage_url,
+                    songs[0].titulo,
+                    songs[0].duration,
+                )
+            except Exception as e:
+                log.warning(f"Error guardando caché Spotify: {e}")
+        return songs, title
+
+    async def resolve_play_query(self, search_query, *, channel_id, requested_by, server_id, priority, limit):
+        """Resuelve una búsqueda o URL de /play. Devuelve (canciones, título de la playlist o None)."""
+        if is_youtube_playlist_url(search_query):
+            # Las playlists van primero por la extracción flat: es mucho más barata y la metadata
+            # que falte se completa luego en segundo plano.
+            try:
+                flat_info = await self.extract_playlist_flat_async(
+                    search_query, timeout=35, priority=priority, guild_id=server_id
+                )
+                if flat_info and flat_info.get("entries"):
+                    songs = self.songs_from_entries(
+                        flat_info["entries"], channel_id=channel_id, requested_by=requested_by, limit=limit
+                    )
+                    if songs:
+                        self.schedule_metadata_fill(server_id, songs)
+                        return songs, flat_info.get("title")
+            except Exception as e:
+                log.warning(f"Extracción flat falló para playlist, probando extracción completa: {search_query}. Error: {e}")
+
+        extraction_query = make_extraction_query(search_query)
+        search_key = None
+        if extraction_query != search_query:
+            search_key = normalize_extraction_key(search_query)
+            cached = self.search_cache.get(search_key)
+            if cached:
+                song = self.build_song(
+                    webpage_url=cached["webpage_url"],
+                    titulo=cached["title"],
+                    duration=cached["duration"],
+                    channel_id=channel_id,
+                    requested_by=requested_by,
+                )
+                return [song], None
+
+        try:
+            info = await self.extract_info_async(
+                extraction_query,
+                timeout=25,
+                priority=priority,
+                guild_id=server_id,
+            )
+        except Exception as e:
+            log.warning(f"No se pudo extraer para: {search_query}. Error: {e}")
+            return [], None
+
+        if not info:
+            return [], None
+
+        if search_key:
+            songs = self.songs_from_entries(
+                info.get("entries") or [info], channel_id=channel_id, requested_by=requested_by, limit=1
+            )
+            if songs:
+                match = {
+                    "webpage_url": songs[0].webpage_url,
+                    "title": songs[0].titulo,
+                    "duration": songs[0].duration,
+                }
+                self.search_cache.put(search_key, match)
+                if self.search_cache.db:
+                    self.db_call_background(self.search_cache.persist, search_key, match)
+            return songs, None
+
+        if "entries" in info and info.get("entries"):
+            songs = self.songs_from_entries(info["entries"], channel_id=channel_id, requested_by=requested_by, limit=limit)
+            return songs, info.get("title")
+
+        if info.get("_type") == "playlist" and info.get("entries"):
+            info = info["entries"][0]
+        return self.songs_from_entries([info], channel_id=channel_id, requested_by=requested_by, limit=limit), None
+
+    def schedule_metadata_fill(self, server_id, songs):
+        missing = [song for song in songs if not song.duration or song.titulo == "Desconocido"]
+        if not missing:
+            return
+        task = self.bot.loop.create_task(self.fill_missing_metadata(server_id, missing))
+        tasks = self.import_tasks.setdefault(server_id, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def fill_missing_metadata(self, server_id, songs):
+        """Completa duración/título de entradas flat sin bloquear la importación ni tocar la caché de streams."""
+        queue = self.get_queue(server_id)
+        queued_urls, seen_version = None, None
+        pending = {}
+        filled = 0
+        for song in songs:
+            if queue.version != seen_version:
+                # Solo se recorre la cola otra vez si alguien la cambió (/remove, /clear, otra canción...).
+                queued_urls = {queued.webpage_url for queued in queue}
+                seen_version = queue.version
+            if song.webpage_url not in queued_urls or (song.duration and song.titulo != "Desconocido"):
+                continue
+
+            # Si el prefetch ya resolvió el stream, sus datos bastan y no hace falta extraer nada.
+            info = self.stream_cache.peek(song.webpage_url)
+            if info is None:
+                if self.failed_streams.peek(song.webpage_url):
+                    continue
+                try:
+                    info = await self.extract_metadata_async(
+                        song.webpage_url, priority=PRIORITY_BULK, guild_id=server_id
+                    )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    log.info(f"No se pudo completar metadata de {song.webpage_url}: {e}")
+                    continue
+            if not info:
+                continue
+
+            changes = {}
+            if not song.duration and info.get("duration"):
+                changes["duration"] = int(info["duration"])
+            if song.titulo == "Desconocido" and info.get("title"):
+                changes["titulo"] = info["title"]
+            if changes:
+                pending[id(song)] = (song, song.replace(**changes))
+            if len(pending) >= 10:
+                # Se aplican en lote: una sola pasada por la cola cada pocas canciones.
+                untouched = queue.version == seen_version
+                filled += queue.replace_many(pending)
+                pending = {}
+                if untouched:
+                    # El cambio de versión es nuestro: las URLs en cola siguen siendo las mismas.
+                    seen_version = queue.version
+
+        if pending:
+            filled += queue.replace_many(pending)
+        if filled:
+            log.info(f"📝 Metadata completada para {filled} canciones en {server_id}")
+
+    def start_import(self, ctx, server_id, items, **kwargs):
+        task = self.bot.loop.create_task(self.run_import(ctx, server_id, items, **kwargs))
+        tasks = self.import_tasks.setdefault(server_id, set())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    def cancel_imports(self, server_id):
+        for task in self.import_tasks.pop(str(server_id), set()):
+            task.cancel()
+
+    async def edit_progress(self, ctx, content):
+        try:
+            await ctx.followup.edit_message(message_id="@original", content=content)
+        except Exception as e:
+            log.warning(f"No se pudo actualizar el progreso de /play: {e}")
+
+    async def run_import(self, ctx, server_id, items, *, added, total, max_songs, playlist_title):
+        """Resuelve en segundo plano el resto de una importación y añade las canciones en orden."""
+        loop = self.bot.loop
+        semaphore = asyncio.Semaphore(self.import_concurrency)
+        results = [None] * len(items)
+        offset = total - len(items)
+        added = list(added)
+        # stopped: el bot salió del canal de voz; las tareas que quedan terminan sin resolver nada más.
+        state = {"next": 0, "resolved": 0, "last_update": loop.time(), "stopped": False}
+
+        def limit_reached():
+            max_queue = self.guild_settings.get(server_id).max_queue
+            return len(added) >= max_songs or len(self.get_queue(server_id)) >= max_queue
+
+        async def resolve(index, item):
+            async with semaphore:
+                if state["stopped"] or limit_reached():
+                    results[index] = []
+                    return
+                songs, _ = await self.resolve_play_item(
+                    item,
+                    channel_id=ctx.channel.id,
+                    requested_by=ctx.author.id,
+                    server_id=server_id,
+                    priority=PRIORITY_BULK,
+                    limit=1,
+                )
+                results[index] = songs
+            await flush()
+
+        async def flush():
+            state["resolved"] += 1
+            if state["stopped"]:
+                return
+            queue = self.get_queue(server_id)
+            appended = []
+            while state["next"] < len(results) and results[state["next"]] is not None:
+                for song in results[state["next"]]:
+                    if limit_reached():
+                        break
+                    appended.append(song)
+                    added.append(song)
+                results[state["next"]] = []
+                state["next"] += 1
+            if appended:
+                guild = self.bot.get_guild(int(server_id))
+                vc = guild.voice_client if guild else None
+                if vc is None:
+                    state["stopped"] = True
+                    del added[len(added) - len(appended):]
+                    return
+                queue.extend(appended)
+                self.refresh_prefetch(server_id)
+                if not vc.is_playing() and not vc.is_paused():
+                    await self.play_next(server_id)
+
+            now = loop.time()
+            if now - state["last_update"] >= self.import_progress_interval:
+                state["last_update"] = now
+                await self.edit_progress(
+                    ctx,
+                    f"🎶 Importando **{playlist_title}**: {offset + state['resolved']}/{total} resueltas "
+                    f"({len(added)} en cola).",
+                )
+
+        workers = [loop.create_task(resolve(i, item)) for i, item in enumerate(items)]
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            for worker in workers:
+                worker.cancel()
+            await self.edit_progress(
+                ctx, f"⏹️ Importación de **{playlist_title}** cancelada ({len(added)} canciones añadidas)."
+            )
+            raise
+        except Exception as e:
+            for worker in workers:
+                worker.cancel()
+            log.error(f"Error importando {playlist_title}: {e}", exc_info=True)
+
+        if state["stopped"]:
+            await self.edit_progress(
+                ctx,
+                f"⏹️ Importación de **{playlist_title}** detenida: el bot ya no está en un canal de voz "
+                f"({len(added)} canciones añadidas).",
+            )
+            return
+
+        total_secs = sum(song.duration for song in added)
+        msg = (
+            f"🎶 **{len(added)}** canciones de **{playlist_title}** añadidas "
+            f"({format_duration(total_secs)} en total)."
+        )
+        if len(added) >= max_songs:
+            msg += f" (Se limitó a {max_songs} canciones)."
+        await self.edit_progress(ctx, msg)
+
     # ----------------------------
     # Comandos
     # ----------------------------
+    def play_source_type(self, busqueda):
+        if "spotify.com" in busqueda:
+            return "spotify"
+        if is_youtube_playlist_url(busqueda):
+            return "youtube_playlist"
+        if is_likely_url(busqueda):
+            return "url"
+        return "search"
+
     @discord.slash_command(description="Busca y reproduce música (o añade a la cola).")
     @option("busqueda", str, description="URL o nombre de la canción.")
     async def play(self, ctx, busqueda: str):
@@ -409,6 +3504,7 @@ class Musica(commands.Cog):
 
         canal_usuario = ctx.author.voice.channel
         vc = None
+        span = PhaseSpan("play", ctx.guild.id, self.play_source_type(busqueda))
 
         try:
             for attempt in range(1, 3):
@@ -429,9 +3525,24 @@ class Musica(commands.Cog):
                     await asyncio.sleep(3)
                     if attempt == 2:
                         raise
+            span.mark("connect")
 
             await asyncio.sleep(0.3)
             await ctx.followup.edit_message(message_id="@original", content=f"🔎 Buscando: `{busqueda}`...")
+            span.mark("settle")
+
+            server_id = str(ctx.guild.id)
+            self.cancel_disconnect_timer(server_id)
+            queue = self.get_queue(server_id)
+
+            settings = self.guild_settings.get(server_id)
+            max_songs = min(settings.max_request, max(0, settings.max_queue - len(queue)))
+            if max_songs == 0:
+                await ctx.followup.edit_message(
+                    message_id="@original",
+                    content=f"⚠️ La cola alcanzó su límite ({settings.max_queue} canciones).",
+                )
+                return
 
             songs_to_process = []
             is_spotify_source = False
@@ -446,35 +3557,18 @@ class Musica(commands.Cog):
 
             if "spotify.com" in busqueda and self.spotify_client:
                 is_spotify_source = True
-                parsed_url = urllib.parse.urlparse(busqueda)
-                path_segments = [p for p in parsed_url.path.split("/") if p]
-
-                entity_type = path_segments[0] if len(path_segments) >= 1 else None
-                entity_id = path_segments[1].split("?")[0] if len(path_segments) >= 2 else None
+                entity_type, entity_id = parse_spotify_url(busqueda)
+                if entity_type not in SPOTIFY_ENTITY_TYPES or not entity_id:
+                    await ctx.followup.edit_message(
+                        message_id="@original",
+                        content="⚠️ Enlace Spotify no reconocido (solo track/playlist/album/artist).",
+                    )
+                    return
 
                 try:
-                    if entity_type == "track":
-                        track = self.spotify_client.track(entity_id)
-                        artist = track["artists"][0]["name"]
-                        title = track["name"]
-                        songs_to_process.append(create_youtube_search_query(artist, title))
-                        playlist_title = f"Canción Spotify: {title}"
-                    elif entity_type == "playlist":
-                        playlist_metadata = self.spotify_client.playlist(entity_id)
-                        playlist_title = playlist_metadata.get("name", "Playlist Spotify")
-                        playlist_tracks = self.spotify_client.playlist_items(entity_id, limit=50)
-                        for item in playlist_tracks.get("items", []):
-                            track = item.get("track") if item else None
-                            if track and track.get("name") and track.get("artists"):
-                                artist = track["artists"][0]["name"]
-                                title = track["name"]
-                                songs_to_process.append(create_youtube_search_query(artist, title))
-                    else:
-                        await ctx.followup.edit_message(
-                            message_id="@original",
-                            content="⚠️ Enlace Spotify no reconocido (solo track/playlist).",
-                        )
-                        return
+                    playlist_title, songs_to_process = await self.resolve_spotify_link(
+                        entity_type, entity_id, limit=max_songs
+                    )
                 except Exception as e:
                     log.error(f"Error al procesar Spotify: {e}")
                     await ctx.followup.edit_message(
@@ -482,116 +3576,74 @@ class Musica(commands.Cog):
                         content="⚠️ Error al procesar el enlace de Spotify.",
                     )
                     return
+                span.mark("spotify")
+                if not songs_to_process:
+                    await ctx.followup.edit_message(
+                        message_id="@original",
+                        content="⚠️ El enlace de Spotify no tiene canciones reproducibles (sin título o sin artista).",
+                    )
+                    return
             else:
                 songs_to_process.append(busqueda)
 
-            server_id = str(ctx.guild.id)
-            self.cancel_disconnect_timer(server_id)
-            queue = self.get_queue(server_id)
-
+            # Se resuelve solo hasta la primera canción válida; el resto se importa en segundo plano.
             songs_to_add = []
-            max_songs = min(150, max(0, self.max_queue_size - len(queue)))
-            if max_songs == 0:
-                await ctx.followup.edit_message(
-                    message_id="@original",
-                    content=f"⚠️ La cola alcanzó su límite ({self.max_queue_size} canciones).",
+            next_index = 0
+            while next_index < len(songs_to_process) and not songs_to_add:
+                item = songs_to_process[next_index]
+                next_index += 1
+                priority = PRIORITY_SEARCH
+                if isinstance(item, str) and is_youtube_playlist_url(item):
+                    priority = PRIORITY_BULK
+                songs, resolved_title = await self.resolve_play_item(
+                    item,
+                    channel_id=ctx.channel.id,
+                    requested_by=ctx.author.id,
+                    server_id=server_id,
+                    priority=priority,
+                    limit=max_songs,
                 )
-                return
-
-            for search_query in songs_to_process:
-                if len(songs_to_add) >= max_songs:
-                    break
-                url_to_fetch = "desconocida"
-                try:
-                    info = await self.extract_info_async(make_extraction_query(search_query), timeout=25)
-                    if not info:
-                        continue
-
-                    if "entries" in info and info.get("entries"):
-                        if not is_spotify_source:
-                            playlist_title = info.get("title", playlist_title)
-
-                        for entry in info["entries"]:
-                            if len(songs_to_add) >= max_songs:
-                                break
-                            try:
-                                url_to_fetch = normalize_entry_url(entry)
-                                if not url_to_fetch or not is_youtube_url(url_to_fetch):
-                                    continue
-                                titulo = entry.get("title", "Desconocido")
-                                duration = entry.get("duration") or 0
-                                songs_to_add.append(
-                                    self.build_song(
-                                        webpage_url=url_to_fetch,
-                                        titulo=titulo,
-                                        duration=duration,
-                                        channel_id=ctx.channel.id,
-                                        requested_by=ctx.author.id,
-                                    )
-                                )
-                            except Exception as song_e:
-                                log.warning(f"⚠️ Se saltó una canción ({url_to_fetch}). Error: {song_e}")
-                                continue
-                    else:
-                        if info.get("_type") == "playlist" and info.get("entries"):
-                            info = info["entries"][0]
-
-                        webpage = normalize_entry_url(info)
-                        if not webpage or not is_youtube_url(webpage):
-                            continue
-
-                        songs_to_add.append(
-                            self.build_song(
-                                webpage_url=webpage,
-                                titulo=info.get("title", "Desconocido"),
-                                duration=info.get("duration") or 0,
-                                channel_id=ctx.channel.id,
-                                requested_by=ctx.author.id,
-                            )
-                        )
-                except Exception as e:
-                    if is_youtube_playlist_url(search_query):
-                        log.warning(f"Extracción principal falló para playlist, probando fallback flat: {search_query}. Error: {e}")
-                        try:
-                            flat_info = await self.extract_playlist_flat_async(search_query, timeout=35)
-                            if not flat_info or not flat_info.get("entries"):
-                                continue
-
-                            if not is_spotify_source:
-                                playlist_title = flat_info.get("title", playlist_title)
-
-                            for entry in flat_info.get("entries", []):
-                                if len(songs_to_add) >= max_songs:
-                                    break
-                                try:
-                                    webpage = normalize_entry_url(entry)
-                                    if not webpage or not is_youtube_url(webpage):
-                                        continue
-                                    songs_to_add.append(
-                                        self.build_song(
-                                            webpage_url=webpage,
-                                            titulo=entry.get("title", "Desconocido"),
-                                            duration=entry.get("duration") or 0,
-                                            channel_id=ctx.channel.id,
-                                            requested_by=ctx.author.id,
-                                        )
-                                    )
-                                except Exception as song_e:
-                                    log.warning(f"⚠️ Se saltó una canción en fallback ({search_query}). Error: {song_e}")
-                            continue
-                        except Exception as fallback_e:
-                            log.warning(f"No se pudo extraer playlist con fallback flat para: {search_query}. Error: {fallback_e}")
-
-                    log.warning(f"No se pudo extraer para: {search_query}. Error: {e}")
-                    continue
+                if songs and resolved_title and not is_spotify_source:
+                    playlist_title = resolved_title
+                songs_to_add.extend(songs)
 
             if not songs_to_add:
                 return await ctx.followup.edit_message(
                     message_id="@original", content="⚠️ No se encontraron canciones válidas para reproducir."
                 )
+            span.mark("extract")
 
             queue.extend(songs_to_add)
-            total_secs = sum((s.get("duration") or 0) for s in songs_to_add)
+            self.refresh_prefetch(server_id)
+
+            started = False
+            if not vc.is_playing() and not vc.is_paused():
+                await self.play_next(server_id, span=span)
+                started = True
+            if not span.pending:
+                # Solo se encoló (o falló el arranque): el span termina aquí.
+                self.phase_stats.record(span)
+
+            remaining = songs_to_process[next_index:]
+            if remaining and len(songs_to_add) < max_songs:
+                msg = (
+                    f"🎶 Importando **{playlist_title}**: {next_index}/{len(songs_to_process)} resueltas "
+                    f"({len(songs_to_add)} en cola)."
+                )
+                msg += " Iniciando reproducción." if started else f" (Comienza en posición #{len(queue)})."
+                await ctx.followup.edit_message(message_id="@original", content=msg)
+                self.start_import(
+                    ctx,
+                    server_id,
+                    remaining,
+                    added=songs_to_add,
+                    total=len(songs_to_process),
+                    max_songs=max_songs,
+                    playlist_title=playlist_title,
+                )
+                return
+
+            total_secs = sum(song.duration for song in songs_to_add)
 
             if len(songs_to_add) > 1:
                 msg = (
@@ -605,11 +3657,11 @@ class Musica(commands.Cog):
                 msg = f"🎶 **{self.song_label(songs_to_add[0])}** añadida a la cola."
                 pos_start = len(queue)
 
-            if not vc.is_playing() and not vc.is_paused():
-                await self.play_next(server_id)
+            if started:
                 msg += " Iniciando reproducción."
             else:
                 msg += f" (Comienza en posición #{pos_start})."
+            msg += self.restored_queue_hint(server_id)
 
             await ctx.followup.edit_message(message_id="@original", content=msg)
 
@@ -625,7 +3677,8 @@ class Musica(commands.Cog):
         if len(cola) < 2:
             return await ctx.respond("⚠️ Necesitas al menos 2 canciones en cola para barajar.", ephemeral=False)
 
-        random.shuffle(cola)
+        cola.shuffle()
+        self.refresh_prefetch(server_id)
         await ctx.respond("🔀 **¡Cola barajada!**", ephemeral=False)
 
     @discord.slash_command(description="Mueve una canción de posición dentro de la cola.")
@@ -639,8 +3692,8 @@ class Musica(commands.Cog):
         if origen > len(cola) or destino > len(cola):
             return await ctx.respond(f"⚠️ Las posiciones deben estar entre 1 y {len(cola)}.", ephemeral=False)
 
-        song = cola.pop(origen - 1)
-        cola.insert(destino - 1, song)
+        song = cola.move(origen - 1, destino - 1)
+        self.refresh_prefetch(server_id)
         await ctx.respond(f"↕️ Movida: **{self.song_label(song)}** a posición #{destino}.", ephemeral=False)
 
     @discord.slash_command(description="Quita canciones de la cola por número, rangos (3-5) o comas (2,4,6).")
@@ -653,16 +3706,15 @@ class Musica(commands.Cog):
         if cola_length == 0:
             return await ctx.respond("📭 La cola está vacía.", ephemeral=False)
 
-        indices_to_remove = self.parse_removal_indices(cola_length, numero)
-        if not indices_to_remove:
+        ranges = self.parse_removal_ranges(cola_length, numero)
+        if not ranges:
             return await ctx.respond(
                 f"⚠️ Formato inválido o números fuera de rango (1 a {cola_length}).",
                 ephemeral=False,
             )
 
-        removed = []
-        for idx in indices_to_remove:
-            removed.append(self.song_label(cola.pop(idx)))
+        removed = [self.song_label(song) for song in cola.remove_ranges(ranges)]
+        self.refresh_prefetch(server_id)
 
         if len(removed) == 1:
             await ctx.respond(f"🗑️ Eliminada: **{removed[0]}**")
@@ -688,7 +3740,10 @@ class Musica(commands.Cog):
 
         if vc:
             self.cancel_disconnect_timer(server_id)
+            self.cancel_imports(server_id)
+            self.cancel_breaker_retry(server_id)
             self.get_queue(server_id).clear()
+            self.clear_prefetch(server_id)
             self.current_song.pop(server_id, None)
             vc.stop()
             await vc.disconnect()
@@ -713,6 +3768,30 @@ class Musica(commands.Cog):
     @discord.slash_command(description="Reanuda la canción pausada.")
     async def resume(self, ctx):
         vc = ctx.voice_client
+        server_id = str(ctx.guild.id)
+        restored = self.restored_queues.get(server_id)
+        if restored:
+            # Cola guardada antes de un reinicio: se añade a la cola y se reanuda desde ahí.
+            connected = vc and vc.is_connected()
+            if not connected and not ctx.author.voice:
+                return await ctx.respond("🔇 Entra a un canal de voz para recuperar la cola guardada.", ephemeral=True)
+            await ctx.defer()
+            self.restored_queues.pop(server_id, None)
+            self.state_saved.pop(server_id, None)
+            queue = self.get_queue(server_id)
+            added = restored[: max(0, self.guild_settings.get(server_id).max_queue - len(queue))]
+            queue.extend(added)
+            self.refresh_prefetch(server_id)
+            if not connected:
+                vc = await ctx.author.voice.channel.connect(timeout=60, reconnect=True)
+            if vc.is_paused():
+                vc.resume()
+            if vc.is_playing() or vc.is_paused():
+                return await ctx.followup.send(
+                    f"📥 Cola guardada añadida al final ({len(added)} canciones).", ephemeral=False
+                )
+            await self.play_next(server_id)
+            return await ctx.followup.send(f"▶️ Reanudando la cola guardada ({len(added)} canciones).", ephemeral=False)
         if not vc or not vc.is_connected():
             return await ctx.respond("🚫 El bot no está conectado al canal de voz.", ephemeral=False)
 
@@ -730,24 +3809,35 @@ class Musica(commands.Cog):
         cola = self.get_queue(server_id)
 
         if not cola:
-            return await ctx.respond(":man_shrugging: La cola está vacía.", ephemeral=False)
+            return await ctx.respond(
+                ":man_shrugging: La cola está vacía." + self.restored_queue_hint(server_id), ephemeral=False
+            )
 
-        total_secs = sum((song.get("duration") or 0) for song in cola)
-        txt = f"**📜 Cola de Reproducción ({len(cola)} canciones · {format_duration(total_secs)}):**\n"
-        for i, song in enumerate(cola):
-            if i >= 20:
-                txt += f"\n*...y {len(cola) - 20} más.*"
-                break
+        cached = self.queue_render_cache.get(server_id)
+        if cached and cached[0] == cola.version:
+            return await ctx.respond(cached[1])
+
+        txt = f"**📜 Cola de Reproducción ({len(cola)} canciones · {format_duration(cola.total_duration)}):**\n"
+        for i, song in enumerate(cola.head(20)):
             txt += f"**{i + 1}.** {self.song_label(song)}\n"
+        if len(cola) > 20:
+            txt += f"\n*...y {len(cola) - 20} más.*"
 
+        self.queue_render_cache[server_id] = (cola.version, txt)
         await ctx.respond(txt)
 
     @discord.slash_command(description="Borra todas las canciones de la cola.")
     async def clear(self, ctx):
         server_id = str(ctx.guild.id)
         queue = self.get_queue(server_id)
-        if queue:
+        importing = bool(self.import_tasks.get(server_id))
+        self.cancel_imports(server_id)
+        restored = self.restored_queues.pop(server_id, None)
+        if restored:
+            self.state_saved.pop(server_id, None)
+        if queue or importing or restored:
             queue.clear()
+            self.clear_prefetch(server_id)
             await ctx.respond("🗑️ La cola ha sido vaciada.", ephemeral=False)
         else:
             await ctx.respond("📭 La cola ya estaba vacía.", ephemeral=False)
@@ -755,15 +3845,66 @@ class Musica(commands.Cog):
     @discord.slash_command(name="volume", description="Ajusta el volumen (0-100).")
     @option("nivel", int, description="Porcentaje de volumen (0 a 100).", min_value=0, max_value=100)
     async def set_volume(self, ctx, nivel: int):
-        vc = ctx.voice_client
-        self.default_volume = nivel / 100.0
+        server_id = str(ctx.guild.id)
+        settings = self.guild_settings.update(server_id, volume=nivel / 100.0)
+        self.save_guild_settings(server_id, settings)
 
-        if vc and vc.is_playing() and isinstance(vc.source, discord.PCMVolumeTransformer):
-            vc.source.volume = self.default_volume
+        if self.apply_live_volume(server_id, ctx.voice_client, settings.volume):
             await ctx.respond(f"🔊 Volumen cambiado a **{nivel}%**.")
         else:
             await ctx.respond(f"🔊 Volumen configurado a **{nivel}%** (se aplicará en la próxima canción).")
 
+    def apply_live_volume(self, server_id, vc, volume):
+        """Ajusta el volumen de la fuente en curso (y de la precalentada) sin reiniciar ffmpeg.
+
+        Devuelve False si la fuente actual lleva el volumen dentro de ffmpeg (modo opus).
+        """
+        warm = self.warm_sources.get(server_id)
+        if warm:
+            if isinstance(warm[1], discord.PCMVolumeTransformer):
+                warm[1].volume = volume
+            else:
+                self.discard_warm_source(server_id)
+
+        source = vc.source if vc and (vc.is_playing() or vc.is_paused()) else None
+        if isinstance(source, discord.PCMVolumeTransformer):
+            source.volume = volume
+            return True
+        return source is None
+
+    @discord.slash_command(description="(MOD) Ajustes de música del servidor (sin opciones muestra los actuales).")
+    @discord.default_permissions(administrator=True)
+    @option("limite_cola", int, description="Canciones máximas en cola.", min_value=1, max_value=1000, required=False, default=None)
+    @option("limite_pedido", int, description="Canciones máximas por /play.", min_value=1, max_value=500, required=False, default=None)
+    @option("inactividad", int, description="Minutos sin música antes de desconectar.", min_value=1, max_value=60, required=False, default=None)
+    async def musicconfig(self, ctx, limite_cola: int = None, limite_pedido: int = None, inactividad: int = None):
+        server_id = str(ctx.guild.id)
+        changes = {}
+        if limite_cola is not None:
+            changes["max_queue"] = limite_cola
+        if limite_pedido is not None:
+            changes["max_request"] = limite_pedido
+        if inactividad is not None:
+            changes["idle_timeout"] = inactividad * 60
+
+        settings = self.guild_settings.get(server_id)
+        if changes:
+            settings = self.guild_settings.update(server_id, **changes)
+            self.save_guild_settings(server_id, settings)
+            if "idle_timeout" in changes and server_id in self.disconnect_timer and ctx.voice_client:
+                # Un temporizador en marcha se reinicia con el nuevo plazo.
+                await self.start_disconnect_timer(server_id, ctx.voice_client.channel.id)
+
+        header = "⚙️ Ajustes actualizados" if changes else "⚙️ Ajustes de música"
+        await ctx.respond(
+            f"{header}\n"
+            f"- volumen: **{round(settings.volume * 100)}%**\n"
+            f"- límite de cola: **{settings.max_queue}** canciones\n"
+            f"- límite por /play: **{settings.max_request}** canciones\n"
+            f"- desconexión por inactividad: **{settings.idle_timeout // 60}** minutos",
+            ephemeral=True,
+        )
+
     @discord.slash_command(description="Reinicia la canción actual.")
     async def replay(self, ctx):
         server_id = str(ctx.guild.id)
@@ -776,7 +3917,8 @@ class Musica(commands.Cog):
             return await ctx.respond("🚫 No estoy conectado.", ephemeral=False)
 
         current = self.current_song[server_id]
-        self.get_queue(server_id).insert(0, current)
+        self.get_queue(server_id).appendleft(current)
+        self.refresh_prefetch(server_id)
         vc.stop()
         await ctx.respond(f"🔄 Reiniciando: **{self.song_label(current)}**", ephemeral=False)
 
@@ -801,37 +3943,42 @@ class Musica(commands.Cog):
         if seconds < 0:
             return await ctx.respond("⚠️ El tiempo no puede ser negativo.", ephemeral=False)
 
-        duration = current.get("duration") or 0
+        duration = current.duration
         if duration and seconds >= duration:
             return await ctx.respond(
                 f"⚠️ El tiempo solicitado ({format_duration(seconds)}) excede la duración ({format_duration(duration)}).",
                 ephemeral=False,
             )
 
-        source_query = current.get("webpage_url") or current.get("url")
+        source_query = current.webpage_url
         if not source_query:
             return await ctx.respond("⚠️ No se encontró URL de origen para la canción actual.", ephemeral=False)
 
         try:
-            fresh_info = await self.resolve_stream_with_retry(source_query, retries=2)
+            local_path = self.local_audio_path(source_query)
+            if local_path:
+                fresh_info = {"url": local_path, "acodec": "opus"}
+                before_options = f"-ss {seconds} {LOCAL_FFMPEG_BEFORE_OPTIONS}"
+            else:
+                fresh_info = await self.resolve_stream_with_retry(
+                    source_query, retries=2, priority=PRIORITY_SEEK, guild_id=server_id
+                )
+                before_options = f"-ss {seconds} {FFMPEG_OPTIONS['before_options']}"
             url_stream = fresh_info.get("url")
             if not url_stream:
                 return await ctx.respond("⚠️ No se pudo resolver el stream para hacer seek.", ephemeral=False)
 
-            seek_options = {
-                "before_options": f"-ss {seconds} {FFMPEG_OPTIONS['before_options']}",
-                "options": FFMPEG_OPTIONS["options"],
-            }
-            new_source = discord.FFmpegPCMAudio(url_stream, executable=FFMPEG_EXECUTABLE, **seek_options)
-            new_source = discord.PCMVolumeTransformer(new_source, volume=self.default_volume)
+            new_source = self.create_audio_source(
+                server_id,
+                url_stream,
+                before_options=before_options,
+                codec=fresh_info.get("acodec"),
+            )
 
             # Reemplazar reproducción actual sin alterar la cola.
             vc.stop()
 
-            def next_song(error):
-                self.bot.loop.create_task(self.on_song_end(server_id, error))
-
-            vc.play(new_source, after=next_song)
+            vc.play(new_source, after=self.after_playback(server_id))
 
             await ctx.respond(
                 f"⏩ Saltando **{self.song_label(current)}** a `{format_duration(seconds)}`.",
@@ -841,32 +3988,201 @@ class Musica(commands.Cog):
             log.error(f"Error en /seek para {self.song_label(current)}: {e}", exc_info=True)
             await ctx.respond("⚠️ No se pudo realizar seek en la canción actual.", ephemeral=False)
 
+    @discord.slash_command(description="(MOD) Consulta o purga la caché Spotify → YouTube.")
+    @discord.default_permissions(administrator=True)
+    @option("accion", str, description="Qué hacer con la caché.", choices=["estadisticas", "ver", "purgar"])
+    @option("clave", str, description="ID/enlace de track Spotify o ISRC (vacío en purgar = todo).", required=False, default=None)
+    async def spotifycache(self, ctx, accion: str, clave: str = None):
+        if not self.spotify_matches:
+            return await ctx.respond("⚠️ La caché de Spotify no está disponible.", ephemeral=True)
+
+        if clave and "spotify.com" in clave:
+            clave = parse_spotify_url(clave)[1] or clave
+
+        try:
+            if accion == "estadisticas":
+                summary = await self.db_call(self.spotify_matches.describe)
+                return await ctx.respond(f"🗂️ Caché Spotify: `{summary}`", ephemeral=True)
+
+            if accion == "ver":
+                if not clave:
+                    return await ctx.respond("⚠️ Indica un ID de track o ISRC.", ephemeral=True)
+                rows = await self.db_call(self.spotify_matches.inspect, clave)
+                if not rows:
+                    return await ctx.respond(f"📭 Sin entradas para `{clave}`.", ephemeral=True)
+                lines = [
+                    f"- `{row['track_id']}` (ISRC `{row['isrc'] or '-'}`) → {row['webpage_url']} · "
+                    f"**{row['title']}** [{format_duration(row['duration'])}] · "
+                    f"guardado <t:{int(row['created_at'])}:R>, usado <t:{int(row['last_used'])}:R>"
+                    for row in rows
+                ]
+                return await ctx.respond("\n".join(lines), ephemeral=True)
+
+            removed = await self.db_call(self.spotify_matches.purge, clave)
+            target = f"para `{clave}`" if clave else "en total"
+            await ctx.respond(f"🗑️ Eliminadas **{removed}** entradas {target}.", ephemeral=True)
+        except Exception as e:
+            log.error(f"Error en /spotifycache: {e}", exc_info=True)
+            await ctx.respond("⚠️ No se pudo consultar la caché de Spotify.", ephemeral=True)
+
+    @discord.slash_command(description="(MOD) Consulta, verifica o vacía la caché de audio en disco.")
+    @discord.default_permissions(administrator=True)
+    @option("accion", str, description="Qué hacer con la caché.", choices=["estadisticas", "verificar", "purgar"])
+    async def audiocache(self, ctx, accion: str):
+        if not self.audio_cache:
+            return await ctx.respond(
+                "⚠️ La caché de audio está desactivada (`MUSIC_AUDIO_CACHE_MB`).", ephemeral=True
+            )
+
+        try:
+            if accion == "estadisticas":
+                pending = f" · {len(self.audio_downloads)} descargas pendientes" if self.audio_downloads else ""
+                return await ctx.respond(f"💽 Caché de audio: `{self.audio_cache.describe()}`{pending}", ephemeral=True)
+
+            if accion == "verificar":
+                # Leer todos los archivos puede tardar: se responde al terminar.
+                await ctx.defer(ephemeral=True)
+                checked, broken = await self.db_call(self.audio_cache.verify)
+                return await ctx.followup.send(
+                    f"🔍 Comprobadas **{checked}** pistas: **{broken}** dañadas y eliminadas.", ephemeral=True
+                )
+
+            removed = await self.db_call(self.audio_cache.purge)
+            await ctx.respond(f"🗑️ Eliminadas **{removed}** pistas de la caché de audio.", ephemeral=True)
+        except Exception as e:
+            log.error(f"Error en /audiocache: {e}", exc_info=True)
+            await ctx.respond("⚠️ No se pudo consultar la caché de audio.", ephemeral=True)
+
+    async def ffmpeg_version(self):
+        # La versión no cambia en vida del proceso: se consulta una vez y fuera del event loop.
+        if self.ffmpeg_version_text is None:
+            self.ffmpeg_version_text = "desconocida"
+            if FFMPEG_EXECUTABLE:
+                proc = None
+                try:
+                    proc = await asyncio.create_subprocess_exec(
+                        FFMPEG_EXECUTABLE, "-version", stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+                    )
+                    stdout, _ = await asyncio.wait_for(proc.communicate(), timeout=5)
+                    first = stdout.decode(errors="replace").splitlines()
+                    if first:
+                        self.ffmpeg_version_text = first[0]
+                except Exception:
+                    if proc and proc.returncode is None:
+                        proc.kill()
+        return self.ffmpeg_version_text
+
     @discord.slash_command(description="(MOD) Diagnóstico operativo del módulo de música.")
     @discord.default_permissions(administrator=True)
-    async def musicdiag(self, ctx):
+    @option(
+        "seccion",
+        str,
+        description="Qué mostrar.",
+        choices=["general", "latencias", "bloqueos"],
+        required=False,
+        default="general",
+    )
+    async def musicdiag(self, ctx, seccion: str = "general"):
+        if seccion == "latencias":
+            # Discord corta en 2000 caracteres: las ventanas se recortan antes que las últimas operaciones.
+            stats_txt = self.phase_stats.describe()
+            if len(stats_txt) > 1200:
+                stats_txt = stats_txt[:1200] + "\n…"
+            recent_txt = self.phase_stats.describe_guild(ctx.guild.id)[:600]
+            msg = (
+                f"⏱️ Latencias por fase\n```{stats_txt}```\n"
+                f"Últimas operaciones en este servidor:\n```{recent_txt}```"
+            )
+            return await ctx.respond(msg, ephemeral=True)
+
+        if seccion == "bloqueos":
+            incidents = list(self.loop_lag.incidents)
+            if not incidents:
+                return await ctx.respond(
+                    f"🧊 Sin bloqueos del event loop por encima de {self.loop_lag.threshold * 1000:.0f}ms.", ephemeral=True
+                )
+            lines = []
+            for incident in reversed(incidents):
+                lag = f"{incident['lag'] * 1000:.0f}ms" if incident["lag"] is not None else "en curso"
+                lines.append(f"- <t:{int(incident['at'])}:R> · {lag} · `{incident['where']}`")
+            latest = incidents[-1]["stack"][-1200:]
+            msg = (
+                f"🧊 Bloqueos del event loop ({self.loop_lag.describe()})\n"
+                + "\n".join(lines)
+                + f"\nPila del último:\n```{latest}```"
+            )
+            return await ctx.respond(msg[:2000], ephemeral=True)
+
         ffmpeg_path = FFMPEG_EXECUTABLE or "no encontrado"
-        ffmpeg_ver = "desconocida"
-        if ffmpeg_path != "no encontrado":
-            try:
-                proc = subprocess.run([ffmpeg_path, "-version"], capture_output=True, text=True, timeout=5)
-                first = (proc.stdout or "").splitlines()
-                if first:
-                    ffmpeg_ver = first[0]
-            except Exception:
-                pass
+        ffmpeg_ver = await self.ffmpeg_version()
 
         server_id = str(ctx.guild.id)
         queue_len = len(self.get_queue(server_id))
+        hedge_mode = "con cobertura" if self.hedged_resolve else "secuencial"
+        profiles_txt = "".join(
+            f"  - `{self.profile_stats[profile].describe()}`\n" for profile in self.stream_profile_order()
+        )
+        spotify_cache = "desactivada"
+        if self.spotify_matches:
+            try:
+                spotify_cache = await self.db_call(self.spotify_matches.describe)
+            except Exception as e:
+                spotify_cache = f"error: {e}"
+        saved_state = "desactivado"
+        if self.state_store:
+            try:
+                saved_state = await self.db_call(self.state_store.describe)
+            except Exception as e:
+                saved_state = f"error: {e}"
         msg = (
             f"🩺 Diagnóstico música\n"
             f"- yt-dlp: `{yt_dlp.version.__version__}`\n"
             f"- ffmpeg: `{ffmpeg_path}`\n"
             f"- ffmpeg version: `{ffmpeg_ver}`\n"
+            f"- modo de reproducción: `{PLAYBACK_MODE}`\n"
             f"- canciones en cola: `{queue_len}`\n"
-            f"- volumen por defecto: `{int(self.default_volume * 100)}%`"
+            f"- volumen del servidor: `{round(self.guild_settings.get(ctx.guild.id).volume * 100)}%`\n"
+            f"- ajustes por servidor: `{self.guild_settings.describe()}`\n"
+            f"- caché de streams: `{self.stream_cache.describe()}`\n"
+            f"- caché Spotify → YouTube: `{spotify_cache}`\n"
+            f"- caché de búsquedas: `{self.search_cache.describe()}`\n"
+            f"- caché de audio: `{self.audio_cache.describe() if self.audio_cache else 'desactivada'}`\n"
+            f"- estado guardado: `{saved_state}`\n"
+            f"- extracciones: `{self.extractions.describe()}`\n"
+            f"- circuito del extractor: `{self.extractor_breaker.describe()}`\n"
+            f"- vídeos fallidos recordados: `{self.failed_streams.describe()}`\n"
+            f"- perfiles de stream ({hedge_mode}):\n{profiles_txt}"
+            f"- lag del event loop: `{self.loop_lag.describe()}`\n"
+            f"- instancias yt-dlp: `{ytdl_pool.created}` ({len(YTDL_PROFILES)} perfiles por hilo)\n"
+            f"- planificador yt-dlp: ```{self.extraction_scheduler.describe()}```"
         )
         await ctx.respond(msg, ephemeral=True)
 
 
+# Clases cuyas instancias o excepciones cruzan una recarga en caliente.
+HANDOFF_CLASSES = (
+    "Song", "YtdlPool", "NoStreamFound", "KnownBadVideo", "ExtractorUnavailable", "TTLCache", "SingleFlight",
+    "LatencyWindow", "ProfileStats", "Histogram", "LoopLagMonitor", "PhaseSpan", "PhaseStats", "CircuitBreaker",
+    "ExtractionQueueTimeout", "ExtractionJob", "ExtractionScheduler", "SongQueue", "MusicDatabase",
+    "SpotifyMatchCache", "SearchCache", "QueueStateStore", "GuildSettings", "GuildSettingsStore", "CachedAudio",
+    "AudioCache",
+)
+
+
+def handoff_fingerprint():
+    """Huella del código de HANDOFF_CLASSES y de los atributos traspasados; None si no se puede leer el fuente."""
+    digest = hashlib.sha1(repr(Musica.HANDOFF_ATTRS).encode())
+    try:
+        for name in HANDOFF_CLASSES:
+            digest.update(inspect.getsource(globals()[name]).encode())
+    except (OSError, TypeError):
+        return None
+    return digest.hexdigest()
+
+
+# Se calcula al importar, antes de que una recarga en caliente sustituya las clases por las del módulo anterior.
+HANDOFF_FINGERPRINT = handoff_fingerprint()
+
+
 def setup(bot):
     bot.add_cog(Musica(bot))
@@ -0,0 +1,35 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from cogs import musica  # noqa: E402
+
+
+class FakeBot:
+    def __init__(self, loop):
+        self.loop = loop
+
+    def get_cog(self, name):
+        return None
+
+
+@pytest.fixture
+def cog_factory(tmp_path, monkeypatch):
+    monkeypatch.setenv("MUSIC_DATA_DIR", str(tmp_path))
+    monkeypatch.setenv("MUSIC_HEDGED_RESOLVE", "0")
+    cogs = []
+
+    def make(factory=None):
+        if factory:
+            monkeypatch.setattr(musica, "ytdl_pool", musica.YtdlPool(musica.YTDL_PROFILES, factory=factory))
+        cog = musica.Musica(FakeBot(asyncio.get_running_loop()))
+        cogs.append(cog)
+        return cog
+
+    yield make
+    for cog in cogs:
+        cog.cog_unload()
@@ -0,0 +1,41 @@
+"""Caché de audio: la limpieza al arrancar solo borra archivos propios."""
+import hashlib
+import os
+
+from cogs import musica
+
+
+def test_load_keeps_foreign_files_in_shared_directory(tmp_path):
+    db = musica.MusicDatabase(str(tmp_path / "musica.sqlite3"))
+    (tmp_path / "commands.sha256").write_text("abc")
+    orphan = hashlib.sha1(b"https://www.youtube.com/watch?v=x").hexdigest()
+    (tmp_path / f"{orphan}.part").write_bytes(b"partial")
+    (tmp_path / f"{orphan}.opus").write_bytes(b"unindexed")
+    (tmp_path / "notas.opus").write_bytes(b"del operador")
+    try:
+        cache = musica.AudioCache(db, str(tmp_path), 10 * 1024 * 1024, 2, 900)
+        assert cache.load() == 0
+        remaining = set(os.listdir(tmp_path))
+        assert {"musica.sqlite3", "commands.sha256", "notas.opus"} <= remaining
+        assert f"{orphan}.part" not in remaining and f"{orphan}.opus" not in remaining
+    finally:
+        db.close()
+
+
+def test_store_and_reload_index(tmp_path):
+    db = musica.MusicDatabase(str(tmp_path / "musica.sqlite3"))
+    try:
+        cache = musica.AudioCache(db, str(tmp_path / "audio"), 1024, 2, 900)
+        url = "https://www.youtube.com/watch?v=y"
+        assert cache.record_play(url) == 1
+        assert cache.record_play(url) == 2 and cache.wants(url, 2, 120)
+        part = cache.part_path(url)
+        with open(part, "wb") as f:
+            f.write(b"o" * 100)
+        entry = cache.store(url, part, 120)
+        assert cache.lookup(url) == cache.path(entry.filename)
+
+        reloaded = musica.AudioCache(db, str(tmp_path / "audio"), 1024, 2, 900)
+        assert reloaded.load() == 1 and reloaded.total_bytes == 100
+    finally:
+        db.close()
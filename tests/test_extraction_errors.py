@@ -0,0 +1,104 @@
+"""Vídeos rotos: van a la caché negativa y no cuentan como caída del extractor."""
+import asyncio
+
+import pytest
+import yt_dlp
+from yt_dlp.extractor.common import InfoExtractor
+from yt_dlp.utils import ExtractorError
+
+from cogs import musica
+
+
+class PrivateVideoIE(InfoExtractor):
+    _VALID_URL = r"https://private\.test/(?P<id>\w+)"
+    IE_NAME = "privatetest"
+
+    def _real_extract(self, url):
+        raise ExtractorError("Private video. Sign in if you've been granted access to this video", expected=True)
+
+
+def real_youtubedl(params):
+    ydl = yt_dlp.YoutubeDL(params, auto_init=False)
+    ydl.add_info_extractor(PrivateVideoIE())
+    return ydl
+
+
+class EmptyYoutubeDL:
+    """Devuelve None o un resultado sin URL, como yt-dlp con ignoreerrors activo."""
+
+    def __init__(self, params):
+        self.params = params
+
+    def extract_info(self, url, download=False):
+        return None if url.endswith("0") else {"title": "sin stream"}
+
+
+def test_stream_profiles_raise_instead_of_ignoring_errors():
+    for profile in musica.STREAM_PROFILES:
+        assert musica.YTDL_PROFILES[profile]["ignoreerrors"] is False
+
+
+def test_private_videos_are_cached_and_do_not_trip_the_breaker(cog_factory):
+    async def run():
+        cog = cog_factory(real_youtubedl)
+        threshold = cog.extractor_breaker.threshold
+        for index in range(threshold + 2):
+            url = f"https://private.test/v{index}"
+            with pytest.raises(musica.KnownBadVideo) as excinfo:
+                await cog.resolve_stream_with_retry(url)
+            assert excinfo.value.reason == "private"
+            assert cog.failed_streams.peek(url)["reason"] == "private"
+
+        assert cog.extractor_breaker.state == musica.CircuitBreaker.CLOSED
+        cog.check_breaker()
+
+        # La segunda petición no vuelve a extraer: sale de la caché negativa.
+        submitted = sum(cog.extraction_scheduler.submitted.values())
+        with pytest.raises(musica.KnownBadVideo):
+            await cog.resolve_stream_with_retry("https://private.test/v0")
+        assert sum(cog.extraction_scheduler.submitted.values()) == submitted
+
+    asyncio.run(run())
+
+
+def test_empty_results_are_video_failures(cog_factory):
+    async def run():
+        cog = cog_factory(EmptyYoutubeDL)
+        for index in range(cog.extractor_breaker.threshold + 2):
+            url = f"https://empty.test/v{index}"
+            with pytest.raises(musica.KnownBadVideo) as excinfo:
+                await cog.resolve_stream_with_retry(url)
+            assert excinfo.value.reason == "no_stream"
+            assert url in cog.failed_streams.entries
+
+        assert cog.extractor_breaker.state == musica.CircuitBreaker.CLOSED
+
+    asyncio.run(run())
+
+
+def test_empty_result_is_classified_as_no_stream():
+    assert musica.classify_extraction_error(musica.NoStreamFound("sin url")) == "no_stream"
+    assert musica.classify_extraction_error(ValueError("otra cosa")) is None
+
+
+def test_classified_error_does_not_launch_the_backup_profile(cog_factory):
+    calls = []
+
+    def counting_youtubedl(params):
+        ydl = real_youtubedl(params)
+        extract = ydl.extract_info
+
+        def extract_info(url, download=False):
+            calls.append(url)
+            return extract(url, download=download)
+
+        ydl.extract_info = extract_info
+        return ydl
+
+    async def run():
+        cog = cog_factory(counting_youtubedl)
+        with pytest.raises(musica.KnownBadVideo):
+            await cog.resolve_stream_with_retry("https://private.test/solo")
+        assert calls == ["https://private.test/solo"]
+
+    asyncio.run(run())
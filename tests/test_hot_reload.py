@@ -0,0 +1,66 @@
+"""/reload: traspaso en caliente con la misma huella de código y recarga en frío si cambió."""
+import asyncio
+
+from conftest import FakeBot
+
+from cogs import musica
+
+
+def song(n):
+    return musica.Song(f"https://www.youtube.com/watch?v={n}", f"Canción {n}", 100, 1)
+
+
+def reload(previous, tamper=None):
+    bot = previous.bot
+    bot.hot_reload = True
+    previous.cog_unload()
+    if tamper:
+        tamper(bot.musica_handoff)
+    try:
+        return musica.Musica(bot)
+    finally:
+        bot.hot_reload = False
+
+
+def test_hot_reload_reuses_resources(tmp_path, monkeypatch):
+    monkeypatch.setenv("MUSIC_DATA_DIR", str(tmp_path))
+
+    async def run():
+        old = musica.Musica(FakeBot(asyncio.get_running_loop()))
+        old.get_queue("1").append(song("a"))
+        new = reload(old)
+        try:
+            assert new.db is old.db
+            assert new.extraction_scheduler is old.extraction_scheduler
+            assert new.search_cache is old.search_cache
+            assert new.get_queue("1") is old.get_queue("1")
+            assert new.bot.hot_reload_result.startswith("en caliente")
+        finally:
+            new.cog_unload()
+
+    asyncio.run(run())
+
+
+def test_changed_code_falls_back_to_cold_reload(tmp_path, monkeypatch):
+    monkeypatch.setenv("MUSIC_DATA_DIR", str(tmp_path))
+
+    async def run():
+        old = musica.Musica(FakeBot(asyncio.get_running_loop()))
+        await old.restore_guild_state(1)
+        old.current_song["1"] = song("actual")
+        old.get_queue("1").append(song("a"))
+        new = reload(old, tamper=lambda handoff: handoff.update(fingerprint="otra versión"))
+        try:
+            assert new.db is not old.db
+            assert new.extraction_scheduler is not old.extraction_scheduler
+            assert old.extraction_scheduler.executor._shutdown
+            assert new.bot.musica_handoff is None
+            assert new.bot.hot_reload_result.startswith("en frío")
+            assert not new.queues
+
+            await new.restore_guild_state(1)
+            assert new.restored_queues["1"] == [song("actual"), song("a")]
+        finally:
+            new.cog_unload()
+
+    asyncio.run(run())
@@ -0,0 +1,37 @@
+"""Importación en segundo plano: si el bot sale del canal de voz, termina sin cancelarse."""
+import asyncio
+from types import SimpleNamespace
+
+from cogs import musica
+
+
+class Followup:
+    def __init__(self):
+        self.messages = []
+
+    async def edit_message(self, message_id, content):
+        self.messages.append(content)
+
+
+def test_import_stops_when_voice_client_is_gone(cog_factory):
+    async def run():
+        cog = cog_factory()
+        cog.bot.get_guild = lambda guild_id: SimpleNamespace(voice_client=None)
+        resolved = []
+
+        async def resolve_play_item(item, **kwargs):
+            resolved.append(item)
+            return [musica.Song(f"https://www.youtube.com/watch?v={item}", item, 100, 1)], None
+
+        cog.resolve_play_item = resolve_play_item
+        cog.import_concurrency = 1
+        ctx = SimpleNamespace(
+            channel=SimpleNamespace(id=1), author=SimpleNamespace(id=2), followup=Followup()
+        )
+        await cog.run_import(ctx, "1", ["a", "b", "c"], added=[], total=3, max_songs=10, playlist_title="Lista")
+
+        assert resolved == ["a"]
+        assert len(cog.get_queue("1")) == 0
+        assert "detenida" in ctx.followup.messages[-1] and "0 canciones" in ctx.followup.messages[-1]
+
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+"""Cachés persistentes en SQLite: escrituras agrupadas y recorte solo al pasar del límite."""
+from cogs import musica
+
+
+def statements_counter(db):
+    calls = []
+    original = db.run_batch
+
+    def run_batch(statements):
+        calls.append(list(statements))
+        original(statements)
+
+    db.run_batch = run_batch
+    return calls
+
+
+def test_spotify_hits_are_written_in_batches(tmp_path):
+    db = musica.MusicDatabase(str(tmp_path / "musica.sqlite3"))
+    try:
+        cache = musica.SpotifyMatchCache(db, 100, 3600)
+        cache.put("track", None, "https://www.youtube.com/watch?v=a", "A", 100)
+        calls = statements_counter(db)
+        for _ in range(cache.TOUCH_BATCH - 1):
+            assert cache.get("track")["webpage_url"].endswith("v=a")
+        assert calls == []
+        cache.flush_touched()
+        assert len(calls) == 1 and len(calls[0]) == 1
+    finally:
+        db.close()
+
+
+def test_spotify_evicts_only_over_the_cap(tmp_path):
+    db = musica.MusicDatabase(str(tmp_path / "musica.sqlite3"))
+    try:
+        cache = musica.SpotifyMatchCache(db, 10, 3600)
+        for i in range(10):
+            cache.put(f"t{i}", None, f"https://www.youtube.com/watch?v={i}", str(i), 100)
+        assert cache.count() == 10
+        cache.put("t10", None, "https://www.youtube.com/watch?v=10", "10", 100)
+        assert cache.count() == 9
+        assert cache.get("t10") is not None
+    finally:
+        db.close()
+
+
+def test_search_restore_keeps_newer_entries(tmp_path):
+    db = musica.MusicDatabase(str(tmp_path / "musica.sqlite3"))
+    try:
+        previous = musica.SearchCache(3, 3600, db=db)
+        for query in ("a", "b", "c"):
+            previous.persist(query, {"webpage_url": f"https://www.youtube.com/watch?v={query}", "duration": 60})
+
+        cache = musica.SearchCache(3, 3600, db=db)
+        fresh = {"webpage_url": "https://www.youtube.com/watch?v=nuevo", "duration": 60}
+        cache.put("a", fresh)
+        rows = cache.load()
+        assert len(rows) == 3
+        assert cache.restore(rows) == 2
+        assert cache.get("a") == fresh and cache.get("b") and cache.get("c")
+    finally:
+        db.close()
+
+
+def test_search_persist_evicts_only_over_the_cap(tmp_path):
+    db = musica.MusicDatabase(str(tmp_path / "musica.sqlite3"))
+    try:
+        cache = musica.SearchCache(10, 3600, db=db)
+        count = lambda: db.query("SELECT COUNT(*) AS n FROM search_cache")[0]["n"]
+        for i in range(10):
+            cache.persist(f"q{i}", {"webpage_url": f"https://www.youtube.com/watch?v={i}"})
+        assert count() == 10
+        cache.persist("q10", {"webpage_url": "https://www.youtube.com/watch?v=10"})
+        assert count() == 9
+    finally:
+        db.close()
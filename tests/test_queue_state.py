@@ -0,0 +1,59 @@
+"""Cola guardada tras un reinicio: queda aparte hasta /resume."""
+import asyncio
+
+from cogs import musica
+
+
+def song(n):
+    return musica.Song(f"https://www.youtube.com/watch?v={n}", f"Canción {n}", 100, 1)
+
+
+def test_restored_queue_stays_pending_and_is_kept_on_disk(cog_factory):
+    async def run():
+        cog = cog_factory()
+        cog.state_store.save_many([("1", song("actual"), [song("a"), song("b")])])
+
+        await cog.restore_guild_state(1)
+        assert len(cog.get_queue("1")) == 0
+        assert cog.restored_queues["1"] == [song("actual"), song("a"), song("b")]
+        assert "/resume" in cog.restored_queue_hint("1")
+
+        # Un /play sobre la cola vacía no pierde la guardada en la siguiente escritura.
+        cog.get_queue("1").append(song("nueva"))
+        cog.state_store.save_many(cog.collect_state_changes())
+        state = cog.state_store.load("1")
+        assert [s.webpage_url for s in state["queue"]] == [
+            song(n).webpage_url for n in ("nueva", "actual", "a", "b")
+        ]
+
+    asyncio.run(run())
+
+
+class MetadataYoutubeDL:
+    calls = []
+
+    def __init__(self, params):
+        self.params = params
+
+    def extract_info(self, url, download=False, process=True):
+        self.calls.append((url, process))
+        return {"title": f"Título de {url[-1]}", "duration": 200}
+
+
+def test_metadata_fill_skips_stream_cache_and_removed_songs(cog_factory):
+    async def run():
+        MetadataYoutubeDL.calls = []
+        cog = cog_factory(MetadataYoutubeDL)
+        flat = [musica.Song(f"https://www.youtube.com/watch?v={n}", "Desconocido", 0, 1) for n in "abc"]
+        complete = musica.Song("https://www.youtube.com/watch?v=d", "Conocida", 90, 1)
+        queue = cog.get_queue("1")
+        queue.extend(flat + [complete])
+        queue.remove_ranges([(1, 1)])
+
+        await cog.fill_missing_metadata("1", flat + [complete])
+        assert MetadataYoutubeDL.calls == [(flat[0].webpage_url, False), (flat[2].webpage_url, False)]
+        assert [s.titulo for s in queue] == ["Título de a", "Título de c", "Conocida"]
+        assert queue.total_duration == 490
+        assert len(cog.stream_cache) == 0
+
+    asyncio.run(run())
@@ -0,0 +1,101 @@
+"""/remove: rangos patológicos y coherencia de SongQueue tras quitar canciones."""
+import random
+import time
+
+import pytest
+
+from cogs import musica
+
+
+def parse(length, text):
+    # El método no usa estado del cog.
+    return musica.Musica.parse_removal_ranges(None, length, text)
+
+
+def make_queue(count):
+    return musica.SongQueue(
+        musica.Song(f"https://www.youtube.com/watch?v={index}", f"tema {index}", index + 1, 1)
+        for index in range(count)
+    )
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("3", [[2, 2]]),
+        ("2-4", [[1, 3]]),
+        ("1,3", [[0, 0], [2, 2]]),
+        (" 2 - 3 , 5 ", [[1, 2], [4, 4]]),
+    ],
+)
+def test_simple_input(text, expected):
+    assert parse(10, text) == expected
+
+
+def test_huge_ranges_are_clamped_without_expanding():
+    started = time.perf_counter()
+    assert parse(10, "1-" + "9" * 21) == [[0, 9]]
+    assert parse(10, "5-1000000000000") == [[4, 9]]
+    assert parse(10, "1000000000000") == []
+    assert parse(10, ",".join(["1-1000000000"] * 5000)) == [[0, 9]]
+    assert time.perf_counter() - started < 1
+
+
+@pytest.mark.parametrize("text", ["5-2", "10-1", "3-2,9-8"])
+def test_reversed_ranges_are_ignored(text):
+    assert parse(10, text) == []
+
+
+@pytest.mark.parametrize("text", ["-3", "0", "-5--1", "0-0"])
+def test_negative_and_zero_positions_remove_nothing(text):
+    assert parse(10, text) == []
+
+
+def test_ranges_starting_below_one_are_clamped():
+    assert parse(10, "0-2") == [[0, 1]]
+
+
+@pytest.mark.parametrize("text", ["", ",,,", "abc", "1-2-3", "1.5", "uno-dos", "--", "1-", "-"])
+def test_malformed_parts_are_skipped(text):
+    assert parse(10, text) == []
+
+
+def test_malformed_parts_do_not_discard_valid_ones():
+    assert parse(10, "x,2,1-2-3,4-5,?") == [[1, 1], [3, 4]]
+
+
+def test_overlapping_and_adjacent_ranges_are_merged():
+    assert parse(20, "1-5,3-8,9,12-14,14-15,20") == [[0, 8], [11, 14], [19, 19]]
+    assert parse(20, "5,4,3,2,1") == [[0, 4]]
+
+
+def test_empty_queue():
+    assert parse(0, "1-5") == []
+
+
+def test_remove_ranges_keeps_total_duration_consistent():
+    rng = random.Random(7)
+    for _ in range(200):
+        length = rng.randrange(0, 40)
+        queue = make_queue(length)
+        parts = [f"{rng.randrange(-5, 50)}-{rng.randrange(-5, 50)}" for _ in range(rng.randrange(1, 6))]
+        parts += [str(rng.randrange(-5, 50)) for _ in range(rng.randrange(0, 4))]
+        ranges = parse(length, ",".join(parts))
+
+        expected_removed = {index for start, end in ranges for index in range(start, end + 1)}
+        before = list(queue)
+        version = queue.version
+        removed = queue.remove_ranges(ranges)
+
+        assert removed == [song for index, song in enumerate(before) if index in expected_removed]
+        assert list(queue) == [song for index, song in enumerate(before) if index not in expected_removed]
+        assert queue.total_duration == sum(song.duration for song in queue)
+        assert queue.version > version or not ranges
+
+
+def test_remove_everything_then_reuse_queue():
+    queue = make_queue(5)
+    assert len(queue.remove_ranges(parse(5, "1-99"))) == 5
+    assert len(queue) == 0 and queue.total_duration == 0
+    queue.append(musica.Song("https://www.youtube.com/watch?v=x", "x", 30, 1))
+    assert queue.total_duration == 30
@@ -0,0 +1,58 @@
+"""ExtractionScheduler: timeout desde que se encola y promoción de todos los trabajos de una clave."""
+import asyncio
+import threading
+
+import pytest
+
+from cogs import musica
+
+
+def test_timeout_includes_time_waiting_for_a_thread():
+    async def run():
+        scheduler = musica.ExtractionScheduler(1)
+        gate = threading.Event()
+        try:
+            busy = asyncio.ensure_future(scheduler.run(gate.wait, priority=musica.PRIORITY_BULK))
+            await asyncio.sleep(0.05)
+            with pytest.raises(musica.ExtractionQueueTimeout):
+                await scheduler.run(lambda: "nunca", priority=musica.PRIORITY_PLAYBACK, timeout=0.2)
+            # El trabajo expirado sale de la cola y no ocupa el hilo cuando quede libre.
+            assert scheduler.queue_depth() == 0
+            assert scheduler.timeouts == 1
+        finally:
+            gate.set()
+            await busy
+            scheduler.shutdown()
+
+    asyncio.run(run())
+
+
+def test_promote_moves_every_job_with_the_key():
+    async def run():
+        scheduler = musica.ExtractionScheduler(1)
+        gate = threading.Event()
+        order = []
+        try:
+            busy = asyncio.ensure_future(scheduler.run(gate.wait, priority=musica.PRIORITY_BULK))
+            await asyncio.sleep(0.05)
+            key = ("stream", "x")
+            jobs = [
+                asyncio.ensure_future(scheduler.run(lambda: order.append("search"), priority=musica.PRIORITY_SEARCH)),
+                asyncio.ensure_future(
+                    scheduler.run(lambda: order.append("primary"), priority=musica.PRIORITY_PREFETCH, key=key)
+                ),
+                asyncio.ensure_future(
+                    scheduler.run(lambda: order.append("fallback"), priority=musica.PRIORITY_PREFETCH, key=key)
+                ),
+            ]
+            await asyncio.sleep(0)
+            assert scheduler.promote(key, musica.PRIORITY_PLAYBACK)
+            assert scheduler.queue_depth(musica.PRIORITY_PLAYBACK) == 2
+            gate.set()
+            await asyncio.gather(busy, *jobs)
+            assert order == ["primary", "fallback", "search"]
+        finally:
+            gate.set()
+            scheduler.shutdown()
+
+    asyncio.run(run())
@@ -0,0 +1,22 @@
+"""Enlaces de Spotify: un track sin nombre o sin artistas no llega a /play como None."""
+import asyncio
+from types import SimpleNamespace
+
+
+def test_unplayable_single_track_returns_no_items(cog_factory):
+    async def run():
+        cog = cog_factory()
+        tracks = {
+            "local": {"id": "local", "name": "Grabación", "artists": []},
+            "vacio": None,
+            "bueno": {"id": "bueno", "name": "Tema", "artists": [{"name": "Grupo"}]},
+        }
+        cog.spotify_client = SimpleNamespace(track=tracks.get)
+
+        assert (await cog.resolve_spotify_link("track", "local", 10))[1] == []
+        assert (await cog.resolve_spotify_link("track", "vacio", 10))[1] == []
+        title, items = await cog.resolve_spotify_link("track", "bueno", 10)
+        assert title == "Canción Spotify: Tema"
+        assert items == [{"query": "Grupo - Tema", "spotify_id": "bueno", "isrc": None}]
+
+    asyncio.run(run())